@@ -11,6 +11,7 @@ https://docs.djangoproject.com/en/4.2/ref/settings/
 """
 
 from pathlib import Path
+from corsheaders.defaults import default_headers
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
@@ -61,6 +62,10 @@ CORS_ALLOWED_ORIGINS = [
     "http://localhost:3000",
     "http://127.0.0.1:3000",
 ]
+# conditional GETs from the dashboard (ETag / If-None-Match), ETags are only
+# sent when CACHES is shared by all workers
+CORS_ALLOW_HEADERS = (*default_headers, "if-none-match")
+CORS_EXPOSE_HEADERS = ["ETag"]
 
 REST_FRAMEWORK = {
     "DEFAULT_PAGINATION_CLASS": "rest_framework.pagination.PageNumberPagination",
@@ -68,6 +73,108 @@ REST_FRAMEWORK = {
     "DEFAULT_DATETIME_FORMAT": "%Y-%m-%dT%H:%M:%S",
 }
 
+# alerts list page size, clients may ask for up to ALERTS_MAX_PAGE_SIZE
+# with ?page_size=
+ALERTS_PAGE_SIZE = 50
+ALERTS_MAX_PAGE_SIZE = 200
+# seconds between the alert stream's database polls, one poll per ASGI worker
+# whatever the number of connected clients
+ALERT_STREAM_POLL_INTERVAL = 1.0
+# a reconnecting stream client gets at most this many missed creations and
+# acknowledgements, older ones are left to the alerts list
+ALERT_STREAM_MAX_RESUME = 1000
+# seconds of alert creations and acknowledgements the stream reads again on
+# every poll, catches alerts whose transaction committed after a later one
+ALERT_STREAM_OVERLAP = 10.0
+# seconds today's dashboard summary is cached for, past days are cached until
+# late data for them arrives
+DASHBOARD_CACHE_TTL = 10
+# seconds past days stay cached when CACHES is per process (LocMemCache),
+# late data only invalidates the worker that ingested it. A shared cache
+# keeps them until late data arrives
+DASHBOARD_PAST_CACHE_TTL = 300
+# points per zone returned by /api/analytics/occupancy/, longer ranges get
+# wider buckets
+ANALYTICS_MAX_POINTS = 500
+# largest ?points= accepted by /api/devices/<code>/telemetry/
+TELEMETRY_SERIES_MAX_POINTS = 2000
+
+# Ingestion
+
+# max number of device_code lookups kept in each worker process
+DEVICE_REGISTRY_MAX_SIZE = 10000
+# seconds an unknown device_code stays rejected without a query, bounds how
+# long a device created by another worker is refused here
+DEVICE_REGISTRY_MISSING_TTL = 30
+# share invalidations between worker processes through the default cache,
+# only useful when CACHES points at a backend all workers can reach
+DEVICE_REGISTRY_SHARED_VERSION = False
+# keep open (device, alert_type) pairs in memory so repeated anomalies cost
+# no query. Acknowledgements reach other workers through the default cache,
+# so it is ignored unless CACHES is shared (not LocMemCache); without it
+# alert deduplication reads the open alerts of each batch's devices
+OPEN_ALERT_INDEX = False
+# seconds between batched Device.last_seen writes, 0 writes on every reading
+HEARTBEAT_FLUSH_INTERVAL = 5
+# "sync" writes readings inside the request, "spool" validates them, queues
+# them in INGEST_SPOOL_PATH and answers 202, run `manage.py drain_spool`.
+# "writer" hands single readings and parking logs to one thread per process
+# that commits up to INGEST_WRITER_MAX_BATCH requests per transaction, the
+# request answers 201 once its write is committed
+INGEST_MODE = "sync"
+INGEST_WRITER_MAX_BATCH = 200
+# seconds a request waits for the writer thread before answering 503
+INGEST_WRITER_TIMEOUT = 30.0
+INGEST_SPOOL_PATH = BASE_DIR / "spool.sqlite3"
+# largest batch accepted by /api/parking-log/bulk/
+PARKING_LOG_BULK_MAX_ITEMS = 5000
+# readings validated and written per transaction by /api/telemetry/stream/
+TELEMETRY_STREAM_CHUNK_SIZE = 1000
+# per-line errors echoed back by /api/telemetry/stream/, the rest are counted
+TELEMETRY_STREAM_MAX_ERRORS = 100
+# async ingestion views (served under ASGI) talking to the database at once,
+# per worker process
+ASYNC_DB_CONCURRENCY = 20
+# seconds before alert rules are reloaded, edits through the admin or the
+# ORM apply at once
+RULES_RELOAD_INTERVAL = 30
+# raise DEVICE_OFFLINE alerts from heartbeat deadlines inside each server
+# process, check_offline_devices is not needed when this is on
+OFFLINE_DETECTOR = True
+
+# Retention
+
+# days of readings kept in TelemetryData, `manage.py compact_telemetry` packs
+# older days into one compressed TelemetryChunk per device and day
+TELEMETRY_HOT_DAYS = 7
+# days of rows kept per table by `manage.py archive_data`, older local days
+# are exported to Parquet under ARCHIVE_PATH (needs pyarrow) and deleted;
+# None keeps a table forever. Only acknowledged alerts are archived,
+# telemetry_chunks are the days moved to the cold tier by compact_telemetry
+RETENTION_DAYS = {
+    "telemetry": 30,
+    "telemetry_chunks": 365,
+    "parking_logs": 180,
+    "alerts": 180,
+}
+ARCHIVE_PATH = BASE_DIR / "archive"
+# devices per archive file, every file holds one local day
+ARCHIVE_DEVICE_CHUNK = 100
+# archived rows deleted per transaction (at most 999, SQLite's parameter
+# limit on older builds) and seconds between transactions, so ingestion
+# gets the write lock while a purge runs
+ARCHIVE_DELETE_BATCH = 500
+ARCHIVE_DELETE_PAUSE = 0.01
+
+# the dashboard summary cache and the shared invalidation counters live here,
+# point every worker at one Redis (django.core.cache.backends.redis.RedisCache)
+# or file cache to share them between processes
+CACHES = {
+    "default": {
+        "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+    }
+}
+
 ROOT_URLCONF = "core.urls"
 
 TEMPLATES = [
@@ -92,10 +199,29 @@ WSGI_APPLICATION = "core.wsgi.application"
 # Database
 # https://docs.djangoproject.com/en/4.2/ref/settings/#databases
 
+# SQLite profile for concurrent ingestion, applied to every new connection:
+# WAL lets reads run during a write, synchronous=NORMAL only syncs the WAL at
+# checkpoints (safe in WAL mode, a power cut may lose the last commits but
+# not corrupt the file), busy_timeout makes a writer wait up to 5 seconds for
+# the lock instead of failing with "database is locked", and mmap reads pages
+# without copying. IMMEDIATE transactions take the write lock at BEGIN, so
+# they wait there instead of failing halfway. Pair it with INGEST_MODE =
+# "writer". Drop OPTIONS when switching to PostgreSQL.
+SQLITE_OPTIONS = {
+    "init_command": (
+        "PRAGMA journal_mode=WAL;"
+        "PRAGMA synchronous=NORMAL;"
+        "PRAGMA busy_timeout=5000;"
+        "PRAGMA mmap_size=268435456;"
+    ),
+    "transaction_mode": "IMMEDIATE",
+}
+
 DATABASES = {
     "default": {
         "ENGINE": "django.db.backends.sqlite3",
         "NAME": BASE_DIR / "db.sqlite3",
+        "OPTIONS": SQLITE_OPTIONS,
     }
 }
 
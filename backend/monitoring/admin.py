@@ -1,9 +1,11 @@
 from django.contrib import admin
-from .models import ParkingZone, Device, TelemetryData, ParkingLog, Alert
+from django.utils import timezone
+from .alert_index import open_alerts
+from .models import ParkingZone, Device, TelemetryData, ParkingLog, Alert, AlertRule
 
 @admin.register(ParkingZone)
 class ParkingZoneAdmin(admin.ModelAdmin):
-    list_display = ['name', 'code', 'total_slots', 'daily_target']
+    list_display = ['name', 'code', 'total_slots', 'daily_target', 'offline_timeout']
     search_fields = ['name', 'code']
 
 @admin.register(Device)
@@ -24,13 +26,23 @@ class ParkingLogAdmin(admin.ModelAdmin):
     list_filter = ['is_occupied', 'timestamp']
     search_fields = ['device__device_code']
 
+@admin.register(AlertRule)
+class AlertRuleAdmin(admin.ModelAdmin):
+    list_display = ['alert_type', 'metric', 'operator', 'threshold', 'severity', 'zone', 'device', 'is_enabled']
+    list_filter = ['alert_type', 'severity', 'is_enabled', 'zone']
+    search_fields = ['alert_type', 'device__device_code']
+
 @admin.register(Alert)
 class AlertAdmin(admin.ModelAdmin):
-    list_display = ['device', 'severity', 'alert_type', 'is_acknowledged', 'created_at']
+    list_display = ['device', 'severity', 'alert_type', 'is_acknowledged', 'created_at', 'resolved_at']
     list_filter = ['severity', 'alert_type', 'is_acknowledged']
     search_fields = ['device__device_code', 'message']
     actions = ['mark_acknowledged']
     
     def mark_acknowledged(self, request, queryset):
-        queryset.update(is_acknowledged=True)
+        queryset = queryset.filter(is_acknowledged=False)
+        # update() sends no signals, so the open alert index is told here
+        pairs = list(queryset.values_list('device_id', 'alert_type'))
+        queryset.update(is_acknowledged=True, acknowledged_at=timezone.now())
+        open_alerts.discard(pairs)
     mark_acknowledged.short_description = "Mark selected alerts as acknowledged"
\ No newline at end of file
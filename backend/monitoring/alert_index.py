@@ -0,0 +1,113 @@
+import logging
+import threading
+from django.conf import settings
+from django.db import transaction
+from .models import Alert
+from .versioning import SharedVersion, cache_is_shared
+
+logger = logging.getLogger(__name__)
+
+
+class OpenAlertIndex:
+    """In-memory set of (device_id, alert_type) pairs with an open alert.
+
+    Repeated anomalies from a device that is already alerting are dropped
+    here without a query. The set is loaded from the database on first use
+    in each process and reloaded when another process acknowledges,
+    resolves or deletes an alert, through a version counter in the default cache
+    (checked at most once a second). That only reaches other workers when
+    the cache is shared between them, so the index is only used with such
+    a backend; otherwise filter_new() reads the open pairs of the batch's
+    devices from the database. Alerts opened by other processes may be
+    missing from the index, the unique_open_alert constraint rejects those
+    inserts.
+    """
+
+    def __init__(self, enabled=True):
+        self.enabled = enabled
+        self.shared_version = SharedVersion('monitoring:open_alerts:version')
+        self._pairs = None
+        self._lock = threading.Lock()
+        # bumped on every discard, a reload that raced with one is not kept
+        self._generation = 0
+
+    @property
+    def pairs(self):
+        pairs = self._pairs
+        if pairs is None or self.shared_version.changed():
+            pairs = self.reload()
+        return pairs
+
+    def reload(self):
+        generation = self._generation
+        pairs = set(
+            Alert.objects.filter(is_acknowledged=False, resolved_at__isnull=True)
+            .order_by()
+            .values_list('device_id', 'alert_type')
+        )
+        with self._lock:
+            if generation == self._generation:
+                self._pairs = pairs
+        return pairs
+
+    def filter_new(self, alerts):
+        """Alerts whose pair is not open, at most one per pair"""
+        alerts = list(alerts)
+        if not alerts:
+            return []
+        seen = set(self.pairs) if self.enabled else self._open_pairs(alerts)
+        new_alerts = []
+        for alert in alerts:
+            key = (alert.device_id, alert.alert_type)
+            if key not in seen:
+                seen.add(key)
+                new_alerts.append(alert)
+        return new_alerts
+
+    def add(self, pairs):
+        """Mark pairs open once the surrounding transaction commits"""
+        if self.enabled:
+            pairs = list(pairs)
+            transaction.on_commit(lambda: self._add(pairs))
+
+    def discard(self, pairs):
+        """Mark pairs closed once the surrounding transaction commits"""
+        if self.enabled:
+            pairs = list(pairs)
+            transaction.on_commit(lambda: self._discard(pairs))
+
+    def _open_pairs(self, alerts):
+        return set(
+            Alert.objects.filter(
+                is_acknowledged=False,
+                resolved_at__isnull=True,
+                device_id__in={alert.device_id for alert in alerts},
+                alert_type__in={alert.alert_type for alert in alerts},
+            ).order_by().values_list('device_id', 'alert_type')
+        )
+
+    def _add(self, pairs):
+        with self._lock:
+            if self._pairs is not None:
+                self._pairs.update(pairs)
+
+    def _discard(self, pairs):
+        with self._lock:
+            self._generation += 1
+            if self._pairs is not None:
+                self._pairs.difference_update(pairs)
+        self.shared_version.bump()
+
+
+def _index_enabled():
+    if not getattr(settings, 'OPEN_ALERT_INDEX', False):
+        return False
+    if not cache_is_shared():
+        # an acknowledge in another worker would never reach this one and
+        # its pair would stay open here, dropping new alerts for good
+        logger.warning('OPEN_ALERT_INDEX needs a cache shared between workers, checking open alerts in the database.')
+        return False
+    return True
+
+
+open_alerts = OpenAlertIndex(enabled=_index_enabled())
@@ -0,0 +1,146 @@
+import math
+from collections import defaultdict
+from datetime import timedelta
+from django.db.models import F
+from django.utils import timezone
+from .models import DeviceState, ParkingZone, ZoneDailyStats, ZoneEnergyDaily, ZoneHourlyStats
+from .rollups import day_bounds
+
+# widths tried for hourly buckets before switching to days, all divide a day
+HOUR_WIDTHS = (1, 2, 3, 4, 6, 8, 12)
+
+
+def bucket_width(start_date, end_date, bucket, max_points):
+    """(bucket, width) keeping the series of start_date..end_date at or
+    under max_points, widening hours to days when needed
+    """
+    days = (end_date - start_date).days + 1
+    if bucket == 'hour':
+        for width in HOUR_WIDTHS:
+            if math.ceil(days * 24 / width) <= max_points:
+                return 'hour', width
+    return 'day', math.ceil(days / max_points)
+
+
+def occupancy_trend(start_date, end_date, bucket='hour', zone_code=None, max_points=500):
+    """Parking events and average occupancy per zone for the local days
+    start_date..end_date.
+
+    Reads the hourly rollup for hour buckets and the daily one for day
+    buckets, so the cost follows the number of zones and buckets, never the
+    number of events. Slots still occupied add their time so far from
+    DeviceState, the rollups only count periods that have ended. Buckets
+    are widened until a series has at most max_points points.
+    """
+    bucket, width = bucket_width(start_date, end_date, bucket, max_points)
+    start, end = day_bounds(start_date, end_date)
+    step = timedelta(hours=width) if bucket == 'hour' else timedelta(days=width)
+
+    zones = ParkingZone.objects.order_by('name')
+    if zone_code:
+        zones = zones.filter(code=zone_code)
+    zones = list(zones)
+    zone_ids = [zone.pk for zone in zones]
+
+    if bucket == 'hour':
+        rows = ZoneHourlyStats.objects.filter(
+            zone_id__in=zone_ids, hour__gte=start, hour__lt=end
+        ).values_list('zone_id', 'hour', 'events', 'occupied_events', 'occupied_seconds')
+    else:
+        rows = ZoneDailyStats.objects.filter(
+            zone_id__in=zone_ids, date__gte=start_date, date__lte=end_date
+        ).values_list('zone_id', 'date', 'events', 'occupied_events', 'occupied_seconds')
+
+    def index(moment):
+        if bucket == 'day':
+            moment = day_bounds(moment, moment)[0]
+        return int((moment - start) / step)
+
+    points = math.ceil((end - start) / step)
+    series = defaultdict(lambda: [[0, 0, 0.0] for _ in range(points)])
+    for zone_id, moment, events, occupied_events, occupied_seconds in rows:
+        values = series[zone_id][index(moment)]
+        values[0] += events
+        values[1] += occupied_events
+        values[2] += occupied_seconds
+
+    # periods still running, up to now
+    now = min(timezone.now(), end)
+    running = DeviceState.objects.filter(
+        device__zone__in=zone_ids,
+        is_occupied=True,
+        occupancy_changed_at__lt=now,
+    ).values_list(F('device__zone'), 'occupancy_changed_at')
+    for zone_id, since in running:
+        since = max(since, start)
+        while since < now:
+            position = int((since - start) / step)
+            until = min(now, start + step * (position + 1))
+            series[zone_id][position][2] += (until - since).total_seconds()
+            since = until
+
+    result = []
+    for zone in zones:
+        values = series[zone.pk]
+        result.append({
+            'zone_code': zone.code,
+            'zone_name': zone.name,
+            'total_slots': zone.total_slots,
+            'series': [
+                {
+                    'start': start + step * position,
+                    'events': events,
+                    'occupied_events': occupied_events,
+                    # share of slot time occupied, in percent
+                    'occupancy': round(
+                        occupied_seconds / (step.total_seconds() * zone.total_slots) * 100, 2
+                    ),
+                }
+                for position, (events, occupied_events, occupied_seconds) in enumerate(values)
+            ],
+        })
+
+    return {
+        'start': start_date,
+        'end': end_date,
+        'bucket': bucket,
+        'bucket_size': width,
+        'zones': result,
+    }
+
+
+def zone_energy(start_date, end_date, zone_code=None):
+    """Energy (kWh), peak and mean power (W) per zone and local day for
+    start_date..end_date, read from ZoneEnergyDaily: one row per zone and
+    day whatever the number of readings. Days without readings are left out.
+    """
+    zones = ParkingZone.objects.order_by('name')
+    if zone_code:
+        zones = zones.filter(code=zone_code)
+    zones = list(zones)
+
+    days = defaultdict(list)
+    for zone_id, date, energy_wh, power_sum, readings, peak_w in ZoneEnergyDaily.objects.filter(
+        zone__in=[zone.pk for zone in zones], date__gte=start_date, date__lte=end_date
+    ).order_by('date').values_list('zone_id', 'date', 'energy_wh', 'power_sum', 'readings', 'peak_w'):
+        days[zone_id].append({
+            'date': date,
+            'energy_kwh': round(energy_wh / 1000, 3),
+            'peak_w': round(peak_w, 2),
+            'mean_w': round(power_sum / readings, 2) if readings else 0.0,
+            'readings': readings,
+        })
+
+    return {
+        'start': start_date,
+        'end': end_date,
+        'zones': [
+            {
+                'zone_code': zone.code,
+                'zone_name': zone.name,
+                'energy_kwh': round(sum(day['energy_kwh'] for day in days[zone.pk]), 3),
+                'days': days[zone.pk],
+            }
+            for zone in zones
+        ],
+    }
@@ -0,0 +1,185 @@
+import asyncio
+import json
+import weakref
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.handlers.asgi import ASGIRequest
+from django.db import IntegrityError
+from django.http import JsonResponse, StreamingHttpResponse
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import require_GET, require_POST
+from .registry import device_registry
+from .serializers import TelemetrySerializer, BulkTelemetrySerializer, ParkingLogSerializer, device_codes
+from .spool import spool_enabled
+from .writer import WriterTimeout, db_writer, writer_enabled
+from .stream import StreamPosition, alert_broadcaster
+
+# Async variants of the ingestion views for ASGI servers (uvicorn, daphne).
+# A waiting request holds no thread, device lookups come from the registry or
+# the async ORM and at most ASYNC_DB_CONCURRENCY requests per worker talk to
+# the database at the same time, the rest queue on the semaphore.
+
+# seconds between keepalive comments on an idle alert stream, keeps proxies
+# from closing the connection
+STREAM_KEEPALIVE = 15
+
+# one semaphore per event loop, a semaphore cannot be shared between loops
+_db_slots = weakref.WeakKeyDictionary()
+
+
+def db_slots():
+    loop = asyncio.get_running_loop()
+    if loop not in _db_slots:
+        _db_slots[loop] = asyncio.Semaphore(settings.ASYNC_DB_CONCURRENCY)
+    return _db_slots[loop]
+
+
+def _parse_body(request):
+    try:
+        return json.loads(request.body)
+    except ValueError:
+        return None
+
+
+def _error(message, status=400):
+    return JsonResponse({'error': message}, status=status)
+
+
+async def _validated(serializer_class, data):
+    if not isinstance(data, dict):
+        return None, 'Expected a JSON object.'
+    devices = await device_registry.aget_many([data.get('device_code')])
+    serializer = serializer_class(data=data, context={'devices': devices})
+    if not serializer.is_valid():
+        return None, serializer.errors
+    return serializer, None
+
+
+async def _save(serializer):
+    # row, device state and alerts commit together, which the async ORM
+    # cannot do (no atomic() in async code), so the write runs on the sync
+    # thread or the writer
+    if writer_enabled():
+        # wait for the writer's commit without holding the sync thread
+        future = await sync_to_async(serializer.submit)()
+        try:
+            await asyncio.wait_for(asyncio.wrap_future(future), db_writer.timeout)
+        except asyncio.TimeoutError:
+            future.cancel()
+            raise WriterTimeout('The database writer did not answer in time.') from None
+    else:
+        await sync_to_async(serializer.save)()
+
+
+# async view for telemetry data submit
+@csrf_exempt
+@require_POST
+async def telemetry_submit(request):
+    serializer, errors = await _validated(TelemetrySerializer, _parse_body(request))
+    if errors:
+        return _error(errors)
+
+    async with db_slots():
+        if spool_enabled():
+            await sync_to_async(serializer.spool)()
+            return JsonResponse({'message': 'Telemetry data accepted'}, status=202)
+
+        # errors map to the same responses as the sync view
+        try:
+            await _save(serializer)
+        except IntegrityError:
+            return _error('Duplicate telemetry data')
+        except WriterTimeout as e:
+            return _error(str(e), status=503)
+        except Exception as e:
+            return _error(str(e))
+
+    return JsonResponse({'message': 'Telemetry data received'}, status=201)
+
+
+# async view for bulk telemetry data submit
+@csrf_exempt
+@require_POST
+async def telemetry_bulk_submit(request):
+    payload = _parse_body(request)
+    serializer = BulkTelemetrySerializer(data=payload if isinstance(payload, dict) else None)
+    if not serializer.is_valid():
+        return _error(serializer.errors)
+
+    items = serializer.validated_data['data']
+    devices = await device_registry.aget_many(device_codes(items))
+    readings, errors = serializer.validate_items(items, devices)
+
+    async with db_slots():
+        if spool_enabled():
+            result = await sync_to_async(serializer.spool_readings)(readings, errors)
+            return JsonResponse(result, status=202)
+
+        # the batch is written in one transaction, which the async ORM
+        # cannot do, so that part runs on the sync thread
+        result = await sync_to_async(serializer.ingest)(readings, errors)
+
+    return JsonResponse(result, status=201)
+
+
+# async view for parking log submit
+@csrf_exempt
+@require_POST
+async def parking_log_submit(request):
+    serializer, errors = await _validated(ParkingLogSerializer, _parse_body(request))
+    if errors:
+        return _error(errors)
+
+    async with db_slots():
+        if spool_enabled():
+            await sync_to_async(serializer.spool)()
+            return JsonResponse({'message': 'Parking log accepted'}, status=202)
+
+        try:
+            await _save(serializer)
+        except WriterTimeout as e:
+            return _error(str(e), status=503)
+        except Exception as e:
+            return _error(str(e))
+
+    return JsonResponse({'message': 'Parking log recorded'}, status=201)
+
+
+# alert change feed (Server-Sent Events), ASGI only
+@require_GET
+async def alerts_stream(request):
+    if not isinstance(request, ASGIRequest):
+        # under WSGI the open stream would hold a worker thread for good,
+        # clients poll /api/alerts/ instead
+        return _error('The alert stream needs an ASGI server.', status=501)
+    position = StreamPosition.decode(request.headers.get('Last-Event-ID'))
+    broadcaster = alert_broadcaster()
+    subscription = await broadcaster.subscribe(position)
+
+    response = StreamingHttpResponse(
+        _alert_events(broadcaster, subscription, subscription.position),
+        content_type='text/event-stream',
+    )
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'
+    return response
+
+
+async def _alert_events(broadcaster, subscription, start):
+    try:
+        # the first id lets a client resume even if nothing happens before
+        # it disconnects
+        yield f'retry: 3000\nid: {start.encode()}\n\n'
+        while True:
+            try:
+                event = await asyncio.wait_for(subscription.queue.get(), STREAM_KEEPALIVE)
+            except asyncio.TimeoutError:
+                yield ': keepalive\n\n'
+                continue
+            if event is None:
+                # fell behind, the client reconnects with its last event id
+                return
+            kind, data, position = event
+            yield f'id: {position.encode()}\nevent: {kind}\ndata: {data}\n\n'
+    finally:
+        broadcaster.unsubscribe(subscription)
@@ -0,0 +1,184 @@
+import logging
+import struct
+import time
+import zlib
+from datetime import datetime, timedelta, timezone as dt_timezone
+import numpy as np
+from django.db import transaction
+from django.db.models import FloatField
+from django.db.models.functions import Cast
+from django.utils import timezone
+from .models import TelemetryChunk, TelemetryData
+from .rollups import day_bounds
+
+logger = logging.getLogger(__name__)
+
+# Cold tier of the telemetry. Days older than TELEMETRY_HOT_DAYS are moved
+# from TelemetryData (one row and three index entries per reading) into one
+# TelemetryChunk per device and day:
+#
+#   header  version (uint8), readings (uint32)
+#   body    zlib of four columns: timestamps in microseconds as
+#           delta-of-delta, then voltage, current and power factor in
+#           hundredths as deltas. A column is its first value (int64), the
+#           width of the rest (uint8 code) and readings - 1 packed integers.
+#
+# Regular readings make the timestamp column all zeros and the values
+# small steps, which pack into one byte each before zlib.
+
+FORMAT_VERSION = 1
+HEADER = struct.Struct('<BI')
+COLUMN = struct.Struct('<qB')
+# voltage, current and power factor are stored with two decimal places
+SCALE = 100
+WIDTHS = [np.dtype(code) for code in ('<i1', '<i2', '<i4', '<i8')]
+# a hot day must be older than the 24 hours of late data ingestion accepts
+MIN_HOT_DAYS = 2
+
+EPOCH = datetime(1970, 1, 1, tzinfo=dt_timezone.utc)
+MICROSECOND = timedelta(microseconds=1)
+
+
+def encode_chunk(timestamps, values):
+    """Encode int64 epoch microseconds and a (n, 3) int64 array of voltage,
+    current and power factor hundredths, sorted by time, into bytes
+    """
+    columns = [np.diff(np.diff(timestamps), prepend=0)] + [np.diff(values[:, i]) for i in range(3)]
+    firsts = [timestamps[0]] + [values[0, i] for i in range(3)]
+    body = b''.join(_pack(int(first), column) for first, column in zip(firsts, columns))
+    return HEADER.pack(FORMAT_VERSION, len(timestamps)) + zlib.compress(body)
+
+
+def decode_chunk(data):
+    """(epoch microseconds, (n, 3) hundredths) int64 arrays of a chunk"""
+    data = bytes(data)
+    version, count = HEADER.unpack_from(data)
+    if version != FORMAT_VERSION:
+        raise ValueError(f'Unknown telemetry chunk format {version}.')
+    body = zlib.decompress(data[HEADER.size:])
+
+    columns = []
+    offset = 0
+    for _ in range(4):
+        first, code = COLUMN.unpack_from(body, offset)
+        offset += COLUMN.size
+        rest = np.frombuffer(body, WIDTHS[code], count - 1, offset)
+        offset += rest.nbytes
+        columns.append((first, rest.astype(np.int64)))
+
+    (first, delta_of_delta), *values = columns
+    timestamps = first + np.r_[0, np.cumsum(np.cumsum(delta_of_delta))]
+    return timestamps, np.column_stack([first + np.r_[0, np.cumsum(rest)] for first, rest in values])
+
+
+def load_cold(device_id, start, end):
+    """Readings of a device's chunks in [start, end) as epoch seconds and a
+    (n, 3) float array of voltage, current and power factor, oldest first
+    """
+    chunks = TelemetryChunk.objects.filter(
+        device_id=device_id, start__lt=end, end__gte=start
+    ).order_by('date').values_list('data', flat=True)
+
+    timestamps, values = [np.empty(0, dtype=np.int64)], [np.empty((0, 3), dtype=np.int64)]
+    for data in chunks:
+        chunk_timestamps, chunk_values = decode_chunk(data)
+        timestamps.append(chunk_timestamps)
+        values.append(chunk_values)
+    timestamps, values = np.concatenate(timestamps), np.concatenate(values)
+
+    keep = (timestamps >= _micros(start)) & (timestamps < _micros(end))
+    return timestamps[keep] / 1e6, values[keep] / SCALE
+
+
+def compact_telemetry(before, device_batch=100):
+    """Move the readings of the local days before `before` into
+    TelemetryChunk, one transaction per day and batch of devices. A chunk
+    already stored for a device-day (readings restored from an archive) is
+    merged with the new readings. Returns (chunks, readings).
+    """
+    started = time.monotonic()
+    oldest = TelemetryData.objects.order_by('timestamp').values_list('timestamp', flat=True).first()
+    chunks = readings = 0
+    date = timezone.localdate(oldest) if oldest else before
+    while date < before:
+        start, end = day_bounds(date, date)
+        day = TelemetryData.objects.filter(timestamp__gte=start, timestamp__lt=end)
+        device_ids = sorted(day.order_by().values_list('device_id', flat=True).distinct())
+        for offset in range(0, len(device_ids), device_batch):
+            batch = device_ids[offset:offset + device_batch]
+            with transaction.atomic():
+                chunks += len(batch)
+                readings += _compact(date, day.filter(device_id__in=batch))
+        date += timedelta(days=1)
+
+    logger.info('Compacted %d readings into %d chunks in %.3fs', readings, chunks, time.monotonic() - started)
+    return chunks, readings
+
+
+def _compact(date, queryset):
+    rows = queryset.order_by('device_id', 'timestamp').values_list(
+        'device_id',
+        'timestamp',
+        Cast('voltage', FloatField()),
+        Cast('current', FloatField()),
+        Cast('power_factor', FloatField()),
+    ).iterator(chunk_size=10000)
+    flat = np.fromiter(
+        (value for row in rows for value in (row[0], _micros(row[1]), row[2], row[3], row[4])),
+        dtype=np.float64,
+    ).reshape(-1, 5)
+    devices = flat[:, 0].astype(np.int64)
+    timestamps = flat[:, 1].astype(np.int64)
+    values = np.rint(flat[:, 2:] * SCALE).astype(np.int64)
+
+    stored = dict(
+        TelemetryChunk.objects.select_for_update()
+        .filter(device_id__in=np.unique(devices).tolist(), date=date)
+        .values_list('device_id', 'data')
+    )
+    first = np.flatnonzero(np.r_[True, devices[1:] != devices[:-1]])
+    chunks = []
+    for lo, hi in zip(first, np.r_[first[1:], len(devices)]):
+        device_id = int(devices[lo])
+        chunk_timestamps, chunk_values = timestamps[lo:hi], values[lo:hi]
+        if device_id in stored:
+            old_timestamps, old_values = decode_chunk(stored[device_id])
+            merged_timestamps = np.r_[old_timestamps, chunk_timestamps]
+            # a reading in both keeps its hot version, stable sort puts it last
+            order = np.argsort(merged_timestamps, kind='stable')
+            merged_timestamps = merged_timestamps[order]
+            merged_values = np.r_[old_values, chunk_values][order]
+            last = np.r_[merged_timestamps[1:] != merged_timestamps[:-1], True]
+            chunk_timestamps, chunk_values = merged_timestamps[last], merged_values[last]
+        chunks.append(TelemetryChunk(
+            device_id=device_id,
+            date=date,
+            start=_datetime(chunk_timestamps[0]),
+            end=_datetime(chunk_timestamps[-1]),
+            readings=len(chunk_timestamps),
+            data=encode_chunk(chunk_timestamps, chunk_values),
+        ))
+
+    TelemetryChunk.objects.bulk_create(
+        chunks,
+        update_conflicts=True,
+        unique_fields=['device', 'date'],
+        update_fields=['start', 'end', 'readings', 'data'],
+    )
+    queryset.delete()
+    return len(devices)
+
+
+def _pack(first, column):
+    for code, dtype in enumerate(WIDTHS):
+        info = np.iinfo(dtype)
+        if not len(column) or (column.min() >= info.min and column.max() <= info.max):
+            return COLUMN.pack(first, code) + column.astype(dtype).tobytes()
+
+
+def _micros(moment):
+    return (moment - EPOCH) // MICROSECOND
+
+
+def _datetime(micros):
+    return EPOCH + timedelta(microseconds=int(micros))
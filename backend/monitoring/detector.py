@@ -0,0 +1,167 @@
+import heapq
+import logging
+import threading
+import time
+from datetime import timedelta
+from django.conf import settings
+from django.db import connection
+from django.utils import timezone
+from .heartbeat import heartbeats
+from .models import Alert, Device, DEFAULT_OFFLINE_TIMEOUT
+from .tasks import raise_offline_alerts, restore_devices
+
+logger = logging.getLogger(__name__)
+
+
+class OfflineDetector:
+    """In-process offline detection from per-device deadlines.
+
+    Every heartbeat pushes last_seen + the zone's offline_timeout for its
+    device onto a min-heap, O(log n) per device. A background thread wakes
+    at the earliest deadline (at least every `tick` seconds), so alerts fire
+    within about a second of it without scanning the devices table. Heap
+    entries superseded by a newer heartbeat are skipped when popped.
+
+    The heap is rebuilt from Device.last_seen when the thread starts and
+    after a device or zone changes. Expired devices are checked against the
+    database before alerting, since the heartbeat may have reached another
+    worker process; those are re-armed instead. A device that reports again
+    after its DEVICE_OFFLINE alert gets CONNECTION_RESTORED on the next tick.
+    """
+
+    def __init__(self, enabled=True, tick=1.0):
+        self.enabled = enabled
+        self.tick = tick
+        self._heap = []
+        self._deadlines = {}  # device_id -> current deadline, epoch seconds
+        self._seen = {}  # device_id -> newest heartbeat, epoch seconds
+        self._timeouts = {}  # device_id -> offline_timeout of its zone
+        self._offline = set()  # devices with an open DEVICE_OFFLINE alert
+        self._restored = set()
+        self._stale = True
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def touch(self, device_ids, seen_at):
+        """Push the deadlines of devices that just reported"""
+        if not self.enabled:
+            return
+        seen = seen_at.timestamp()
+        with self._lock:
+            for device_id in device_ids:
+                if seen <= self._seen.get(device_id, 0):
+                    continue
+                self._seen[device_id] = seen
+                self._arm(device_id, seen + self._timeouts.get(device_id, DEFAULT_OFFLINE_TIMEOUT))
+                if device_id in self._offline:
+                    self._offline.discard(device_id)
+                    self._restored.add(device_id)
+            if self._thread is None:
+                self._start()
+
+    def invalidate(self):
+        """Reload timeouts and deadlines on the next tick"""
+        self._stale = True
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=self.tick + 5)
+            self._thread = None
+
+    def _arm(self, device_id, deadline):
+        self._deadlines[device_id] = deadline
+        heapq.heappush(self._heap, (deadline, device_id))
+
+    def _expired(self, now):
+        expired = []
+        while self._heap and self._heap[0][0] <= now:
+            deadline, device_id = heapq.heappop(self._heap)
+            if self._deadlines.get(device_id) == deadline:
+                del self._deadlines[device_id]
+                expired.append(device_id)
+        return expired
+
+    def _rebuild(self):
+        self._stale = False
+        rows = list(Device.objects.filter(is_active=True).order_by().values_list(
+            'pk', 'last_seen', 'zone__offline_timeout'
+        ))
+        offline = set(
+            Alert.objects.filter(alert_type='DEVICE_OFFLINE', is_acknowledged=False, resolved_at__isnull=True)
+            .order_by().values_list('device_id', flat=True)
+        )
+        now = time.time()
+        with self._lock:
+            self._timeouts, self._deadlines = {}, {}
+            for device_id, last_seen, timeout in rows:
+                self._timeouts[device_id] = timeout
+                seen = max(self._seen.get(device_id, 0), last_seen.timestamp() if last_seen else 0)
+                if not seen:
+                    # never reported, nothing to wait for
+                    continue
+                self._seen[device_id] = seen
+                deadline = seen + timeout
+                if device_id in offline:
+                    if deadline <= now:
+                        continue
+                    self._restored.add(device_id)
+                self._deadlines[device_id] = deadline
+            self._offline = offline - self._restored
+            self._seen = {device_id: self._seen[device_id] for device_id in self._timeouts if device_id in self._seen}
+            self._heap = [(deadline, device_id) for device_id, deadline in self._deadlines.items()]
+            heapq.heapify(self._heap)
+
+    def _fire(self, device_ids):
+        now = timezone.now()
+        rows = Device.objects.filter(pk__in=device_ids, is_active=True).order_by().values_list(
+            'pk', 'device_code', 'last_seen', 'zone__offline_timeout'
+        )
+        offline = []
+        with self._lock:
+            for device_id, device_code, last_seen, timeout in rows:
+                last_seen = heartbeats.last_seen(device_id) or last_seen
+                if last_seen and last_seen > now - timedelta(seconds=timeout):
+                    # reported to another worker meanwhile
+                    seen = max(self._seen.get(device_id, 0), last_seen.timestamp())
+                    self._seen[device_id] = seen
+                    if device_id not in self._deadlines:
+                        self._arm(device_id, seen + timeout)
+                elif device_id not in self._deadlines:
+                    offline.append((device_id, device_code, last_seen, timeout))
+            self._offline.update(device_id for device_id, *_ in offline)
+        return raise_offline_alerts(offline)
+
+    def _start(self):
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name='offline-detector', daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        while True:
+            try:
+                if self._stale:
+                    self._rebuild()
+                with self._lock:
+                    expired = self._expired(time.time())
+                    restored, self._restored = self._restored, set()
+                if expired:
+                    self._fire(expired)
+                if restored:
+                    restore_devices(list(restored))
+            except Exception:
+                logger.exception('Offline detection failed')
+                # expired devices may have been dropped, start over
+                self._stale = True
+
+            with self._lock:
+                wait = self._heap[0][0] - time.time() if self._heap else self.tick
+            if self._stop.wait(min(max(wait, 0), self.tick)):
+                break
+        connection.close()
+
+
+offline_detector = OfflineDetector(
+    enabled=getattr(settings, 'OFFLINE_DETECTOR', True),
+)
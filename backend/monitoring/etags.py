@@ -0,0 +1,77 @@
+import hashlib
+from datetime import datetime, timedelta
+from django.db.models import Max, Q
+from django.utils import timezone
+from .heartbeat import heartbeats
+from .models import Alert, Device, ParkingLog
+from .versioning import SharedVersion, cache_is_shared
+
+# bumped when a device or zone is saved or deleted (signals.py) and when
+# old rows are archived or restored (retention.py), covers renames, targets
+# and purges that no max id would reveal
+catalog_version = SharedVersion('monitoring:catalog:version')
+# bumped when an alert is deleted (signals.py), which no max id reveals
+alert_version = SharedVersion('monitoring:alerts:version')
+
+# ETag functions for django.views.decorators.http.condition. They run before
+# the view and only read a few indexed max ids and counts, so an unchanged
+# response is answered with 304 without building it. The versions above
+# live in the default cache: with a per-process one (LocMemCache) a write
+# handled by another worker would never change the ETag, so responses then
+# go without one.
+
+
+def _etag(*parts):
+    return hashlib.md5('|'.join(str(part) for part in parts).encode(), usedforsecurity=False).hexdigest()
+
+
+def _last_pk(queryset):
+    return queryset.order_by('-pk').values_list('pk', flat=True).first()
+
+
+def dashboard_summary_etag(request):
+    if not cache_is_shared():
+        return None
+    date_str = request.GET.get('date')
+    try:
+        target_date = datetime.strptime(date_str, '%Y-%m-%d').date() if date_str else timezone.now().date()
+    except ValueError:
+        # let the view answer 400
+        return None
+
+    # active devices depend on the clock as well as on writes
+    two_minutes_ago = timezone.now() - timedelta(minutes=2)
+    active_devices = Device.objects.filter(
+        Q(last_seen__gte=two_minutes_ago) |
+        Q(pk__in=list(heartbeats.pending(since=two_minutes_ago)))
+    ).count()
+
+    return _etag(
+        target_date,
+        _last_pk(ParkingLog.objects.all()),
+        _last_pk(Alert.objects.all()),
+        Device.objects.count(),
+        active_devices,
+        alert_version.current(),
+        catalog_version.current(),
+    )
+
+
+def alerts_list_etag(request):
+    if not cache_is_shared():
+        return None
+    last_acknowledged = (
+        Alert.objects.filter(acknowledged_at__isnull=False)
+        .order_by('-acknowledged_at', '-pk')
+        .values_list('acknowledged_at', 'pk')
+        .first()
+    )
+    # resolutions are bulk updates, no signal tells about them
+    return _etag(
+        request.GET.urlencode(),
+        _last_pk(Alert.objects.all()),
+        last_acknowledged,
+        Alert.objects.aggregate(last=Max('resolved_at'))['last'],
+        alert_version.current(),
+        catalog_version.current(),
+    )
@@ -0,0 +1,189 @@
+import logging
+import time
+from datetime import timedelta
+import numpy as np
+from django.db.models import Count, Exists, FloatField, OuterRef, Q
+from django.db.models.functions import Cast
+from django.utils import timezone
+from .models import Alert, Device, DeviceHealth, TelemetryData
+from .rules import rule_engine
+
+logger = logging.getLogger(__name__)
+
+# weight of each component in the 0-100 score
+WEIGHTS = {
+    'uptime': 40,
+    'alerts': 25,
+    'anomalies': 20,
+    'stability': 15,
+}
+# alert penalty points per severity, 20 points cost the whole alerts component
+ALERT_PENALTY = {'CRITICAL': 10, 'WARNING': 3, 'INFO': 0.5}
+ALERT_PENALTY_MAX = 20
+# share of readings breaking a rule that costs the whole anomalies component
+ANOMALY_RATE_MAX = 0.1
+# voltage coefficient of variation that costs the whole stability component
+VOLTAGE_CV_MAX = 0.05
+
+
+def devices_to_score(now=None, max_age=timedelta(hours=1)):
+    """Devices never scored, scored more than max_age ago, or with alerts
+    newer than their stored score.
+
+    New readings alone do not count: a reporting device moves its score
+    little between runs and is refreshed once max_age has passed. The
+    material changes all raise alerts, telemetry gaps included (the
+    offline detector's DEVICE_OFFLINE and CONNECTION_RESTORED).
+    """
+    now = now or timezone.now()
+    return Device.objects.filter(
+        Q(health__isnull=True)
+        | Q(health__computed_at__lt=now - max_age)
+        | Exists(Alert.objects.filter(device=OuterRef('pk'), created_at__gt=OuterRef('health__computed_at')))
+    ).values_list('pk', flat=True)
+
+
+def score_devices(device_ids=None, window=timedelta(hours=24), now=None, batch_size=200):
+    """Compute and store the health of the devices (the ones needing it when
+    None) over the last `window`. Returns the number of devices scored.
+
+    Each batch of devices costs one ordered telemetry read, one grouped
+    alert query and one upsert; every component is computed for the whole
+    batch at once with NumPy segment reductions. Batches bound the memory
+    used by a day of readings.
+    """
+    started = time.monotonic()
+    now = now or timezone.now()
+    if device_ids is None:
+        device_ids = devices_to_score(now)
+    devices = list(
+        Device.objects.filter(pk__in=device_ids)
+        .order_by('pk')
+        .values_list('pk', 'zone_id', 'zone__offline_timeout')
+    )
+    for offset in range(0, len(devices), batch_size):
+        _score_batch(devices[offset:offset + batch_size], now - window, now)
+
+    logger.info('Scored %d devices in %.3fs', len(devices), time.monotonic() - started)
+    return len(devices)
+
+
+def _score_batch(devices, since, now):
+    ids = np.array([pk for pk, _, _ in devices], dtype=np.int64)
+    zone_ids = np.array([zone_id for _, zone_id, _ in devices], dtype=np.int64)
+    timeouts = np.array([timeout for _, _, timeout in devices], dtype=np.float64)
+
+    readings = _load_readings(ids, since, now)
+    uptime, readings_count, anomaly_rate, voltage_cv = _telemetry_components(
+        readings, ids, zone_ids, timeouts, since.timestamp(), now.timestamp()
+    )
+
+    penalty = np.zeros(len(ids))
+    counts = {severity: np.zeros(len(ids), dtype=np.int64) for severity in ALERT_PENALTY}
+    rows = Alert.objects.filter(device_id__in=ids.tolist(), created_at__gte=since).values(
+        'device_id'
+    ).annotate(**{
+        severity: Count('id', filter=Q(severity=severity)) for severity in ALERT_PENALTY
+    })
+    for row in rows:
+        position = np.searchsorted(ids, row['device_id'])
+        for severity, points in ALERT_PENALTY.items():
+            counts[severity][position] = row[severity]
+            penalty[position] += row[severity] * points
+
+    # a device that sent nothing earns nothing for the quality of its data
+    reported = readings_count > 0
+    components = {
+        'uptime': uptime,
+        'alerts': 1 - np.minimum(penalty / ALERT_PENALTY_MAX, 1),
+        'anomalies': reported * (1 - np.minimum(anomaly_rate / ANOMALY_RATE_MAX, 1)),
+        'stability': reported * (1 - np.minimum(voltage_cv / VOLTAGE_CV_MAX, 1)),
+    }
+    score = np.rint(sum(WEIGHTS[name] * value for name, value in components.items()))
+
+    DeviceHealth.objects.bulk_create(
+        [
+            DeviceHealth(
+                device_id=int(ids[i]),
+                score=int(score[i]),
+                uptime_ratio=round(float(uptime[i]), 4),
+                critical_alerts=int(counts['CRITICAL'][i]),
+                warning_alerts=int(counts['WARNING'][i]),
+                info_alerts=int(counts['INFO'][i]),
+                anomaly_rate=round(float(anomaly_rate[i]), 4),
+                voltage_cv=round(float(voltage_cv[i]), 4),
+                readings=int(readings_count[i]),
+                computed_at=now,
+            )
+            for i in range(len(ids))
+        ],
+        batch_size=500,
+        update_conflicts=True,
+        unique_fields=['device'],
+        update_fields=[
+            'score', 'uptime_ratio', 'critical_alerts', 'warning_alerts', 'info_alerts',
+            'anomaly_rate', 'voltage_cv', 'readings', 'computed_at',
+        ],
+    )
+
+
+def _load_readings(ids, since, now, chunk_size=10000):
+    """(device_id, epoch seconds, voltage, current, power_factor) rows of the
+    devices in [since, now), ordered by device then time
+    """
+    rows = TelemetryData.objects.filter(
+        device_id__in=ids.tolist(),
+        timestamp__gte=since,
+        timestamp__lt=now,
+    ).order_by('device_id', 'timestamp').values_list(
+        'device_id',
+        'timestamp',
+        Cast('voltage', FloatField()),
+        Cast('current', FloatField()),
+        Cast('power_factor', FloatField()),
+    ).iterator(chunk_size=chunk_size)
+    return np.fromiter(
+        (value for row in rows for value in (row[0], row[1].timestamp(), row[2], row[3], row[4])),
+        dtype=np.float64,
+    ).reshape(-1, 5)
+
+
+def _telemetry_components(readings, ids, zone_ids, timeouts, since, now):
+    """Per device (in ids order): uptime ratio, reading count, share of
+    readings breaking a rule and voltage coefficient of variation
+    """
+    n = len(ids)
+    uptime = np.zeros(n)
+    counts = np.zeros(n, dtype=np.int64)
+    anomaly_rate = np.zeros(n)
+    voltage_cv = np.zeros(n)
+    if not len(readings):
+        return uptime, counts, anomaly_rate, voltage_cv
+
+    device = np.searchsorted(ids, readings[:, 0].astype(np.int64))
+    moments, voltage, current, power_factor = readings[:, 1], readings[:, 2], readings[:, 3], readings[:, 4]
+    first = np.flatnonzero(np.r_[True, device[1:] != device[:-1]])
+    present = device[first]
+    counts[present] = np.diff(np.r_[first, len(device)])
+
+    # uptime: a reading covers up to `timeout` seconds after it, gaps past
+    # that (and before the first reading of the window) count as downtime
+    timeout = timeouts[device]
+    following = np.r_[moments[1:], 0.0]
+    last = np.r_[first[1:] - 1, len(device) - 1]
+    following[last] = now
+    covered = np.minimum(following - moments, timeout)
+    covered_total = np.add.reduceat(covered, first)
+    uptime[present] = np.clip(covered_total / (now - since), 0, 1)
+
+    # anomalies: the same rules as ingestion, per reading
+    values = np.vstack([voltage * current * power_factor, voltage, current, power_factor])
+    broken = rule_engine.compiled.breaches(ids[device], zone_ids[device], values)
+    anomaly_rate[present] = np.add.reduceat(broken.astype(np.float64), first) / counts[present]
+
+    # stability: standard deviation of the voltage relative to its mean
+    mean = np.add.reduceat(voltage, first) / counts[present]
+    variance = np.add.reduceat(voltage ** 2, first) / counts[present] - mean ** 2
+    voltage_cv[present] = np.sqrt(np.maximum(variance, 0)) / np.where(mean > 0, mean, 1)
+
+    return uptime, counts, anomaly_rate, voltage_cv
@@ -0,0 +1,135 @@
+import atexit
+import logging
+import threading
+from django.conf import settings
+from django.db import connection
+from django.db.models import Case, When, Value, DateTimeField
+from django.utils import timezone
+from .models import Device
+
+logger = logging.getLogger(__name__)
+
+
+class HeartbeatBuffer:
+    """Write-behind buffer for Device.last_seen.
+
+    Keeps only the newest heartbeat per device in memory and writes them all
+    with one UPDATE every `flush_interval` seconds from a background thread.
+    Readers that need exact liveness (offline checks, dashboard) merge
+    pending() with the stored column. A `flush_interval` of 0 writes
+    through on every record() instead.
+
+    The buffer belongs to one process: pending() only holds the heartbeats
+    this process recorded, another worker or a management command sees
+    them once they are flushed. The flush thread starts on the first
+    record(), never at import, so commands that record no heartbeats run
+    without it.
+    """
+
+    # devices per UPDATE statement, keeps the CASE expression small
+    FLUSH_BATCH_SIZE = 500
+
+    def __init__(self, flush_interval=5.0):
+        self.flush_interval = flush_interval
+        self._pending = {}
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        self._exit_hook = False
+
+    def record(self, device_ids, seen_at=None):
+        seen_at = seen_at or timezone.now()
+        self._notify(device_ids, seen_at)
+        if self.flush_interval <= 0:
+            Device.objects.filter(pk__in=device_ids).update(last_seen=seen_at)
+            return
+
+        with self._lock:
+            for device_id in device_ids:
+                previous = self._pending.get(device_id)
+                if previous is None or previous < seen_at:
+                    self._pending[device_id] = seen_at
+            if self._thread is None:
+                self._start()
+
+    async def arecord(self, device_ids, seen_at=None):
+        """record() for async views"""
+        if self.flush_interval <= 0:
+            seen_at = seen_at or timezone.now()
+            self._notify(device_ids, seen_at)
+            await Device.objects.filter(pk__in=device_ids).aupdate(last_seen=seen_at)
+        else:
+            self.record(device_ids, seen_at)
+
+    def _notify(self, device_ids, seen_at):
+        from .detector import offline_detector
+        offline_detector.touch(device_ids, seen_at)
+
+    def pending(self, since=None):
+        """Unflushed heartbeats as {device_id: last_seen}"""
+        with self._lock:
+            if since is None:
+                return dict(self._pending)
+            return {
+                device_id: seen_at
+                for device_id, seen_at in self._pending.items()
+                if seen_at >= since
+            }
+
+    def last_seen(self, device_id):
+        with self._lock:
+            return self._pending.get(device_id)
+
+    def flush(self):
+        with self._lock:
+            pending, self._pending = self._pending, {}
+        if not pending:
+            return 0
+
+        items = list(pending.items())
+        try:
+            for start in range(0, len(items), self.FLUSH_BATCH_SIZE):
+                batch = items[start:start + self.FLUSH_BATCH_SIZE]
+                Device.objects.filter(pk__in=[device_id for device_id, _ in batch]).update(
+                    last_seen=Case(
+                        *[When(pk=device_id, then=Value(seen_at)) for device_id, seen_at in batch],
+                        output_field=DateTimeField(),
+                    )
+                )
+        except Exception:
+            # put them back unless a newer heartbeat arrived meanwhile
+            with self._lock:
+                for device_id, seen_at in pending.items():
+                    if self._pending.get(device_id, seen_at) <= seen_at:
+                        self._pending[device_id] = seen_at
+            raise
+        return len(items)
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=self.flush_interval + 5)
+            self._thread = None
+        self.flush()
+
+    def _start(self):
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name='heartbeat-flush', daemon=True)
+        self._thread.start()
+        if not self._exit_hook:
+            # last heartbeats are written when the worker shuts down
+            atexit.register(self.stop)
+            self._exit_hook = True
+
+    def _run(self):
+        while not self._stop.wait(self.flush_interval):
+            try:
+                self.flush()
+            except Exception:
+                logger.exception('Heartbeat flush failed')
+        connection.close()
+
+
+heartbeats = HeartbeatBuffer(
+    flush_interval=getattr(settings, 'HEARTBEAT_FLUSH_INTERVAL', 5.0),
+)
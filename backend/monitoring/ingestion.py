@@ -0,0 +1,266 @@
+from django.db import transaction
+from django.db.models import OuterRef, Subquery
+from .models import Device, DeviceState, TelemetryData, ParkingLog, Alert
+from .heartbeat import heartbeats
+from .rollups import update_energy_rollups, update_parking_rollups
+from .rules import rule_engine
+
+
+def ingest_telemetry(readings, heartbeat=True):
+    """Write a batch of validated readings with a fixed number of queries.
+
+    Every reading is a dict holding the resolved `device_id` and `zone_id`
+    and the telemetry fields. Returns the list of TelemetryData rows that were inserted and the
+    list of readings skipped as duplicates. Pass heartbeat=False when the
+    heartbeat was already recorded at receive time (spool drain).
+    """
+    if not readings:
+        return [], []
+
+    # drop repeats inside the batch and rows already stored
+    seen = set()
+    unique = []
+    duplicates = []
+    for reading in readings:
+        key = (reading['device_id'], reading['timestamp'])
+        if key in seen:
+            duplicates.append(reading)
+        else:
+            seen.add(key)
+            unique.append(reading)
+
+    device_ids = {reading['device_id'] for reading in unique}
+    existing = set(
+        TelemetryData.objects.filter(
+            device_id__in=device_ids,
+            timestamp__in={reading['timestamp'] for reading in unique},
+        ).order_by().values_list('device_id', 'timestamp')
+    )
+
+    rows = []
+    inserted = []
+    for reading in unique:
+        if (reading['device_id'], reading['timestamp']) in existing:
+            duplicates.append(reading)
+            continue
+        inserted.append(reading)
+        rows.append(TelemetryData(
+            device_id=reading['device_id'],
+            voltage=reading['voltage'],
+            current=reading['current'],
+            power_factor=reading['power_factor'],
+            timestamp=reading['timestamp'],
+        ))
+
+    with transaction.atomic():
+        # a concurrent writer may still beat us to a row, the unique
+        # constraint on (device, timestamp) turns that into a no-op
+        TelemetryData.objects.bulk_create(rows, batch_size=500, ignore_conflicts=True)
+        previous = update_telemetry_states(inserted)
+        update_energy_rollups(inserted, previous)
+        if heartbeat:
+            heartbeats.record(device_ids)
+        check_anomalies(inserted)
+
+    return rows, duplicates
+
+
+def ingest_parking_logs(events):
+    """Insert a batch of validated occupancy events holding a resolved `device_id`.
+
+    Events are replayed per device in timestamp order on top of the stored
+    DeviceState, which is updated in the same transaction. Events older
+    than that state, exact repeats of a stored or batch event and repeats
+    of the device's current state are dropped. An event at the time of the
+    last one but with the other state is a flip and is stored.
+    Returns the inserted rows and a dict counting the dropped events.
+    """
+    dropped = {'stale': 0, 'duplicates': 0, 'unchanged': 0}
+    if not events:
+        return [], dropped
+
+    events = sorted(events, key=lambda event: (event['device_id'], event['timestamp']))
+
+    with transaction.atomic():
+        # latest stored state per device
+        states = _load_occupancy({event['device_id'] for event in events})
+        # events at a device's last time are repeats only if stored as such
+        at_last = [
+            event for event in events
+            if event['device_id'] in states and event['timestamp'] == states[event['device_id']][2]
+        ]
+        seen = set()
+        if at_last:
+            seen = set(ParkingLog.objects.filter(
+                device_id__in={event['device_id'] for event in at_last},
+                timestamp__in={event['timestamp'] for event in at_last},
+            ).order_by().values_list('device_id', 'timestamp', 'is_occupied'))
+
+        rows = []
+        intervals = []
+        for event in events:
+            device_id = event['device_id']
+            last_state, changed_at, last_at = states.get(device_id, (None, None, None))
+
+            key = (device_id, event['timestamp'], event['is_occupied'])
+            if last_at is not None and event['timestamp'] < last_at:
+                dropped['stale'] += 1
+            elif key in seen:
+                dropped['duplicates'] += 1
+            elif event['is_occupied'] == last_state:
+                dropped['unchanged'] += 1
+            else:
+                seen.add(key)
+                rows.append(ParkingLog(
+                    device_id=device_id,
+                    is_occupied=event['is_occupied'],
+                    timestamp=event['timestamp'],
+                ))
+                if last_state:
+                    intervals.append((device_id, changed_at, event['timestamp']))
+                states[device_id] = (event['is_occupied'], event['timestamp'], event['timestamp'])
+
+        ParkingLog.objects.bulk_create(rows, batch_size=500)
+        update_parking_rollups(rows, intervals)
+        _save_occupancy({row.device_id: states[row.device_id] for row in rows})
+
+    return rows, dropped
+
+
+def update_occupancy_states(events):
+    """Apply parking events to DeviceState, call inside the transaction that
+    stores them. Events older than the stored state are ignored. Returns the
+    (device_id, start, end) occupied periods the events closed.
+    """
+    events = sorted(events, key=lambda event: (event['device_id'], event['timestamp']))
+    states = _load_occupancy({event['device_id'] for event in events})
+    intervals = []
+    _save_occupancy(_apply_occupancy(states, events, intervals))
+    return intervals
+
+
+def update_telemetry_states(readings):
+    """Move each device's telemetry snapshot to its newest reading, call
+    inside the transaction that stores them. Readings older than the stored
+    snapshot are ignored, so late data never rolls the state back.
+    Returns the previous snapshot time of each device (None when it had
+    none), for update_energy_rollups.
+    """
+    newest = {}
+    for reading in readings:
+        current = newest.get(reading['device_id'])
+        if current is None or reading['timestamp'] > current['timestamp']:
+            newest[reading['device_id']] = reading
+    if not newest:
+        return {}
+
+    stored = dict(
+        DeviceState.objects.select_for_update()
+        .filter(device_id__in=newest)
+        .values_list('device_id', 'telemetry_at')
+    )
+    DeviceState.objects.bulk_create(
+        [
+            DeviceState(
+                device_id=device_id,
+                voltage=reading['voltage'],
+                current=reading['current'],
+                power_factor=reading['power_factor'],
+                telemetry_at=reading['timestamp'],
+            )
+            for device_id, reading in newest.items()
+            if stored.get(device_id) is None or reading['timestamp'] > stored[device_id]
+        ],
+        batch_size=500,
+        update_conflicts=True,
+        unique_fields=['device'],
+        update_fields=['voltage', 'current', 'power_factor', 'telemetry_at'],
+    )
+    return stored
+
+
+def rebuild_device_states():
+    """Recompute every DeviceState row from ParkingLog and TelemetryData"""
+    with transaction.atomic():
+        DeviceState.objects.all().delete()
+
+        # occupancy needs the whole history to find when the current state began
+        logs = ParkingLog.objects.order_by('device_id', 'timestamp').values(
+            'device_id', 'is_occupied', 'timestamp'
+        )
+        _save_occupancy(_apply_occupancy({}, logs.iterator(chunk_size=5000)))
+
+        latest = TelemetryData.objects.filter(device=OuterRef('pk')).order_by('-timestamp')
+        readings = Device.objects.annotate(
+            latest_voltage=Subquery(latest.values('voltage')[:1]),
+            latest_current=Subquery(latest.values('current')[:1]),
+            latest_power_factor=Subquery(latest.values('power_factor')[:1]),
+            latest_at=Subquery(latest.values('timestamp')[:1]),
+        ).filter(latest_at__isnull=False).order_by().values_list(
+            'pk', 'latest_voltage', 'latest_current', 'latest_power_factor', 'latest_at'
+        )
+        update_telemetry_states([
+            {'device_id': pk, 'voltage': voltage, 'current': current, 'power_factor': power_factor, 'timestamp': timestamp}
+            for pk, voltage, current, power_factor, timestamp in readings
+        ])
+
+        return DeviceState.objects.count()
+
+
+def _load_occupancy(device_ids):
+    """{device_id: (is_occupied, occupancy_changed_at, parking_log_at)} for stored states"""
+    return {
+        device_id: state
+        for device_id, *state in DeviceState.objects.select_for_update().filter(
+            device_id__in=device_ids,
+            parking_log_at__isnull=False,
+        ).values_list('device_id', 'is_occupied', 'occupancy_changed_at', 'parking_log_at')
+    }
+
+
+def _apply_occupancy(states, events, intervals=None):
+    """Replay events sorted by (device_id, timestamp) on states, returns the
+    changed ones. Occupied periods that end are appended to intervals.
+    """
+    changed = {}
+    for event in events:
+        device_id = event['device_id']
+        state = changed.get(device_id) or states.get(device_id)
+        if state is not None and event['timestamp'] <= state[2]:
+            continue
+        if state is not None and state[0] == event['is_occupied']:
+            changed_at = state[1]
+        else:
+            changed_at = event['timestamp']
+            if state is not None and state[0] and intervals is not None:
+                intervals.append((device_id, state[1], event['timestamp']))
+        changed[device_id] = (event['is_occupied'], changed_at, event['timestamp'])
+    return changed
+
+
+def _save_occupancy(states):
+    DeviceState.objects.bulk_create(
+        [
+            DeviceState(
+                device_id=device_id,
+                is_occupied=is_occupied,
+                occupancy_changed_at=changed_at,
+                parking_log_at=parking_log_at,
+            )
+            for device_id, (is_occupied, changed_at, parking_log_at) in states.items()
+        ],
+        batch_size=500,
+        update_conflicts=True,
+        unique_fields=['device'],
+        update_fields=['is_occupied', 'occupancy_changed_at', 'parking_log_at'],
+    )
+
+
+def check_anomalies(readings):
+    """Raise alerts for readings that break an AlertRule, one per device and type"""
+    return Alert.bulk_create_if_not_exists(find_anomalies(readings))
+
+
+def find_anomalies(readings):
+    """Unsaved alerts for the readings, evaluated in one vectorized pass"""
+    return rule_engine.evaluate(readings)
@@ -2,6 +2,8 @@ from django.core.management.base import BaseCommand
 from django.utils import timezone
 from datetime import timedelta
 import random
+from decimal import Decimal
+from monitoring.ingestion import ingest_telemetry
 from monitoring.models import Device, Alert
 
 class Command(BaseCommand):
@@ -23,52 +25,37 @@ class Command(BaseCommand):
             device.last_seen = now - timedelta(minutes=random.randint(3, 30))
             device.save()
             
-            Alert.objects.create(
+            if Alert.create_if_not_exists(
                 device=device,
                 severity='CRITICAL',
                 alert_type='DEVICE_OFFLINE',
-                message=f'Device offline for {(now - device.last_seen).seconds // 60} minutes',
-                is_acknowledged=False
-            )
-            count += 1
-        
-        # Warning: High power
-        high_power_devices = random.sample(devices, k=min(8, len(devices)))
-        for device in high_power_devices:
-            power = round(random.uniform(1500, 2500), 2)
-            Alert.objects.create(
-                device=device,
-                severity='WARNING',
-                alert_type='HIGH_POWER',
-                message=f'Abnormal power usage: {power}W (threshold: 1500W)',
-                is_acknowledged=False
-            )
-            count += 1
+                message=f'Device offline for {(now - device.last_seen).seconds // 60} minutes'
+            ):
+                count += 1
         
-        # Warning: Low voltage
-        voltage_devices = random.sample(devices, k=min(6, len(devices)))
-        for device in voltage_devices:
-            voltage = round(random.uniform(200, 210), 2)
-            Alert.objects.create(
-                device=device,
-                severity='WARNING',
-                alert_type='LOW_VOLTAGE',
-                message=f'Voltage below normal: {voltage}V (expected: 215-225V)',
-                is_acknowledged=False
-            )
-            count += 1
+        # Warning: High power and low voltage, raised by the alert rules
+        # from anomalous readings sent through ingestion
+        readings = [
+            self.reading(device, now, current=random.uniform(15.0, 25.0))
+            for device in random.sample(devices, k=min(8, len(devices)))
+        ] + [
+            self.reading(device, now, voltage=random.uniform(200.0, 209.0))
+            for device in random.sample(devices, k=min(6, len(devices)))
+        ]
+        before = Alert.objects.count()
+        ingest_telemetry(readings, heartbeat=False)
+        count += Alert.objects.count() - before
         
         # Critical: Communication timeout
         timeout_devices = random.sample(devices, k=min(3, len(devices)))
         for device in timeout_devices:
-            Alert.objects.create(
+            if Alert.create_if_not_exists(
                 device=device,
                 severity='CRITICAL',
                 alert_type='COMMUNICATION_TIMEOUT',
-                message='No response from device for extended period',
-                is_acknowledged=False
-            )
-            count += 1
+                message='No response from device for extended period'
+            ):
+                count += 1
         
         # Info: Connection restored
         restored_devices = random.sample(devices, k=min(3, len(devices)))
@@ -84,4 +71,15 @@ class Command(BaseCommand):
         
         self.stdout.write(self.style.SUCCESS(f'✓ Created {count} alerts'))
         self.stdout.write(f'Total alerts in system: {Alert.objects.count()}')
-        self.stdout.write(f'Unacknowledged: {Alert.objects.filter(is_acknowledged=False).count()}')
\ No newline at end of file
+        self.stdout.write(f'Unacknowledged: {Alert.objects.filter(is_acknowledged=False).count()}')
+
+    def reading(self, device, now, voltage=None, current=None):
+        return {
+            'device_id': device.id,
+            'zone_id': device.zone_id,
+            'voltage': Decimal(str(round(voltage or random.uniform(215.0, 225.0), 2))),
+            'current': Decimal(str(round(current or random.uniform(3.5, 7.5), 2))),
+            'power_factor': Decimal(str(round(random.uniform(0.85, 0.98), 2))),
+            # spread so two readings of one device do not collide
+            'timestamp': now - timedelta(milliseconds=random.randint(0, 60000)),
+        }
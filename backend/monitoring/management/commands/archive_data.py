@@ -0,0 +1,32 @@
+from django.core.management.base import BaseCommand, CommandError
+from monitoring import retention
+
+
+class Command(BaseCommand):
+    help = 'Export rows older than RETENTION_DAYS to Parquet files and delete them'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--table',
+            action='append',
+            choices=list(retention.TABLES),
+            help='Table to archive, may be repeated, defaults to all',
+        )
+        parser.add_argument(
+            '--days',
+            type=int,
+            help='Days to keep, overrides RETENTION_DAYS for the tables archived',
+        )
+
+    def handle(self, *args, **kwargs):
+        if retention.pa is None:
+            raise CommandError('archive_data needs the pyarrow package.')
+        names = kwargs['table'] or list(retention.TABLES)
+        days = kwargs['days']
+        try:
+            result = retention.archive(names, {name: days for name in names} if days is not None else None)
+        except ValueError as e:
+            raise CommandError(str(e))
+
+        for name, (files, rows) in result.items():
+            self.stdout.write(f'{name}: {rows} rows archived in {files} files')
@@ -0,0 +1,199 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, connections
+from django.db.models import Q
+from django.test import Client, AsyncClient, override_settings
+from django.utils import timezone
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from datetime import timedelta
+import asyncio
+import json
+import threading
+import time
+from monitoring.detector import offline_detector
+from monitoring.heartbeat import heartbeats
+from monitoring.models import Device, ParkingZone
+
+ENDPOINTS = {
+    'wsgi': '/api/telemetry/',
+    'asgi': '/api/telemetry/async/',
+}
+
+# --compare setups: SQLite connection options and INGEST_MODE. The journal
+# mode is stored in the database file, so the defaults reset it explicitly
+SETUPS = {
+    'before': ({'init_command': 'PRAGMA journal_mode=DELETE'}, 'sync'),
+    'after': (getattr(settings, 'SQLITE_OPTIONS', {}), 'writer'),
+}
+
+# the benchmark writes for devices of its own zone, deleting the zone
+# cascades to every row it caused (telemetry, device state, energy
+# rollups, alerts) and leaves the real devices untouched. A zone is only
+# taken for a leftover benchmark zone with the reserved name and nothing
+# but BENCH- devices
+BENCHMARK_ZONE = 'BENCH'
+BENCHMARK_ZONE_NAME = 'benchmark_ingest (temporary)'
+
+
+class Command(BaseCommand):
+    help = (
+        'Benchmark single-reading telemetry ingestion through the WSGI view '
+        'and the async ASGI view. Requests go through the in-process Django '
+        'handlers (middleware, views, ORM) against the configured database, '
+        'not over the network, for devices of a temporary BENCH zone that is '
+        'deleted afterwards.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=2000)
+        parser.add_argument('--concurrency', type=int, default=50)
+        parser.add_argument('--devices', type=int, default=100)
+        parser.add_argument(
+            '--mode',
+            choices=['wsgi', 'asgi', 'both'],
+            default='both',
+        )
+        parser.add_argument(
+            '--compare',
+            action='store_true',
+            help=(
+                'Run each mode twice: with SQLite defaults and a transaction '
+                'per request, then with SQLITE_OPTIONS and the writer thread'
+            ),
+        )
+        parser.add_argument(
+            '--keep',
+            action='store_true',
+            help='Keep the BENCH zone, its devices and the rows written for them',
+        )
+
+    def handle(self, *args, **kwargs):
+        if kwargs['devices'] < 1:
+            raise CommandError('--devices must be at least 1.')
+        zone, codes = self.create_devices(kwargs['devices'])
+
+        modes = ['wsgi', 'asgi'] if kwargs['mode'] == 'both' else [kwargs['mode']]
+        setups = list(SETUPS) if kwargs['compare'] else [None]
+        try:
+            if kwargs['compare'] and connection.vendor != 'sqlite':
+                raise CommandError('--compare needs the SQLite database.')
+
+            with override_settings(ALLOWED_HOSTS=['testserver']):
+                for setup in setups:
+                    for mode in modes:
+                        run = len(setups) * modes.index(mode) + setups.index(setup)
+                        payloads = self.build_payloads(codes, kwargs['requests'], run)
+                        with self.setup(setup):
+                            if mode == 'wsgi':
+                                results, elapsed = self.run_wsgi(payloads, kwargs['concurrency'])
+                            else:
+                                results, elapsed = asyncio.run(self.run_asgi(payloads, kwargs['concurrency']))
+                        self.report(f'{mode} {setup}' if setup else mode, results, elapsed)
+        finally:
+            # the requests started this process's heartbeat flush and offline
+            # detector threads, end them before their devices go
+            heartbeats.stop()
+            offline_detector.stop()
+            if not kwargs['keep']:
+                deleted, _ = zone.delete()
+                self.stdout.write(f'Removed {deleted} benchmark rows')
+
+    def create_devices(self, count):
+        prefix = f'{BENCHMARK_ZONE}-'
+        existing = ParkingZone.objects.filter(Q(code=BENCHMARK_ZONE) | Q(name=BENCHMARK_ZONE_NAME))
+        foreign = Device.objects.filter(
+            Q(zone__in=existing) | Q(device_code__startswith=prefix)
+        ).exclude(zone__code=BENCHMARK_ZONE, zone__name=BENCHMARK_ZONE_NAME, device_code__startswith=prefix)
+        if any(zone.code != BENCHMARK_ZONE or zone.name != BENCHMARK_ZONE_NAME for zone in existing) or foreign.exists():
+            raise CommandError(
+                f'Zone {BENCHMARK_ZONE} or devices {prefix}* already exist and were not created by '
+                f'this command, refusing to delete them.'
+            )
+        # left over by an interrupted or --keep run
+        existing.delete()
+        zone = ParkingZone.objects.create(
+            name=BENCHMARK_ZONE_NAME, code=BENCHMARK_ZONE, total_slots=count, daily_target=1,
+            # no offline alerts while requests are queued
+            offline_timeout=3600,
+        )
+        devices = Device.objects.bulk_create([
+            Device(device_code=f'{BENCHMARK_ZONE}-{i}', zone=zone, slot_number=str(i))
+            for i in range(count)
+        ])
+        return zone, [device.device_code for device in devices]
+
+    @contextmanager
+    def setup(self, name):
+        if name is None:
+            yield
+            return
+        options, ingest_mode = SETUPS[name]
+        # connections opened from now on, in every thread, read these options
+        database = connections.settings['default']
+        saved = database.get('OPTIONS', {})
+        connections.close_all()
+        database['OPTIONS'] = options
+        connection.ensure_connection()
+        try:
+            with override_settings(INGEST_MODE=ingest_mode):
+                yield
+        finally:
+            database['OPTIONS'] = saved
+            connections.close_all()
+
+    def build_payloads(self, codes, count, run):
+        # unique (device, timestamp) pairs so no request is a duplicate
+        base = timezone.now() - timedelta(minutes=1 + run)
+        return [
+            json.dumps({
+                'device_code': codes[i % len(codes)],
+                'voltage': '220.00',
+                'current': '5.00',
+                'power_factor': '0.90',
+                'timestamp': (base - timedelta(milliseconds=i)).isoformat(),
+            })
+            for i in range(count)
+        ]
+
+    def run_wsgi(self, payloads, concurrency):
+        local = threading.local()
+
+        def send(payload):
+            if not hasattr(local, 'client'):
+                local.client = Client()
+            start = time.perf_counter()
+            response = local.client.post(ENDPOINTS['wsgi'], payload, content_type='application/json')
+            return response.status_code, time.perf_counter() - start
+
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            results = list(pool.map(send, payloads))
+        return results, time.perf_counter() - start
+
+    async def run_asgi(self, payloads, concurrency):
+        client = AsyncClient()
+        slots = asyncio.Semaphore(concurrency)
+
+        async def send(payload):
+            async with slots:
+                start = time.perf_counter()
+                response = await client.post(ENDPOINTS['asgi'], payload, content_type='application/json')
+                return response.status_code, time.perf_counter() - start
+
+        start = time.perf_counter()
+        results = await asyncio.gather(*[send(payload) for payload in payloads])
+        return results, time.perf_counter() - start
+
+    def report(self, mode, results, elapsed):
+        latencies = sorted(latency * 1000 for _, latency in results)
+        ok = sum(1 for status, _ in results if status == 201)
+
+        def percentile(p):
+            return latencies[min(len(latencies) - 1, int(len(latencies) * p))]
+
+        self.stdout.write(
+            f'{mode.upper()}: {len(results)} requests in {elapsed:.2f}s, '
+            f'{len(results) / elapsed:.0f} req/s, {ok} ok, {len(results) - ok} failed, '
+            f'p50 {percentile(0.50):.1f}ms, p95 {percentile(0.95):.1f}ms, p99 {percentile(0.99):.1f}ms'
+        )
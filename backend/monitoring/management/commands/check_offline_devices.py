@@ -0,0 +1,34 @@
+from django.core.management.base import BaseCommand
+import time
+from monitoring.tasks import check_offline_devices
+
+
+class Command(BaseCommand):
+    help = 'Raise DEVICE_OFFLINE and CONNECTION_RESTORED alerts, every --interval seconds'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--interval',
+            type=float,
+            default=30.0,
+            help='Seconds between checks',
+        )
+        parser.add_argument(
+            '--once',
+            action='store_true',
+            help='Run a single check and exit',
+        )
+
+    def handle(self, *args, **kwargs):
+        try:
+            while True:
+                result = check_offline_devices()
+                self.stdout.write(
+                    f"{result['offline']} offline, {result['restored']} restored "
+                    f"in {result['duration']}s"
+                )
+                if kwargs['once']:
+                    break
+                time.sleep(kwargs['interval'])
+        except KeyboardInterrupt:
+            pass
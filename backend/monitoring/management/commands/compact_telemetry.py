@@ -0,0 +1,32 @@
+from datetime import timedelta
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+from monitoring.compaction import MIN_HOT_DAYS, compact_telemetry
+
+
+class Command(BaseCommand):
+    help = 'Pack readings older than TELEMETRY_HOT_DAYS into one compressed chunk per device and day'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--days',
+            type=int,
+            default=settings.TELEMETRY_HOT_DAYS,
+            help='Days of readings left in TelemetryData',
+        )
+        parser.add_argument(
+            '--batch',
+            type=int,
+            default=100,
+            help='Devices compacted per transaction',
+        )
+
+    def handle(self, *args, **kwargs):
+        if kwargs['days'] < MIN_HOT_DAYS:
+            raise CommandError(f'Readings must stay hot at least {MIN_HOT_DAYS} days.')
+        chunks, readings = compact_telemetry(
+            timezone.localdate() - timedelta(days=kwargs['days']),
+            device_batch=kwargs['batch'],
+        )
+        self.stdout.write(self.style.SUCCESS(f'Compacted {readings} readings into {chunks} chunks'))
@@ -0,0 +1,146 @@
+from collections import Counter
+from django.core.management.base import BaseCommand
+from django.db import transaction
+import logging
+import time
+from monitoring.ingestion import ingest_telemetry, ingest_parking_logs
+from monitoring.models import ParkingLog
+from monitoring.registry import device_registry
+from monitoring.serializers import ParkingLogSerializer
+from monitoring.spool import spool, decode_telemetry, decode_parking_log
+
+logger = logging.getLogger(__name__)
+
+# parking_log entries come from /api/parking-log/bulk/ and are deduplicated
+# like that endpoint does, parking_log_event entries from
+# /api/parking-log/ are all stored, as INGEST_MODE "sync" stores them
+DECODERS = {
+    'telemetry': decode_telemetry,
+    'parking_log': decode_parking_log,
+    'parking_log_event': decode_parking_log,
+}
+
+
+class Command(BaseCommand):
+    help = 'Write readings queued by INGEST_MODE="spool" to the database'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=5000,
+            help='Spool entries written per database transaction',
+        )
+        parser.add_argument(
+            '--interval',
+            type=float,
+            default=1.0,
+            help='Seconds to sleep when the spool is empty',
+        )
+        parser.add_argument(
+            '--once',
+            action='store_true',
+            help='Exit once the spool is empty instead of waiting for more',
+        )
+
+    def handle(self, *args, **kwargs):
+        try:
+            while True:
+                if self.drain_batch(kwargs['batch_size']):
+                    continue
+                if kwargs['once']:
+                    break
+                time.sleep(kwargs['interval'])
+        except KeyboardInterrupt:
+            pass
+
+        stats = spool.stats()
+        self.stdout.write(f"Spool depth: {stats['depth']}, lag: {stats['lag_seconds']}s")
+
+    def drain_batch(self, batch_size):
+        entries = spool.read(spool.offset(), batch_size)
+        if not entries:
+            return 0
+
+        devices = device_registry.get_many({
+            payload.get('device_code') for _, _, payload in entries if isinstance(payload, dict)
+        })
+        items = []
+        dead_letters = []
+        skipped = 0
+
+        for entry in entries:
+            entry_id, kind, payload = entry
+            try:
+                device = devices.get(payload['device_code'])
+                if device is None or kind not in DECODERS:
+                    # device deleted since the reading was accepted
+                    skipped += 1
+                    continue
+                item = DECODERS[kind](payload)
+            except Exception as e:
+                dead_letters.append((*entry, f'{type(e).__name__}: {e}'))
+                continue
+            item['device_id'] = device.id
+            item['zone_id'] = device.zone_id
+            item['offline_timeout'] = device.offline_timeout
+            items.append((entry, kind, item))
+
+        with transaction.atomic():
+            try:
+                with transaction.atomic():
+                    counts = self.write(items)
+            except Exception:
+                # one bad entry fails the whole batch, write them one by one
+                # in savepoints and set the failing ones aside
+                counts = Counter()
+                for entry, kind, item in items:
+                    try:
+                        with transaction.atomic():
+                            counts += self.write([(entry, kind, item)])
+                    except Exception as e:
+                        logger.exception('Spool entry %d failed', entry[0])
+                        dead_letters.append((*entry, f'{type(e).__name__}: {e}'))
+
+        # only now is the batch safe to forget, a crash before this line
+        # replays it on the next start
+        spool.commit(entries[-1][0], dead_letters)
+
+        self.stdout.write(
+            f"Drained {len(entries)} entries: {counts['telemetry']} telemetry, "
+            f"{counts['duplicates']} duplicates, {counts['parking_logs']} parking logs, "
+            f"{counts['dropped']} parking logs dropped, {skipped} skipped, "
+            f"{len(dead_letters)} dead letters"
+        )
+        return len(entries)
+
+    def write(self, items):
+        batches = {kind: [] for kind in DECODERS}
+        for _, kind, item in items:
+            batches[kind].append(item)
+        created, duplicates = ingest_telemetry(batches['telemetry'], heartbeat=False)
+        events = ParkingLogSerializer.write_many(self.unstored(batches['parking_log_event']))
+        logs, dropped = ingest_parking_logs(batches['parking_log'])
+        return Counter(
+            telemetry=len(created),
+            duplicates=len(duplicates),
+            parking_logs=len(events) + len(logs),
+            dropped=sum(dropped.values()),
+        )
+
+    def unstored(self, events):
+        """Events not written yet, a batch replayed after a crash finds its
+        events already stored
+        """
+        if not events:
+            return events
+        stored = set(
+            ParkingLog.objects.filter(
+                device_id__in={event['device_id'] for event in events},
+                timestamp__in={event['timestamp'] for event in events},
+            ).order_by().values_list('device_id', 'timestamp', 'is_occupied')
+        )
+        return [
+            event for event in events
+            if (event['device_id'], event['timestamp'], event['is_occupied']) not in stored
+        ]
@@ -0,0 +1,10 @@
+from django.core.management.base import BaseCommand
+from monitoring.ingestion import rebuild_device_states
+
+
+class Command(BaseCommand):
+    help = 'Recompute the current state of every device from its parking logs and telemetry'
+
+    def handle(self, *args, **kwargs):
+        count = rebuild_device_states()
+        self.stdout.write(self.style.SUCCESS(f'Rebuilt the state of {count} devices'))
@@ -0,0 +1,26 @@
+from datetime import date
+from django.core.management.base import BaseCommand
+from monitoring.rollups import rebuild_energy_rollups, rebuild_rollups
+
+
+class Command(BaseCommand):
+    help = 'Recompute the hourly and daily zone rollups from the parking logs and telemetry'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--start',
+            type=date.fromisoformat,
+            help='First day to rebuild (YYYY-MM-DD), defaults to the oldest data',
+        )
+        parser.add_argument(
+            '--end',
+            type=date.fromisoformat,
+            help='Last day to rebuild (YYYY-MM-DD), defaults to the newest data',
+        )
+
+    def handle(self, *args, **kwargs):
+        count = rebuild_rollups(kwargs['start'], kwargs['end'])
+        energy = rebuild_energy_rollups(kwargs['start'], kwargs['end'])
+        self.stdout.write(self.style.SUCCESS(
+            f'Rebuilt {count} daily zone rollups and {energy} daily energy rollups'
+        ))
@@ -0,0 +1,26 @@
+from datetime import date
+from django.core.management.base import BaseCommand, CommandError
+from monitoring import retention
+
+
+class Command(BaseCommand):
+    help = 'Insert archived rows listed in the archive manifest back into their table'
+
+    def add_arguments(self, parser):
+        parser.add_argument('table', choices=list(retention.TABLES))
+        parser.add_argument(
+            '--start',
+            type=date.fromisoformat,
+            help='First day to restore (YYYY-MM-DD), defaults to the oldest archived',
+        )
+        parser.add_argument(
+            '--end',
+            type=date.fromisoformat,
+            help='Last day to restore (YYYY-MM-DD), defaults to the newest archived',
+        )
+
+    def handle(self, *args, **kwargs):
+        if retention.pa is None:
+            raise CommandError('restore_archive needs the pyarrow package.')
+        count = retention.restore_archive(kwargs['table'], kwargs['start'], kwargs['end'])
+        self.stdout.write(self.style.SUCCESS(f'Restored {count} archived {kwargs["table"]} rows'))
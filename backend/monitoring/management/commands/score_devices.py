@@ -0,0 +1,48 @@
+from datetime import timedelta
+from django.core.management.base import BaseCommand
+import time
+from monitoring.health import score_devices
+from monitoring.models import Device
+
+
+class Command(BaseCommand):
+    help = 'Compute the health score of devices with new data, every --interval seconds'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--interval',
+            type=float,
+            default=300.0,
+            help='Seconds between runs',
+        )
+        parser.add_argument(
+            '--once',
+            action='store_true',
+            help='Run once and exit',
+        )
+        parser.add_argument(
+            '--all',
+            action='store_true',
+            help='Score every device, not only the ones with new data',
+        )
+        parser.add_argument(
+            '--window',
+            type=float,
+            default=24.0,
+            help='Hours of history the score is based on',
+        )
+
+    def handle(self, *args, **kwargs):
+        try:
+            while True:
+                started = time.monotonic()
+                count = score_devices(
+                    Device.objects.values('pk') if kwargs['all'] else None,
+                    window=timedelta(hours=kwargs['window']),
+                )
+                self.stdout.write(f'{count} devices scored in {time.monotonic() - started:.3f}s')
+                if kwargs['once']:
+                    break
+                time.sleep(kwargs['interval'])
+        except KeyboardInterrupt:
+            pass
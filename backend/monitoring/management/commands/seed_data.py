@@ -2,6 +2,9 @@ from django.core.management.base import BaseCommand
 from django.utils import timezone
 from datetime import timedelta, datetime
 import random
+from decimal import Decimal
+from monitoring.ingestion import ingest_telemetry, rebuild_device_states
+from monitoring.rollups import rebuild_energy_rollups, rebuild_rollups
 from monitoring.models import ParkingZone, Device, TelemetryData, ParkingLog, Alert
 
 class Command(BaseCommand):
@@ -39,6 +42,12 @@ class Command(BaseCommand):
             self.generate_today_telemetry(devices)
             self.generate_today_parking_logs(devices)
         
+        # the parking logs above bypass ingestion, derive state and rollups
+        # from them; readings went through ingestion but arrived out of order
+        rebuild_device_states()
+        rebuild_rollups()
+        rebuild_energy_rollups()
+        
         if kwargs['with_alerts']:
             self.generate_alerts(devices)
         
@@ -106,33 +115,16 @@ class Command(BaseCommand):
 
     def generate_today_telemetry(self, devices):
         now = timezone.now()
-        count = 0
+        readings = []
         
         for device in devices:
             num_records = random.randint(5, 15)
             
             for i in range(num_records):
                 timestamp = now - timedelta(minutes=random.randint(1, 480))
-                
-                voltage = round(random.uniform(215.0, 225.0), 2)
-                current = round(random.uniform(3.5, 7.5), 2)
-                power_factor = round(random.uniform(0.85, 0.98), 2)
-                
-                if random.random() < 0.05:
-                    current = round(random.uniform(15.0, 25.0), 2)
-                
-                try:
-                    TelemetryData.objects.create(
-                        device=device,
-                        voltage=voltage,
-                        current=current,
-                        power_factor=power_factor,
-                        timestamp=timestamp
-                    )
-                    count += 1
-                except Exception:
-                    pass
+                readings.append(self.reading(device, timestamp, high_power=0.05))
         
+        count = self.ingest(readings)
         self.stdout.write(f'  ✓ Created {count} telemetry records for today')
 
     def generate_historical_telemetry(self, devices):
@@ -141,6 +133,7 @@ class Command(BaseCommand):
         
         for day in range(7):
             day_start = now - timedelta(days=day)
+            readings = []
             
             for device in devices:
                 for hour in range(24):
@@ -152,28 +145,40 @@ class Command(BaseCommand):
                         minute=random.randint(0, 59),
                         second=random.randint(0, 59)
                     )
-                    
-                    voltage = round(random.uniform(215.0, 225.0), 2)
-                    current = round(random.uniform(3.5, 7.5), 2)
-                    power_factor = round(random.uniform(0.85, 0.98), 2)
-                    
-                    if random.random() < 0.03:
-                        current = round(random.uniform(15.0, 25.0), 2)
-                    
-                    try:
-                        TelemetryData.objects.create(
-                            device=device,
-                            voltage=voltage,
-                            current=current,
-                            power_factor=power_factor,
-                            timestamp=timestamp
-                        )
-                        count += 1
-                    except Exception:
-                        pass
+                    readings.append(self.reading(device, timestamp, high_power=0.03))
+            
+            count += self.ingest(readings)
         
         self.stdout.write(f'  ✓ Created {count} historical telemetry records')
 
+    def reading(self, device, timestamp, high_power):
+        voltage = round(random.uniform(215.0, 225.0), 2)
+        current = round(random.uniform(3.5, 7.5), 2)
+        power_factor = round(random.uniform(0.85, 0.98), 2)
+        
+        # anomalies for the alert rules (HIGH_POWER, LOW_VOLTAGE) to catch
+        if random.random() < high_power:
+            current = round(random.uniform(15.0, 25.0), 2)
+        if random.random() < 0.02:
+            voltage = round(random.uniform(200.0, 209.0), 2)
+        
+        return {
+            'device_id': device.id,
+            'zone_id': device.zone_id,
+            'voltage': Decimal(str(voltage)),
+            'current': Decimal(str(current)),
+            'power_factor': Decimal(str(power_factor)),
+            'timestamp': timestamp,
+        }
+
+    def ingest(self, readings):
+        """Write readings like the API does, so the alert rules see them"""
+        count = 0
+        for offset in range(0, len(readings), 5000):
+            created, _ = ingest_telemetry(readings[offset:offset + 5000], heartbeat=False)
+            count += len(created)
+        return count
+
     def generate_today_parking_logs(self, devices):
         now = timezone.now()
         today_start = now.replace(hour=0, minute=0, second=0, microsecond=0)
@@ -274,33 +279,8 @@ class Command(BaseCommand):
             )
             count += 1
         
-        # High power alerts
-        high_power_devices = random.sample(devices, k=min(8, len(devices)))
-        for device in high_power_devices:
-            power_value = round(random.uniform(1500, 2500), 2)
-            Alert.objects.create(
-                device=device,
-                severity='WARNING',
-                alert_type='HIGH_POWER',
-                message=f'Abnormal power usage: {power_value}W (threshold: 1500W)',
-                is_acknowledged=random.choice([True, False]),
-                created_at=now - timedelta(hours=random.randint(1, 8))
-            )
-            count += 1
-        
-        # Low voltage alerts
-        voltage_devices = random.sample(devices, k=min(6, len(devices)))
-        for device in voltage_devices:
-            voltage = round(random.uniform(200, 210), 2)
-            Alert.objects.create(
-                device=device,
-                severity='WARNING',
-                alert_type='LOW_VOLTAGE',
-                message=f'Voltage below normal: {voltage}V (expected: 215-225V)',
-                is_acknowledged=random.choice([True, False]),
-                created_at=now - timedelta(hours=random.randint(2, 12))
-            )
-            count += 1
+        # HIGH_POWER and LOW_VOLTAGE alerts come from the alert rules while
+        # the telemetry is ingested
         
         # Connection restored
         restored_devices = random.sample(devices, k=min(3, len(devices)))
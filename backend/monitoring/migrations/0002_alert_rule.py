@@ -0,0 +1,138 @@
+# Generated by Django 6.0.2 on 2026-10-18 03:37
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+DEFAULT_RULES = [
+    {
+        "alert_type": "HIGH_POWER",
+        "metric": "power",
+        "operator": "gt",
+        "threshold": 1500,
+        "severity": "WARNING",
+        "message": "Abnormal power usage: {value:.2f}W (threshold: {threshold:g}W)",
+    },
+    {
+        "alert_type": "LOW_VOLTAGE",
+        "metric": "voltage",
+        "operator": "lt",
+        "threshold": 210,
+        "severity": "WARNING",
+        "message": "Voltage below normal: {value:.2f}V (threshold: {threshold:g}V)",
+    },
+    {
+        "alert_type": "HIGH_VOLTAGE",
+        "metric": "voltage",
+        "operator": "gt",
+        "threshold": 240,
+        "severity": "WARNING",
+        "message": "Voltage above normal: {value:.2f}V (threshold: {threshold:g}V)",
+    },
+    {
+        "alert_type": "LOW_POWER_FACTOR",
+        "metric": "power_factor",
+        "operator": "lt",
+        "threshold": 0.8,
+        "severity": "WARNING",
+        "message": "Power factor below floor: {value:.2f} (threshold: {threshold:g})",
+    },
+]
+
+
+def create_default_rules(apps, schema_editor):
+    AlertRule = apps.get_model("monitoring", "AlertRule")
+    AlertRule.objects.bulk_create([AlertRule(**rule) for rule in DEFAULT_RULES])
+
+
+def delete_default_rules(apps, schema_editor):
+    AlertRule = apps.get_model("monitoring", "AlertRule")
+    AlertRule.objects.filter(zone=None, device=None).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("monitoring", "0001_initial"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="AlertRule",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("alert_type", models.CharField(db_index=True, max_length=50)),
+                (
+                    "metric",
+                    models.CharField(
+                        choices=[
+                            ("power", "Power (W)"),
+                            ("voltage", "Voltage (V)"),
+                            ("current", "Current (A)"),
+                            ("power_factor", "Power factor"),
+                        ],
+                        max_length=20,
+                    ),
+                ),
+                (
+                    "operator",
+                    models.CharField(
+                        choices=[("gt", "Above"), ("lt", "Below")], max_length=2
+                    ),
+                ),
+                ("threshold", models.FloatField()),
+                (
+                    "severity",
+                    models.CharField(
+                        choices=[
+                            ("INFO", "Info"),
+                            ("WARNING", "Warning"),
+                            ("CRITICAL", "Critical"),
+                        ],
+                        default="WARNING",
+                        max_length=10,
+                    ),
+                ),
+                (
+                    "message",
+                    models.CharField(
+                        help_text="Format string, {value} and {threshold} are filled in",
+                        max_length=200,
+                    ),
+                ),
+                ("is_enabled", models.BooleanField(default=True)),
+                ("updated_at", models.DateTimeField(auto_now=True)),
+                (
+                    "device",
+                    models.ForeignKey(
+                        blank=True,
+                        null=True,
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="alert_rules",
+                        to="monitoring.device",
+                    ),
+                ),
+                (
+                    "zone",
+                    models.ForeignKey(
+                        blank=True,
+                        null=True,
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="alert_rules",
+                        to="monitoring.parkingzone",
+                    ),
+                ),
+            ],
+            options={
+                "ordering": ["alert_type", "zone", "device"],
+            },
+        ),
+        migrations.RunPython(create_default_rules, delete_default_rules),
+    ]
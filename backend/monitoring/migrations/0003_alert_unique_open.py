@@ -0,0 +1,46 @@
+# Generated by Django 6.0.2 on 2026-10-18 03:40
+
+from django.db import migrations, models
+from django.utils import timezone
+
+
+def acknowledge_duplicate_open_alerts(apps, schema_editor):
+    # keep the newest open alert per (device, alert_type) so the constraint
+    # can be added to a database that already holds duplicates
+    Alert = apps.get_model("monitoring", "Alert")
+    seen = set()
+    duplicates = []
+    open_alerts = (
+        Alert.objects.filter(is_acknowledged=False)
+        .order_by("device_id", "alert_type", "-created_at", "-id")
+        .values_list("id", "device_id", "alert_type")
+    )
+    for pk, device_id, alert_type in open_alerts.iterator():
+        if (device_id, alert_type) in seen:
+            duplicates.append(pk)
+        else:
+            seen.add((device_id, alert_type))
+    Alert.objects.filter(pk__in=duplicates).update(
+        is_acknowledged=True, acknowledged_at=timezone.now()
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("monitoring", "0002_alert_rule"),
+    ]
+
+    operations = [
+        migrations.RunPython(
+            acknowledge_duplicate_open_alerts, migrations.RunPython.noop
+        ),
+        migrations.AddConstraint(
+            model_name="alert",
+            constraint=models.UniqueConstraint(
+                condition=models.Q(("is_acknowledged", False)),
+                fields=("device", "alert_type"),
+                name="unique_open_alert",
+            ),
+        ),
+    ]
@@ -0,0 +1,19 @@
+# Generated by Django 6.0.2 on 2026-10-18 03:41
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("monitoring", "0003_alert_unique_open"),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="device",
+            index=models.Index(
+                fields=["is_active", "last_seen"], name="monitoring__is_acti_021634_idx"
+            ),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 6.0.2 on 2026-10-18 03:43
+
+import django.core.validators
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("monitoring", "0004_device_liveness_index"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="parkingzone",
+            name="offline_timeout",
+            field=models.PositiveIntegerField(
+                default=120,
+                help_text="Seconds without a heartbeat before a device counts as offline",
+                validators=[django.core.validators.MinValueValidator(10)],
+            ),
+        ),
+    ]
@@ -0,0 +1,19 @@
+# Generated by Django 6.0.2 on 2026-10-18 03:46
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("monitoring", "0005_zone_offline_timeout"),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="alert",
+            index=models.Index(
+                fields=["acknowledged_at", "id"], name="monitoring__acknowl_58b599_idx"
+            ),
+        ),
+    ]
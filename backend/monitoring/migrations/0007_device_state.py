@@ -0,0 +1,99 @@
+# Generated by Django 6.0.2 on 2026-10-18 03:50
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import OuterRef, Subquery
+
+
+def backfill_device_states(apps, schema_editor):
+    # latest log and reading per device, rebuild_device_state replays the
+    # whole history for exact occupancy change times
+    Device = apps.get_model("monitoring", "Device")
+    DeviceState = apps.get_model("monitoring", "DeviceState")
+    ParkingLog = apps.get_model("monitoring", "ParkingLog")
+    TelemetryData = apps.get_model("monitoring", "TelemetryData")
+
+    latest_log = ParkingLog.objects.filter(device=OuterRef("pk")).order_by("-timestamp")
+    latest_reading = TelemetryData.objects.filter(device=OuterRef("pk")).order_by(
+        "-timestamp"
+    )
+    devices = Device.objects.annotate(
+        log_occupied=Subquery(latest_log.values("is_occupied")[:1]),
+        log_at=Subquery(latest_log.values("timestamp")[:1]),
+        reading_voltage=Subquery(latest_reading.values("voltage")[:1]),
+        reading_current=Subquery(latest_reading.values("current")[:1]),
+        reading_power_factor=Subquery(latest_reading.values("power_factor")[:1]),
+        reading_at=Subquery(latest_reading.values("timestamp")[:1]),
+    )
+    DeviceState.objects.bulk_create(
+        [
+            DeviceState(
+                device_id=device.pk,
+                is_occupied=device.log_occupied,
+                occupancy_changed_at=device.log_at,
+                parking_log_at=device.log_at,
+                voltage=device.reading_voltage,
+                current=device.reading_current,
+                power_factor=device.reading_power_factor,
+                telemetry_at=device.reading_at,
+            )
+            for device in devices.iterator()
+            if device.log_at is not None or device.reading_at is not None
+        ],
+        batch_size=500,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("monitoring", "0006_alert_acknowledged_index"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="DeviceState",
+            fields=[
+                (
+                    "device",
+                    models.OneToOneField(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        primary_key=True,
+                        related_name="state",
+                        serialize=False,
+                        to="monitoring.device",
+                    ),
+                ),
+                ("is_occupied", models.BooleanField(null=True)),
+                ("occupancy_changed_at", models.DateTimeField(blank=True, null=True)),
+                ("parking_log_at", models.DateTimeField(blank=True, null=True)),
+                (
+                    "voltage",
+                    models.DecimalField(
+                        blank=True, decimal_places=2, max_digits=6, null=True
+                    ),
+                ),
+                (
+                    "current",
+                    models.DecimalField(
+                        blank=True, decimal_places=2, max_digits=6, null=True
+                    ),
+                ),
+                (
+                    "power_factor",
+                    models.DecimalField(
+                        blank=True, decimal_places=2, max_digits=4, null=True
+                    ),
+                ),
+                ("telemetry_at", models.DateTimeField(blank=True, null=True)),
+            ],
+            options={
+                "indexes": [
+                    models.Index(
+                        fields=["is_occupied"], name="monitoring__is_occu_d6e96e_idx"
+                    )
+                ],
+            },
+        ),
+        migrations.RunPython(backfill_device_states, migrations.RunPython.noop),
+    ]
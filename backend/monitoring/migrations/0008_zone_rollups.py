@@ -0,0 +1,123 @@
+# Generated by Django 6.0.2 on 2026-10-18 03:54
+
+import datetime
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import Count, F, Q
+from django.db.models.functions import TruncDate, TruncHour
+
+
+def backfill_rollups(apps, schema_editor):
+    ParkingLog = apps.get_model("monitoring", "ParkingLog")
+    ZoneDailyStats = apps.get_model("monitoring", "ZoneDailyStats")
+    ZoneHourlyStats = apps.get_model("monitoring", "ZoneHourlyStats")
+
+    counters = dict(
+        events=Count("id"),
+        occupied_events=Count("id", filter=Q(is_occupied=True)),
+        devices=Count("device", distinct=True),
+    )
+    logs = ParkingLog.objects.order_by()
+    ZoneHourlyStats.objects.bulk_create(
+        [
+            ZoneHourlyStats(**row)
+            for row in logs.values(
+                zone_id=F("device__zone"),
+                hour=TruncHour("timestamp", tzinfo=datetime.timezone.utc),
+            ).annotate(**counters)
+        ],
+        batch_size=500,
+    )
+    ZoneDailyStats.objects.bulk_create(
+        [
+            ZoneDailyStats(**row)
+            for row in logs.values(
+                zone_id=F("device__zone"), date=TruncDate("timestamp")
+            ).annotate(**counters)
+        ],
+        batch_size=500,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("monitoring", "0007_device_state"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="ZoneDailyStats",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("date", models.DateField()),
+                ("events", models.PositiveIntegerField(default=0)),
+                ("occupied_events", models.PositiveIntegerField(default=0)),
+                ("devices", models.PositiveIntegerField(default=0)),
+                (
+                    "zone",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="daily_stats",
+                        to="monitoring.parkingzone",
+                    ),
+                ),
+            ],
+            options={
+                "indexes": [
+                    models.Index(fields=["date"], name="monitoring__date_2a6ada_idx")
+                ],
+                "constraints": [
+                    models.UniqueConstraint(
+                        fields=("zone", "date"), name="unique_zone_date"
+                    )
+                ],
+            },
+        ),
+        migrations.CreateModel(
+            name="ZoneHourlyStats",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("hour", models.DateTimeField()),
+                ("events", models.PositiveIntegerField(default=0)),
+                ("occupied_events", models.PositiveIntegerField(default=0)),
+                ("devices", models.PositiveIntegerField(default=0)),
+                (
+                    "zone",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="hourly_stats",
+                        to="monitoring.parkingzone",
+                    ),
+                ),
+            ],
+            options={
+                "indexes": [
+                    models.Index(fields=["hour"], name="monitoring__hour_2b7ed7_idx")
+                ],
+                "constraints": [
+                    models.UniqueConstraint(
+                        fields=("zone", "hour"), name="unique_zone_hour"
+                    )
+                ],
+            },
+        ),
+        migrations.RunPython(backfill_rollups, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,65 @@
+# Generated by Django 6.0.2 on 2026-10-18 03:58
+
+import datetime
+from collections import defaultdict
+
+from django.db import migrations, models
+from django.utils import timezone
+
+
+def backfill_occupied_seconds(apps, schema_editor):
+    # replay the logs once, periods still open are counted when they close
+    ParkingLog = apps.get_model("monitoring", "ParkingLog")
+    ZoneDailyStats = apps.get_model("monitoring", "ZoneDailyStats")
+    ZoneHourlyStats = apps.get_model("monitoring", "ZoneHourlyStats")
+
+    hourly, daily = defaultdict(float), defaultdict(float)
+    occupied = {}
+    logs = ParkingLog.objects.order_by("device_id", "timestamp").values_list(
+        "device_id", "device__zone", "is_occupied", "timestamp"
+    )
+    for device_id, zone_id, is_occupied, timestamp in logs.iterator(chunk_size=5000):
+        if is_occupied:
+            occupied.setdefault(device_id, timestamp)
+            continue
+        start = occupied.pop(device_id, None)
+        while start is not None and start < timestamp:
+            hour = start.astimezone(datetime.timezone.utc).replace(
+                minute=0, second=0, microsecond=0
+            )
+            end = min(timestamp, hour + datetime.timedelta(hours=1))
+            hourly[zone_id, hour] += (end - start).total_seconds()
+            daily[zone_id, timezone.localdate(start)] += (end - start).total_seconds()
+            start = end
+
+    for model, field, seconds in (
+        (ZoneHourlyStats, "hour", hourly),
+        (ZoneDailyStats, "date", daily),
+    ):
+        rows = []
+        for (zone_id, bucket), value in seconds.items():
+            row, _ = model.objects.get_or_create(zone_id=zone_id, **{field: bucket})
+            row.occupied_seconds = value
+            rows.append(row)
+        model.objects.bulk_update(rows, ["occupied_seconds"], batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("monitoring", "0008_zone_rollups"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="zonedailystats",
+            name="occupied_seconds",
+            field=models.FloatField(default=0),
+        ),
+        migrations.AddField(
+            model_name="zonehourlystats",
+            name="occupied_seconds",
+            field=models.FloatField(default=0),
+        ),
+        migrations.RunPython(backfill_occupied_seconds, migrations.RunPython.noop),
+    ]
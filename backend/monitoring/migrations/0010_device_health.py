@@ -0,0 +1,45 @@
+# Generated by Django 6.0.2 on 2026-10-18 04:02
+
+import django.core.validators
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("monitoring", "0009_rollup_occupied_seconds"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="DeviceHealth",
+            fields=[
+                (
+                    "device",
+                    models.OneToOneField(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        primary_key=True,
+                        related_name="health",
+                        serialize=False,
+                        to="monitoring.device",
+                    ),
+                ),
+                (
+                    "score",
+                    models.PositiveSmallIntegerField(
+                        db_index=True,
+                        validators=[django.core.validators.MaxValueValidator(100)],
+                    ),
+                ),
+                ("uptime_ratio", models.FloatField()),
+                ("critical_alerts", models.PositiveIntegerField(default=0)),
+                ("warning_alerts", models.PositiveIntegerField(default=0)),
+                ("info_alerts", models.PositiveIntegerField(default=0)),
+                ("anomaly_rate", models.FloatField()),
+                ("voltage_cv", models.FloatField()),
+                ("readings", models.PositiveIntegerField(default=0)),
+                ("computed_at", models.DateTimeField()),
+            ],
+        ),
+    ]
@@ -0,0 +1,123 @@
+# Generated by Django 6.0.2 on 2026-10-18 04:04
+
+from collections import defaultdict
+
+import django.db.models.deletion
+import django.db.models.expressions
+import django.db.models.functions.comparison
+from django.db import migrations, models
+from django.utils import timezone
+
+
+def backfill_zone_energy(apps, schema_editor):
+    # replay the readings once, each one's power counts since the previous
+    # reading of its device, up to the zone's offline timeout
+    TelemetryData = apps.get_model("monitoring", "TelemetryData")
+    ZoneEnergyDaily = apps.get_model("monitoring", "ZoneEnergyDaily")
+
+    daily = defaultdict(lambda: [0.0, 0.0, 0, 0.0])
+    last = {}
+    readings = TelemetryData.objects.order_by("device_id", "timestamp").values_list(
+        "device_id",
+        "device__zone",
+        "device__zone__offline_timeout",
+        "timestamp",
+        "power",
+    )
+    for device_id, zone_id, timeout, timestamp, power in readings.iterator(
+        chunk_size=5000
+    ):
+        values = daily[zone_id, timezone.localdate(timestamp)]
+        if device_id in last:
+            seconds = min((timestamp - last[device_id]).total_seconds(), timeout)
+            values[0] += power * seconds / 3600
+        last[device_id] = timestamp
+        values[1] += power
+        values[2] += 1
+        values[3] = max(values[3], power)
+
+    ZoneEnergyDaily.objects.bulk_create(
+        [
+            ZoneEnergyDaily(
+                zone_id=zone_id,
+                date=date,
+                energy_wh=energy_wh,
+                power_sum=power_sum,
+                readings=readings,
+                peak_w=peak_w,
+            )
+            for (zone_id, date), (
+                energy_wh,
+                power_sum,
+                readings,
+                peak_w,
+            ) in daily.items()
+        ],
+        batch_size=500,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("monitoring", "0010_device_health"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="telemetrydata",
+            name="power",
+            field=models.GeneratedField(
+                db_persist=True,
+                expression=django.db.models.functions.comparison.Cast(
+                    django.db.models.expressions.CombinedExpression(
+                        django.db.models.expressions.CombinedExpression(
+                            models.F("voltage"), "*", models.F("current")
+                        ),
+                        "*",
+                        models.F("power_factor"),
+                    ),
+                    models.FloatField(),
+                ),
+                output_field=models.FloatField(),
+            ),
+        ),
+        migrations.CreateModel(
+            name="ZoneEnergyDaily",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("date", models.DateField()),
+                ("energy_wh", models.FloatField(default=0)),
+                ("power_sum", models.FloatField(default=0)),
+                ("readings", models.PositiveIntegerField(default=0)),
+                ("peak_w", models.FloatField(default=0)),
+                (
+                    "zone",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="energy_daily",
+                        to="monitoring.parkingzone",
+                    ),
+                ),
+            ],
+            options={
+                "indexes": [
+                    models.Index(fields=["date"], name="monitoring__date_acb4c4_idx")
+                ],
+                "constraints": [
+                    models.UniqueConstraint(
+                        fields=("zone", "date"), name="unique_zone_energy_date"
+                    )
+                ],
+            },
+        ),
+        migrations.RunPython(backfill_zone_energy, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,51 @@
+# Generated by Django 6.0.2 on 2026-10-18 04:12
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("monitoring", "0011_telemetry_power_zone_energy"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="TelemetryChunk",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("date", models.DateField()),
+                ("start", models.DateTimeField()),
+                ("end", models.DateTimeField()),
+                ("readings", models.PositiveIntegerField()),
+                ("data", models.BinaryField()),
+                (
+                    "device",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="telemetry_chunks",
+                        to="monitoring.device",
+                    ),
+                ),
+            ],
+            options={
+                "indexes": [
+                    models.Index(fields=["start"], name="monitoring__start_0e2342_idx")
+                ],
+                "constraints": [
+                    models.UniqueConstraint(
+                        fields=("device", "date"), name="unique_device_chunk_date"
+                    )
+                ],
+            },
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 6.0.2 on 2026-10-18 04:34
+
+import monitoring.models
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("monitoring", "0012_telemetry_chunk"),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name="alertrule",
+            name="message",
+            field=models.CharField(
+                help_text="Format string, {value} and {threshold} are filled in",
+                max_length=200,
+                validators=[monitoring.models.validate_rule_message],
+            ),
+        ),
+    ]
@@ -0,0 +1,32 @@
+# Generated by Django 6.0.2 on 2026-10-18 04:52
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("monitoring", "0013_alert_rule_message_validator"),
+    ]
+
+    operations = [
+        migrations.RemoveConstraint(
+            model_name="alert",
+            name="unique_open_alert",
+        ),
+        migrations.AddField(
+            model_name="alert",
+            name="resolved_at",
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddConstraint(
+            model_name="alert",
+            constraint=models.UniqueConstraint(
+                condition=models.Q(
+                    ("is_acknowledged", False), ("resolved_at__isnull", True)
+                ),
+                fields=("device", "alert_type"),
+                name="unique_open_alert",
+            ),
+        ),
+    ]
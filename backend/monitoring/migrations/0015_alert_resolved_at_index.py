@@ -0,0 +1,19 @@
+# Generated by Django 6.0.2 on 2026-10-18 05:20
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("monitoring", "0014_alert_resolved"),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="alert",
+            index=models.Index(
+                fields=["resolved_at"], name="monitoring__resolve_639135_idx"
+            ),
+        ),
+    ]
@@ -1,7 +1,27 @@
 from django.db import models
+from django.db.models import F
+from django.db.models.functions import Cast
 from django.utils import timezone
+from django.core.exceptions import ValidationError
 from django.core.validators import MinValueValidator, MaxValueValidator
 
+DEFAULT_OFFLINE_TIMEOUT = 120  # seconds
+
+# what str.format raises for placeholders other than {value} and {threshold}
+# or for format specs that do not fit a float
+MESSAGE_FORMAT_ERRORS = (KeyError, IndexError, ValueError, AttributeError, TypeError)
+
+
+def validate_rule_message(message):
+    try:
+        message.format(value=0.0, threshold=0.0)
+    except MESSAGE_FORMAT_ERRORS as e:
+        raise ValidationError(
+            'Only {value} and {threshold} can be filled in, with float format specs (%(error)s).',
+            params={'error': f'{type(e).__name__}: {e}'},
+        )
+
+
 class ParkingZone(models.Model):
     name = models.CharField(max_length=100, unique=True)
     code = models.CharField(max_length=20, unique=True)
@@ -10,6 +30,11 @@ class ParkingZone(models.Model):
         validators=[MinValueValidator(0)],
         help_text="Expected daily parking events",
     )
+    offline_timeout = models.PositiveIntegerField(
+        default=DEFAULT_OFFLINE_TIMEOUT,
+        validators=[MinValueValidator(10)],
+        help_text="Seconds without a heartbeat before a device counts as offline",
+    )
     created_at = models.DateTimeField(auto_now_add=True)
 
     class Meta:
@@ -32,6 +57,10 @@ class Device(models.Model):
     class Meta:
         unique_together = [['zone', 'slot_number']]
         ordering = ['zone', 'slot_number']
+        indexes = [
+            # stale device scan in check_offline_devices
+            models.Index(fields=['is_active', 'last_seen']),
+        ]
 
     def __str__(self):
         return f"{self.device_code} - Zone: {self.zone.name}"
@@ -41,9 +70,11 @@ class Device(models.Model):
         self.save(update_fields=['last_seen'])
 
     def is_offline(self):
-        if not self.last_seen:
+        from .heartbeat import heartbeats
+        last_seen = heartbeats.last_seen(self.pk) or self.last_seen
+        if not last_seen:
             return True
-        return (timezone.now() - self.last_seen).total_seconds() > 120  # offline if last seen more than 2 minutes
+        return (timezone.now() - last_seen).total_seconds() > self.zone.offline_timeout
     
 class TelemetryData(models.Model):
     device = models.ForeignKey(
@@ -60,6 +91,12 @@ class TelemetryData(models.Model):
     )
     timestamp = models.DateTimeField(db_index=True)
     received_at = models.DateTimeField(auto_now_add=True)
+    # watts, computed by the database on insert so reports can aggregate it
+    power = models.GeneratedField(
+        expression=Cast(F('voltage') * F('current') * F('power_factor'), models.FloatField()),
+        output_field=models.FloatField(),
+        db_persist=True,
+    )
 
     class Meta:
         ordering = ['-timestamp']
@@ -99,6 +136,188 @@ class ParkingLog(models.Model):
             status = "Free"
         return f"{self.device.device_code} - {status} at {self.timestamp}"
     
+class DeviceState(models.Model):
+    """Latest occupancy and telemetry of a device, one row per device.
+
+    Kept up to date by the ingestion paths in the same transaction as the
+    log rows, so current-state reads need neither ParkingLog nor
+    TelemetryData history. rebuild_device_state recomputes it.
+    """
+    device = models.OneToOneField(
+        Device,
+        on_delete=models.CASCADE,
+        primary_key=True,
+        related_name='state'
+    )
+    is_occupied = models.BooleanField(null=True)
+    # timestamp of the event that set the current occupancy
+    occupancy_changed_at = models.DateTimeField(null=True, blank=True)
+    # timestamp of the newest parking log, repeats included
+    parking_log_at = models.DateTimeField(null=True, blank=True)
+    voltage = models.DecimalField(max_digits=6, decimal_places=2, null=True, blank=True)
+    current = models.DecimalField(max_digits=6, decimal_places=2, null=True, blank=True)
+    power_factor = models.DecimalField(max_digits=4, decimal_places=2, null=True, blank=True)
+    telemetry_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['is_occupied']),
+        ]
+
+    def __str__(self):
+        return f"{self.device_id} - occupied: {self.is_occupied}"
+
+
+class ZoneHourlyStats(models.Model):
+    """Parking events of a zone in one UTC hour.
+
+    Rollups are incremented by the ingestion paths (rollups.py) in the same
+    transaction as the logs, events are counted in the zone the device
+    belonged to when they arrived. rebuild_rollups recomputes them.
+    """
+    zone = models.ForeignKey(
+        ParkingZone,
+        on_delete=models.CASCADE,
+        related_name='hourly_stats'
+    )
+    hour = models.DateTimeField()
+    events = models.PositiveIntegerField(default=0)
+    # events switching a slot to occupied
+    occupied_events = models.PositiveIntegerField(default=0)
+    # distinct devices that reported in the hour
+    devices = models.PositiveIntegerField(default=0)
+    # slot time spent occupied, counted when the slot is freed
+    occupied_seconds = models.FloatField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['zone', 'hour'], name='unique_zone_hour'),
+        ]
+        indexes = [
+            models.Index(fields=['hour']),
+        ]
+
+    def __str__(self):
+        return f"{self.zone} - {self.hour}: {self.events} events"
+
+
+class ZoneDailyStats(models.Model):
+    """Parking events of a zone in one local day (TIME_ZONE), see ZoneHourlyStats"""
+    zone = models.ForeignKey(
+        ParkingZone,
+        on_delete=models.CASCADE,
+        related_name='daily_stats'
+    )
+    date = models.DateField()
+    events = models.PositiveIntegerField(default=0)
+    occupied_events = models.PositiveIntegerField(default=0)
+    devices = models.PositiveIntegerField(default=0)
+    occupied_seconds = models.FloatField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['zone', 'date'], name='unique_zone_date'),
+        ]
+        indexes = [
+            models.Index(fields=['date']),
+        ]
+
+    def __str__(self):
+        return f"{self.zone} - {self.date}: {self.events} events"
+
+
+class TelemetryChunk(models.Model):
+    """One device-day of telemetry moved out of TelemetryData by
+    `manage.py compact_telemetry`. `data` holds the readings encoded by
+    compaction.encode_chunk: delta-of-delta timestamps and delta encoded
+    hundredths of voltage, current and power factor.
+    """
+    device = models.ForeignKey(
+        Device,
+        on_delete=models.CASCADE,
+        related_name='telemetry_chunks'
+    )
+    date = models.DateField()
+    # first and last reading in the chunk
+    start = models.DateTimeField()
+    end = models.DateTimeField()
+    readings = models.PositiveIntegerField()
+    data = models.BinaryField()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['device', 'date'], name='unique_device_chunk_date'),
+        ]
+        indexes = [
+            models.Index(fields=['start']),
+        ]
+
+    def __str__(self):
+        return f"{self.device.device_code} - {self.date}: {self.readings} readings"
+
+
+class ZoneEnergyDaily(models.Model):
+    """Energy drawn by the devices of a zone in one local day.
+
+    Incremented by the telemetry ingestion paths (rollups.py): a reading's
+    power counts for the time since the device's previous reading, up to
+    the zone's offline_timeout. rebuild_energy_rollups recomputes it.
+    """
+    zone = models.ForeignKey(
+        ParkingZone,
+        on_delete=models.CASCADE,
+        related_name='energy_daily'
+    )
+    date = models.DateField()
+    energy_wh = models.FloatField(default=0)
+    # sum and count of the readings' power, for the mean
+    power_sum = models.FloatField(default=0)
+    readings = models.PositiveIntegerField(default=0)
+    peak_w = models.FloatField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['zone', 'date'], name='unique_zone_energy_date'),
+        ]
+        indexes = [
+            models.Index(fields=['date']),
+        ]
+
+    def __str__(self):
+        return f"{self.zone} - {self.date}: {self.energy_wh / 1000:.2f} kWh"
+
+
+class DeviceHealth(models.Model):
+    """Latest 0-100 health score of a device and the inputs behind it.
+
+    Written by the batch scoring job (health.py, `manage.py score_devices`)
+    for the devices with new data, read as is by /api/devices/health/.
+    """
+    device = models.OneToOneField(
+        Device,
+        on_delete=models.CASCADE,
+        primary_key=True,
+        related_name='health'
+    )
+    score = models.PositiveSmallIntegerField(
+        validators=[MaxValueValidator(100)],
+        db_index=True
+    )
+    # share of the window covered by heartbeats
+    uptime_ratio = models.FloatField()
+    critical_alerts = models.PositiveIntegerField(default=0)
+    warning_alerts = models.PositiveIntegerField(default=0)
+    info_alerts = models.PositiveIntegerField(default=0)
+    # share of readings breaking an alert rule
+    anomaly_rate = models.FloatField()
+    # voltage standard deviation / mean
+    voltage_cv = models.FloatField()
+    readings = models.PositiveIntegerField(default=0)
+    computed_at = models.DateTimeField()
+
+    def __str__(self):
+        return f"{self.device_id} - health: {self.score}"
+
 class Alert(models.Model):
     SEVERITY_CHOICES = [
         ('INFO', 'Info'),
@@ -121,31 +340,141 @@ class Alert(models.Model):
     is_acknowledged = models.BooleanField(default=False)
     created_at = models.DateTimeField(auto_now_add=True)
     acknowledged_at = models.DateTimeField(null=True, blank=True)
+    # set when the condition cleared by itself (a DEVICE_OFFLINE device
+    # reported again); the alert stays for an operator to acknowledge but
+    # no longer blocks a new one of its type
+    resolved_at = models.DateTimeField(null=True, blank=True)
 
     class Meta:
         ordering = ['-created_at']
         indexes = [
             models.Index(fields=['device', 'alert_type', 'is_acknowledged']),
             models.Index(fields=['-created_at','severity']),
+            # acknowledgements feed of the alert stream
+            models.Index(fields=['acknowledged_at', 'id']),
+            # latest resolution, part of the alerts list ETag
+            models.Index(fields=['resolved_at']),
+        ]
+        constraints = [
+            # one open alert per device and type
+            models.UniqueConstraint(
+                fields=['device', 'alert_type'],
+                condition=models.Q(is_acknowledged=False, resolved_at__isnull=True),
+                name='unique_open_alert',
+            ),
         ]
 
     def __str__(self):
         return f"{self.severity} - {self.alert_type} - {self.device.device_code}"
+
+    @property
+    def is_open(self):
+        """Neither acknowledged nor resolved, blocks new alerts of its type"""
+        return not self.is_acknowledged and self.resolved_at is None
     
     @classmethod
     def create_if_not_exists(cls, device, alert_type, severity, message):
         """Prevent duplicate active alerts"""
-        existing = cls.objects.filter(
-            device=device,
-            alert_type=alert_type,
-            is_acknowledged=False
-        ).exists()
-
-        if not existing:
-            return cls.objects.create(
-                device=device,
-                alert_type=alert_type,
-                severity=severity,
-                message=message
-            )
-        return None
\ No newline at end of file
+        created = cls.bulk_create_if_not_exists([
+            cls(device=device, alert_type=alert_type, severity=severity, message=message)
+        ])
+        return created[0] if created else None
+
+    @classmethod
+    def bulk_create_if_not_exists(cls, alerts):
+        """Batch version of create_if_not_exists.
+
+        Pairs already open are skipped (open_alerts, from memory or one
+        query), the rest are inserted with conflicts ignored, so an alert
+        raced in by another worker is dropped by the unique_open_alert
+        constraint. The open alerts of the inserted pairs are then read
+        back: an alert is ours when its created_at matches, which also
+        gives it its pk.
+        Returns the alerts stored, with their pk.
+        """
+        from .alert_index import open_alerts
+        from .summary_cache import summary_cache
+
+        new_alerts = open_alerts.filter_new(alerts)
+        if not new_alerts:
+            return []
+
+        cls.objects.bulk_create(new_alerts, ignore_conflicts=True)
+        pairs = {(alert.device_id, alert.alert_type) for alert in new_alerts}
+        stored = {
+            (device_id, alert_type, created_at): pk
+            for pk, device_id, alert_type, created_at in cls.objects.filter(
+                device_id__in={device_id for device_id, _ in pairs},
+                alert_type__in={alert_type for _, alert_type in pairs},
+                is_acknowledged=False,
+                resolved_at__isnull=True,
+            ).order_by().values_list('pk', 'device_id', 'alert_type', 'created_at')
+            if (device_id, alert_type) in pairs
+        }
+        created = []
+        for alert in new_alerts:
+            alert.pk = stored.get((alert.device_id, alert.alert_type, alert.created_at))
+            if alert.pk is not None:
+                alert._state.adding = False
+                created.append(alert)
+
+        # open now, whichever worker stored them
+        open_alerts.add({(device_id, alert_type) for device_id, alert_type, _ in stored})
+        summary_cache.invalidate(timezone.localdate(alert.created_at) for alert in created)
+        return created
+
+class AlertRule(models.Model):
+    """Threshold checked against every telemetry reading.
+
+    Rules sharing an alert_type form one check: the rule without zone and
+    device is the default, a zone rule overrides it for that zone and a
+    device rule overrides both. A disabled override silences the check.
+    """
+    METRIC_CHOICES = [
+        ('power', 'Power (W)'),
+        ('voltage', 'Voltage (V)'),
+        ('current', 'Current (A)'),
+        ('power_factor', 'Power factor'),
+    ]
+    OPERATOR_CHOICES = [
+        ('gt', 'Above'),
+        ('lt', 'Below'),
+    ]
+
+    alert_type = models.CharField(max_length=50, db_index=True)
+    metric = models.CharField(max_length=20, choices=METRIC_CHOICES)
+    operator = models.CharField(max_length=2, choices=OPERATOR_CHOICES)
+    threshold = models.FloatField()
+    severity = models.CharField(
+        max_length=10,
+        choices=Alert.SEVERITY_CHOICES,
+        default='WARNING'
+    )
+    message = models.CharField(
+        max_length=200,
+        validators=[validate_rule_message],
+        help_text="Format string, {value} and {threshold} are filled in",
+    )
+    zone = models.ForeignKey(
+        ParkingZone,
+        on_delete=models.CASCADE,
+        null=True,
+        blank=True,
+        related_name='alert_rules'
+    )
+    device = models.ForeignKey(
+        Device,
+        on_delete=models.CASCADE,
+        null=True,
+        blank=True,
+        related_name='alert_rules'
+    )
+    is_enabled = models.BooleanField(default=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        ordering = ['alert_type', 'zone', 'device']
+
+    def __str__(self):
+        scope = self.device or self.zone or 'default'
+        return f"{self.alert_type} {self.metric} {self.operator} {self.threshold} ({scope})"
@@ -0,0 +1,16 @@
+from django.conf import settings
+from rest_framework.pagination import CursorPagination
+
+
+class AlertCursorPagination(CursorPagination):
+    """Keyset pagination for the alerts list.
+
+    Pages are selected with WHERE created_at < <last seen> rather than an
+    OFFSET, so a deep page costs the same as the first one and alerts
+    created while paging do not shift the following pages. id breaks ties
+    between alerts created in the same instant.
+    """
+    ordering = ('-created_at', '-id')
+    page_size = getattr(settings, 'ALERTS_PAGE_SIZE', 50)
+    page_size_query_param = 'page_size'
+    max_page_size = getattr(settings, 'ALERTS_MAX_PAGE_SIZE', 200)
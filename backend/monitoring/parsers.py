@@ -0,0 +1,65 @@
+import gzip
+import io
+import json
+from rest_framework.exceptions import ParseError, UnsupportedMediaType
+from rest_framework.parsers import BaseParser
+
+try:
+    import zstandard
+except ImportError:  # optional, only needed for Content-Encoding: zstd
+    zstandard = None
+
+DECOMPRESS_ERRORS = (OSError, EOFError) + ((zstandard.ZstdError,) if zstandard else ())
+
+
+class NDJSONParser(BaseParser):
+    """Newline-delimited JSON, parsed lazily.
+
+    request.data becomes a generator of (line_number, value) pairs read
+    straight from the request stream, so the body is never held in memory.
+    A line that is not valid JSON yields a ParseError as its value instead of
+    stopping the stream. Gzip and zstd bodies (Content-Encoding) are
+    decompressed on the fly.
+    """
+    media_type = 'application/x-ndjson'
+
+    # longest accepted line, a reading is well under 1 KB
+    max_line_length = 64 * 1024
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        request = (parser_context or {}).get('request')
+        encoding = request.META.get('HTTP_CONTENT_ENCODING', '') if request is not None else ''
+        return self._iter_lines(self._decompress(stream, encoding.strip().lower()))
+
+    def _decompress(self, stream, encoding):
+        if encoding in ('', 'identity'):
+            return stream
+        if encoding == 'gzip':
+            return gzip.GzipFile(fileobj=stream, mode='rb')
+        if encoding == 'zstd':
+            if zstandard is None:
+                raise UnsupportedMediaType('zstd', detail='zstd bodies need the zstandard package.')
+            return io.BufferedReader(zstandard.ZstdDecompressor().stream_reader(stream, read_across_frames=True))
+        raise UnsupportedMediaType(encoding, detail=f'Unsupported Content-Encoding "{encoding}".')
+
+    def _iter_lines(self, stream):
+        line_number = 0
+        try:
+            while True:
+                line = stream.readline(self.max_line_length + 1)
+                if not line:
+                    break
+                line_number += 1
+                if len(line) > self.max_line_length:
+                    raise ParseError(f'Line {line_number} is longer than {self.max_line_length} bytes.')
+
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    yield line_number, json.loads(line)
+                except ValueError as e:
+                    yield line_number, ParseError(f'Invalid JSON: {e}')
+        except DECOMPRESS_ERRORS as e:
+            # truncated or corrupt compressed body
+            raise ParseError(f'Could not decompress request body: {e}')
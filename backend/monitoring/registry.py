@@ -0,0 +1,158 @@
+import threading
+import time
+from collections import OrderedDict, namedtuple
+from django.conf import settings
+from .models import Device
+from .versioning import SharedVersion
+
+# offline_timeout is the zone's, energy rollups cap reading intervals with it
+DeviceEntry = namedtuple('DeviceEntry', ['id', 'zone_id', 'is_active', 'offline_timeout'])
+
+# cached marker for codes that do not exist, creating the device in this
+# process invalidates it, otherwise it expires after missing_ttl seconds
+Missing = namedtuple('Missing', ['expires_at'])
+
+
+class DeviceRegistry:
+    """Process-local LRU map of device_code -> DeviceEntry.
+
+    Ingestion looks devices up on every reading, this keeps those lookups off
+    the database. Entries are dropped by the signal handlers in signals.py
+    whenever a Device or ParkingZone changes. Note that QuerySet.update()
+    does not send signals, use clear() after bulk edits of devices.
+
+    Unknown codes are cached for `missing_ttl` seconds so floods of bad
+    codes stay off the database, a device created by another process
+    without the shared version is found once that entry expires.
+    """
+
+    def __init__(self, max_size=10000, shared_version=None, missing_ttl=30.0):
+        self.max_size = max_size
+        self.shared_version = shared_version
+        self.missing_ttl = missing_ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        # bumped on every invalidation so a lookup that raced with one
+        # does not put stale rows back into the cache
+        self._generation = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, device_code):
+        return self.get_many([device_code]).get(device_code)
+
+    def get_many(self, device_codes):
+        """Resolve codes to entries, loading all misses with one query"""
+        found, missing, generation = self._lookup(device_codes)
+        if missing:
+            rows = self._query(missing)
+            found.update(self._store(missing, rows, generation))
+        return found
+
+    async def aget_many(self, device_codes):
+        """get_many for async views, misses are loaded with the async ORM"""
+        found, missing, generation = self._lookup(device_codes)
+        if missing:
+            rows = [row async for row in self._query(missing)]
+            found.update(self._store(missing, rows, generation))
+        return found
+
+    def _lookup(self, device_codes):
+        self._check_shared_version()
+
+        found = {}
+        missing = set()
+        now = time.monotonic()
+        with self._lock:
+            for code in device_codes:
+                if not isinstance(code, str) or code in found:
+                    continue
+                entry = self._entries.get(code)
+                if entry is None or (isinstance(entry, Missing) and entry.expires_at <= now):
+                    missing.add(code)
+                    continue
+                self._entries.move_to_end(code)
+                self.hits += 1
+                if isinstance(entry, DeviceEntry):
+                    found[code] = entry
+            self.misses += len(missing)
+            return found, missing, self._generation
+
+    def _query(self, device_codes):
+        return Device.objects.filter(device_code__in=device_codes).order_by().values_list(
+            'device_code', 'id', 'zone_id', 'is_active', 'zone__offline_timeout'
+        )
+
+    def _store(self, missing, rows, generation):
+        loaded = {code: DeviceEntry(*values) for code, *values in rows}
+        unknown = Missing(time.monotonic() + self.missing_ttl)
+        with self._lock:
+            if generation != self._generation:
+                return loaded
+            for code in missing:
+                self._entries[code] = loaded.get(code, unknown)
+                self._entries.move_to_end(code)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+        return loaded
+
+    def invalidate_device(self, device_id, device_code=None):
+        with self._lock:
+            self._generation += 1
+            self._entries.pop(device_code, None)
+            self._drop(lambda entry: entry.id == device_id)
+        self._bump()
+
+    def invalidate_zone(self, zone_id):
+        with self._lock:
+            self._generation += 1
+            self._drop(lambda entry: entry.zone_id == zone_id)
+        self._bump()
+
+    def clear(self):
+        with self._lock:
+            self._generation += 1
+            self._entries.clear()
+        self._bump()
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'size': len(self._entries),
+                'max_size': self.max_size,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'hit_ratio': round(self.hits / lookups, 4) if lookups else None,
+            }
+
+    def _drop(self, predicate):
+        stale = [
+            code for code, entry in self._entries.items()
+            if isinstance(entry, DeviceEntry) and predicate(entry)
+        ]
+        for code in stale:
+            del self._entries[code]
+
+    def _bump(self):
+        if self.shared_version is not None:
+            self.shared_version.bump()
+
+    def _check_shared_version(self):
+        if self.shared_version is not None and self.shared_version.changed():
+            with self._lock:
+                self._generation += 1
+                self._entries.clear()
+
+
+device_registry = DeviceRegistry(
+    max_size=getattr(settings, 'DEVICE_REGISTRY_MAX_SIZE', 10000),
+    missing_ttl=getattr(settings, 'DEVICE_REGISTRY_MISSING_TTL', 30.0),
+    shared_version=(
+        SharedVersion('monitoring:device_registry:version')
+        if getattr(settings, 'DEVICE_REGISTRY_SHARED_VERSION', False) else None
+    ),
+)
@@ -0,0 +1,351 @@
+import hashlib
+import json
+import logging
+import os
+import time
+from collections import namedtuple
+from datetime import timedelta
+from decimal import Decimal
+from pathlib import Path
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.db import connection, transaction
+from django.db.models import FloatField, Q
+from django.db.models.functions import Cast
+from django.utils import timezone
+from .etags import catalog_version
+from .models import Alert, Device, ParkingLog, TelemetryChunk, TelemetryData
+from .rollups import day_bounds
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:  # optional, only needed to write or read archives
+    pa = pq = None
+
+logger = logging.getLogger(__name__)
+
+# Retention of the append-only tables. Every local day older than the
+# table's RETENTION_DAYS is exported, ARCHIVE_DEVICE_CHUNK devices per file,
+# to zstd compressed Parquet under ARCHIVE_PATH/<table>/<date>/, recorded in
+# ARCHIVE_PATH/manifest.json, then deleted in small transactions. The
+# rollups, DeviceState and DeviceHealth are kept, so reports and the
+# dashboard still cover archived days.
+
+# readings up to 24 hours old are accepted, younger days may still grow
+MIN_RETENTION_DAYS = 2
+# rows per Parquet row group, bounds the memory used by an export
+ROW_GROUP_SIZE = 50000
+
+# a column is (name, expression read from the database, kind)
+ArchiveTable = namedtuple('ArchiveTable', ['model', 'time_field', 'filter', 'columns'])
+
+TABLES = {
+    'telemetry': ArchiveTable(TelemetryData, 'timestamp', Q(), [
+        ('id', 'id', 'int'),
+        ('device_id', 'device_id', 'int'),
+        ('timestamp', 'timestamp', 'time'),
+        ('voltage', Cast('voltage', FloatField()), 'float'),
+        ('current', Cast('current', FloatField()), 'float'),
+        ('power_factor', Cast('power_factor', FloatField()), 'float'),
+        ('received_at', 'received_at', 'time'),
+    ]),
+    'parking_logs': ArchiveTable(ParkingLog, 'timestamp', Q(), [
+        ('id', 'id', 'int'),
+        ('device_id', 'device_id', 'int'),
+        ('is_occupied', 'is_occupied', 'bool'),
+        ('timestamp', 'timestamp', 'time'),
+        ('created_at', 'created_at', 'time'),
+    ]),
+    # device-days compacted by compact_telemetry, archived still encoded
+    'telemetry_chunks': ArchiveTable(TelemetryChunk, 'start', Q(), [
+        ('id', 'id', 'int'),
+        ('device_id', 'device_id', 'int'),
+        ('date', 'date', 'date'),
+        ('start', 'start', 'time'),
+        ('end', 'end', 'time'),
+        ('readings', 'readings', 'int'),
+        ('data', 'data', 'bytes'),
+    ]),
+    # open alerts drive deduplication, only acknowledged or resolved ones
+    # (CONNECTION_RESTORED is resolved when created) are archived
+    'alerts': ArchiveTable(Alert, 'created_at', Q(is_acknowledged=True) | Q(resolved_at__isnull=False), [
+        ('id', 'id', 'int'),
+        ('device_id', 'device_id', 'int'),
+        ('severity', 'severity', 'str'),
+        ('alert_type', 'alert_type', 'str'),
+        ('message', 'message', 'str'),
+        ('is_acknowledged', 'is_acknowledged', 'bool'),
+        ('created_at', 'created_at', 'time'),
+        ('acknowledged_at', 'acknowledged_at', 'time'),
+        ('resolved_at', 'resolved_at', 'time'),
+    ]),
+}
+
+
+def require_pyarrow():
+    if pa is None:
+        raise ImproperlyConfigured('Archiving needs the pyarrow package.')
+
+
+def archive_path():
+    return Path(settings.ARCHIVE_PATH)
+
+
+def load_manifest(root=None):
+    """The manifest of root (ARCHIVE_PATH by default): {'files': [...]}, one
+    entry per Parquet file with its table, date, device range and rows
+    """
+    path = Path(root or archive_path()) / 'manifest.json'
+    if not path.exists():
+        return {'files': []}
+    return json.loads(path.read_text())
+
+
+def archive(names=None, retention=None, root=None, now=None):
+    """Archive and purge the days past retention of the tables in names (all
+    of TABLES by default). retention maps table names to days, defaulting
+    to RETENTION_DAYS, None keeps a table. Returns {table: (files, rows)}.
+    """
+    require_pyarrow()
+    retention = {**settings.RETENTION_DAYS, **(retention or {})}
+    root = Path(root or archive_path())
+    today = timezone.localdate(now)
+    result = {}
+    for name in names or TABLES:
+        days = retention.get(name)
+        if days is None:
+            continue
+        if days < MIN_RETENTION_DAYS:
+            raise ValueError(f'{name} must be kept at least {MIN_RETENTION_DAYS} days.')
+        result[name] = archive_table(name, today - timedelta(days=days), root)
+
+    if any(rows for _, rows in result.values()):
+        # responses over purged alerts and cached summaries change
+        catalog_version.bump()
+    return result
+
+
+def archive_table(name, before, root):
+    """Export then delete the rows of the local days before `before`, oldest
+    day first. A day is exported per device range; each file is on disk and
+    in the manifest before any of its rows is deleted. Returns (files, rows).
+    """
+    spec = TABLES[name]
+    started = time.monotonic()
+    queryset = spec.model.objects.filter(spec.filter).order_by()
+    oldest = queryset.order_by(spec.time_field).values_list(spec.time_field, flat=True).first()
+    if oldest is None:
+        return 0, 0
+
+    device_ids = list(Device.objects.order_by('pk').values_list('pk', flat=True))
+    ranges = [
+        (device_ids[offset], device_ids[min(offset + settings.ARCHIVE_DEVICE_CHUNK, len(device_ids)) - 1])
+        for offset in range(0, len(device_ids), settings.ARCHIVE_DEVICE_CHUNK)
+    ]
+    manifest = load_manifest(root)
+    files = rows = 0
+
+    date = timezone.localdate(oldest)
+    while date < before:
+        start, end = day_bounds(date, date)
+        day = queryset.filter(**{f'{spec.time_field}__gte': start, f'{spec.time_field}__lt': end})
+        if day.exists():
+            for low, high in ranges:
+                ids = _export(spec, name, date, low, high, day.filter(device_id__gte=low, device_id__lte=high), root, manifest)
+                if ids:
+                    _delete(spec.model, ids)
+                    files += 1
+                    rows += len(ids)
+        date += timedelta(days=1)
+
+    logger.info('Archived %d %s rows in %d files in %.3fs', rows, name, files, time.monotonic() - started)
+    return files, rows
+
+
+def _export(spec, name, date, low, high, queryset, root, manifest):
+    """Write the rows of queryset to a Parquet file and record it in the
+    manifest. Returns the ids written, empty when there were none.
+    """
+    schema = pa.schema([(column, _arrow_type(kind)) for column, _, kind in spec.columns])
+    rows = queryset.order_by('device_id', spec.time_field).values_list(
+        *[expression for _, expression, _ in spec.columns]
+    ).iterator(chunk_size=ROW_GROUP_SIZE)
+
+    # an interrupted run may have archived part of this range already, its
+    # file is kept and the rows left over go to the next part
+    parts = sum(
+        1 for entry in manifest['files']
+        if (entry['table'], entry['date'], entry['devices']) == (name, date.isoformat(), [low, high])
+    )
+    relative = Path(name) / date.isoformat() / f'devices-{low}-{high}-{parts}.parquet'
+    path = root / relative
+    temporary = path.with_name(path.name + '.tmp')
+
+    ids = []
+    writer = None
+    try:
+        batch = []
+        for row in rows:
+            batch.append(row)
+            if len(batch) == ROW_GROUP_SIZE:
+                writer = writer or _writer(temporary, schema)
+                writer.write_table(_to_table(batch, schema))
+                ids += [row[0] for row in batch]
+                batch = []
+        if batch:
+            writer = writer or _writer(temporary, schema)
+            writer.write_table(_to_table(batch, schema))
+            ids += [row[0] for row in batch]
+    finally:
+        if writer is not None:
+            writer.close()
+    if not ids:
+        return ids
+
+    _fsync(temporary)
+    os.replace(temporary, path)
+    manifest['files'].append({
+        'table': name,
+        'date': date.isoformat(),
+        'devices': [low, high],
+        'path': relative.as_posix(),
+        'rows': len(ids),
+        'columns': [column for column, _, _ in spec.columns],
+        'bytes': path.stat().st_size,
+        'sha256': hashlib.sha256(path.read_bytes()).hexdigest(),
+        'archived_at': timezone.now().isoformat(),
+    })
+    _save_manifest(root, manifest)
+    return ids
+
+
+def _delete(model, ids):
+    """Delete rows by id, ARCHIVE_DELETE_BATCH per transaction with a pause
+    between them so ingestion gets the write lock. Plain SQL: the per-row
+    delete signals only matter for open alerts, which are never archived.
+    """
+    qn = connection.ops.quote_name
+    table, pk = qn(model._meta.db_table), qn(model._meta.pk.column)
+    size = settings.ARCHIVE_DELETE_BATCH
+    for offset in range(0, len(ids), size):
+        chunk = ids[offset:offset + size]
+        with transaction.atomic(), connection.cursor() as cursor:
+            cursor.execute(f'DELETE FROM {table} WHERE {pk} IN ({", ".join(["%s"] * len(chunk))})', chunk)
+        time.sleep(settings.ARCHIVE_DELETE_PAUSE)
+
+
+def read_archive(name, start_date=None, end_date=None, root=None):
+    """A pyarrow Table of the archived rows of a table for the local days
+    start_date..end_date (all when omitted). Rows archived twice by an
+    interrupted run appear twice, they share their id.
+    """
+    require_pyarrow()
+    root = Path(root or archive_path())
+    spec = TABLES[name]
+    tables = [
+        pq.read_table(root / entry['path'])
+        for entry in _entries(name, start_date, end_date, root)
+    ]
+    if not tables:
+        return pa.schema([(column, _arrow_type(kind)) for column, _, kind in spec.columns]).empty_table()
+    return pa.concat_tables(tables)
+
+
+def restore_archive(name, start_date=None, end_date=None, root=None):
+    """Insert archived rows back into their table, rows that clash with one
+    already there (same id, or same device and timestamp after the reading
+    was sent again) are skipped. Files are read ROW_GROUP_SIZE rows at a
+    time, one transaction per batch. The rollups never lost them so they
+    are not touched. Returns the number of rows read from the archive.
+    """
+    require_pyarrow()
+    root = Path(root or archive_path())
+    model = TABLES[name].model
+    rows = 0
+    for entry in _entries(name, start_date, end_date, root):
+        for batch in pq.ParquetFile(root / entry['path']).iter_batches(batch_size=ROW_GROUP_SIZE):
+            _insert(model, batch.schema.names, batch.to_pylist())
+            rows += batch.num_rows
+    catalog_version.bump()
+    return rows
+
+
+def _insert(model, names, rows):
+    """INSERT rows (dicts of column values) skipping conflicts, in one
+    transaction
+    """
+    fields = [model._meta.get_field(column) for column in names]
+    qn = connection.ops.quote_name
+    columns = ', '.join(qn(field.column) for field in fields)
+
+    # SQLite allows 999 parameters per statement on older builds
+    size = 999 // len(fields)
+    with transaction.atomic():
+        for offset in range(0, len(rows), size):
+            chunk = rows[offset:offset + size]
+            params = []
+            for row in chunk:
+                params += [_db_value(field, row[column]) for column, field in zip(names, fields)]
+            placeholders = ', '.join(['(%s)' % ', '.join(['%s'] * len(fields))] * len(chunk))
+            with connection.cursor() as cursor:
+                cursor.execute(
+                    f'INSERT INTO {qn(model._meta.db_table)} ({columns}) VALUES {placeholders} '
+                    'ON CONFLICT DO NOTHING',
+                    params,
+                )
+
+
+def _entries(name, start_date, end_date, root):
+    for entry in load_manifest(root)['files']:
+        if entry['table'] != name:
+            continue
+        if start_date and entry['date'] < start_date.isoformat():
+            continue
+        if end_date and entry['date'] > end_date.isoformat():
+            continue
+        yield entry
+
+
+def _db_value(field, value):
+    if value is not None and field.get_internal_type() == 'DecimalField':
+        # archived as float64, exact again once rounded to the field's places
+        value = Decimal(value).quantize(Decimal(1).scaleb(-field.decimal_places))
+    return field.get_db_prep_save(value, connection)
+
+
+def _arrow_type(kind):
+    return {
+        'int': pa.int64,
+        'float': pa.float64,
+        'bool': pa.bool_,
+        'str': pa.string,
+        'bytes': pa.binary,
+        'date': pa.date32,
+        'time': lambda: pa.timestamp('us', tz='UTC'),
+    }[kind]()
+
+
+def _to_table(rows, schema):
+    return pa.Table.from_arrays(
+        [pa.array(values, type=field.type) for values, field in zip(zip(*rows), schema)],
+        schema=schema,
+    )
+
+
+def _writer(path, schema):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    return pq.ParquetWriter(path, schema, compression='zstd')
+
+
+def _fsync(path):
+    with open(path, 'rb') as f:
+        os.fsync(f.fileno())
+
+
+def _save_manifest(root, manifest):
+    path = root / 'manifest.json'
+    temporary = path.with_name('manifest.json.tmp')
+    temporary.write_text(json.dumps(manifest, indent=2))
+    _fsync(temporary)
+    os.replace(temporary, path)
@@ -0,0 +1,348 @@
+from collections import Counter, defaultdict
+from datetime import datetime, time, timedelta, timezone as dt_timezone
+from django.db import connection, transaction
+from django.db.models import Count, F, OuterRef, Q, Subquery
+from django.db.models.functions import TruncDate, TruncHour
+from django.utils import timezone
+from .models import Device, ParkingLog, ParkingZone, TelemetryData, ZoneDailyStats, ZoneEnergyDaily, ZoneHourlyStats
+from .summary_cache import summary_cache
+
+# Per-zone parking event counts by hour and by day, and energy by day.
+# Ingestion increments them in the transaction that stores the logs or
+# readings, so reports read one row per zone and bucket instead of scanning
+# ParkingLog or TelemetryData.
+
+COUNTERS = ('events', 'occupied_events', 'devices', 'occupied_seconds')
+ENERGY_COUNTERS = ('energy_wh', 'power_sum', 'readings')
+
+
+def hour_of(timestamp):
+    """Start of the UTC hour holding timestamp, the ZoneHourlyStats key"""
+    return timestamp.astimezone(dt_timezone.utc).replace(minute=0, second=0, microsecond=0)
+
+
+def day_of(timestamp):
+    """Local date holding timestamp, the ZoneDailyStats key"""
+    return timezone.localdate(timestamp)
+
+
+def day_bounds(start_date, end_date):
+    """[start, end) datetimes covering the local days start_date..end_date"""
+    return (
+        timezone.make_aware(datetime.combine(start_date, time.min)),
+        timezone.make_aware(datetime.combine(end_date + timedelta(days=1), time.min)),
+    )
+
+
+def update_parking_rollups(logs, intervals=()):
+    """Add stored ParkingLog rows to the rollups, call inside the
+    transaction that inserted them. `intervals` are the (device_id, start,
+    end) occupied periods the logs closed, their seconds are spread over the
+    hours and days they cover. Costs four queries whatever the batch.
+    """
+    if not logs:
+        return
+
+    device_ids = {log.device_id for log in logs}
+    zones = dict(Device.objects.filter(pk__in=device_ids).values_list('pk', 'zone_id'))
+
+    # a device counts once per bucket: it is new to a bucket when all of its
+    # stored logs there are the ones being added
+    added = Counter()
+    for log in logs:
+        added['hour', log.device_id, hour_of(log.timestamp)] += 1
+        added['day', log.device_id, day_of(log.timestamp)] += 1
+    start, end = day_bounds(
+        day_of(min(log.timestamp for log in logs)),
+        day_of(max(log.timestamp for log in logs)),
+    )
+    stored = Counter()
+    for device_id, timestamp in ParkingLog.objects.filter(
+        device_id__in=device_ids,
+        timestamp__gte=hour_of(start),
+        timestamp__lt=hour_of(end) + timedelta(hours=1),
+    ).order_by().values_list('device_id', 'timestamp'):
+        stored['hour', device_id, hour_of(timestamp)] += 1
+        stored['day', device_id, day_of(timestamp)] += 1
+
+    hourly = defaultdict(lambda: [0, 0, 0, 0])
+    daily = defaultdict(lambda: [0, 0, 0, 0])
+    for log in logs:
+        zone_id = zones[log.device_id]
+        for buckets, kind, bucket in (
+            (hourly, 'hour', hour_of(log.timestamp)),
+            (daily, 'day', day_of(log.timestamp)),
+        ):
+            counts = buckets[zone_id, bucket]
+            counts[0] += 1
+            counts[1] += log.is_occupied
+            key = (kind, log.device_id, bucket)
+            if stored[key] == added[key]:
+                counts[2] += 1
+                # only once per device and bucket
+                stored[key] = -1
+
+    for device_id, start, end in intervals:
+        _add_occupied(hourly, daily, zones[device_id], start, end)
+
+    _increment(ZoneHourlyStats, 'hour', hourly)
+    _increment(ZoneDailyStats, 'date', daily)
+    summary_cache.invalidate(date for _, date in daily)
+
+
+def update_energy_rollups(readings, previous):
+    """Add stored telemetry readings (dicts with device_id, zone_id,
+    timestamp, voltage, current and power_factor) to ZoneEnergyDaily, call
+    inside the transaction that inserted them. Readings resolved through
+    the device registry carry their zone's offline_timeout, the zones of
+    the others are read. `previous` maps device ids to
+    the time of their newest reading before these.
+
+    A reading's power counts for the time since the device's reading before
+    it, up to the zone's offline_timeout, and goes to the day of the
+    reading. Readings older than the device's newest one count in the mean
+    and peak only; rebuild_energy_rollups places them.
+    """
+    if not readings:
+        return
+
+    timeouts = {
+        reading['zone_id']: reading['offline_timeout']
+        for reading in readings if 'offline_timeout' in reading
+    }
+    unknown = {reading['zone_id'] for reading in readings} - timeouts.keys()
+    if unknown:
+        timeouts.update(ParkingZone.objects.filter(pk__in=unknown).values_list('pk', 'offline_timeout'))
+
+    daily = defaultdict(lambda: [0.0, 0.0, 0, 0.0])
+    last = dict(previous)
+    for reading in sorted(readings, key=lambda reading: (reading['device_id'], reading['timestamp'])):
+        device_id, timestamp = reading['device_id'], reading['timestamp']
+        power = float(reading['voltage']) * float(reading['current']) * float(reading['power_factor'])
+        values = daily[reading['zone_id'], day_of(timestamp)]
+        prior = last.get(device_id)
+        if prior is None or timestamp > prior:
+            if prior is not None:
+                seconds = min((timestamp - prior).total_seconds(), timeouts[reading['zone_id']])
+                values[0] += power * seconds / 3600
+            last[device_id] = timestamp
+        values[1] += power
+        values[2] += 1
+        values[3] = max(values[3], power)
+
+    _increment(ZoneEnergyDaily, 'date', daily, added=ENERGY_COUNTERS, maximum=('peak_w',))
+
+
+def rebuild_energy_rollups(start_date=None, end_date=None):
+    """Recompute ZoneEnergyDaily for the local days start_date..end_date
+    (all days when omitted) from TelemetryData. The readings are replayed in
+    order, reading the power column computed by the database. Days before
+    the oldest stored reading were archived and are kept. Returns the
+    number of rows.
+    """
+    start_date = _stored_from(TelemetryData, start_date)
+    if start_date is None or (end_date and start_date > end_date):
+        return 0
+    start = day_bounds(start_date, start_date)[0] if start_date else None
+    end = day_bounds(end_date, end_date)[1] if end_date else None
+
+    last = {}
+    if start is not None:
+        # the first reading of the range counts from the one before it
+        before = TelemetryData.objects.filter(device=OuterRef('pk'), timestamp__lt=start).order_by('-timestamp')
+        last = dict(
+            Device.objects.annotate(previous=Subquery(before.values('timestamp')[:1]))
+            .filter(previous__isnull=False)
+            .values_list('pk', 'previous')
+        )
+
+    daily = defaultdict(lambda: [0.0, 0.0, 0, 0.0])
+    readings = _between(TelemetryData.objects.all(), 'timestamp', (start, end)).order_by('device_id', 'timestamp')
+    for device_id, zone_id, timeout, timestamp, power in readings.values_list(
+        'device_id', 'device__zone', 'device__zone__offline_timeout', 'timestamp', 'power'
+    ).iterator(chunk_size=5000):
+        values = daily[zone_id, day_of(timestamp)]
+        prior = last.get(device_id)
+        if prior is not None:
+            values[0] += power * min((timestamp - prior).total_seconds(), timeout) / 3600
+        last[device_id] = timestamp
+        values[1] += power
+        values[2] += 1
+        values[3] = max(values[3], power)
+
+    with transaction.atomic():
+        _between(ZoneEnergyDaily.objects.all(), 'date', (start_date, end_date and end_date + timedelta(days=1))).delete()
+        return len(ZoneEnergyDaily.objects.bulk_create(
+            [ZoneEnergyDaily(zone_id=zone_id, date=date, **dict(zip((*ENERGY_COUNTERS, 'peak_w'), values)))
+             for (zone_id, date), values in daily.items()],
+            batch_size=500,
+        ))
+
+
+def rebuild_rollups(start_date=None, end_date=None):
+    """Recompute the rollups of the local days start_date..end_date (all
+    days when omitted) from ParkingLog. Days before the oldest stored log
+    were archived (retention.py) and keep their rollups. Returns the number
+    of daily rows.
+    """
+    start_date = _stored_from(ParkingLog, start_date)
+    if start_date is None or (end_date and start_date > end_date):
+        return 0
+    hour_range, day_range = [None, None], [None, None]
+    if start_date:
+        day_range[0] = day_bounds(start_date, start_date)[0]
+        # whole hours, even where the time zone offset is not
+        hour_range[0] = hour_of(day_range[0])
+    if end_date:
+        day_range[1] = day_bounds(end_date, end_date)[1]
+        hour_range[1] = hour_of(day_range[1] - timedelta(microseconds=1)) + timedelta(hours=1)
+
+    counters = dict(
+        events=Count('id'),
+        occupied_events=Count('id', filter=Q(is_occupied=True)),
+        devices=Count('device', distinct=True),
+    )
+    hourly = defaultdict(lambda: [0, 0, 0, 0])
+    daily = defaultdict(lambda: [0, 0, 0, 0])
+    for buckets, bounds, bucket in (
+        (hourly, hour_range, TruncHour('timestamp', tzinfo=dt_timezone.utc)),
+        (daily, day_range, TruncDate('timestamp')),
+    ):
+        rows = _between(ParkingLog.objects.order_by(), 'timestamp', bounds).values(
+            zone=F('device__zone'), bucket=bucket,
+        ).annotate(**counters)
+        for row in rows:
+            buckets[row['zone'], row['bucket']][:3] = [row[name] for name in counters]
+
+    with transaction.atomic():
+        for zone_id, start, end in _occupied_intervals(hour_range):
+            _add_occupied(hourly, daily, zone_id, start, end, hour_range, day_range)
+
+        _between(ZoneHourlyStats.objects.all(), 'hour', hour_range).delete()
+        _between(ZoneDailyStats.objects.all(), 'date', [d and d.date() for d in day_range]).delete()
+        summary_cache.clear()
+        ZoneHourlyStats.objects.bulk_create(
+            [ZoneHourlyStats(zone_id=zone_id, hour=hour, **dict(zip(COUNTERS, values)))
+             for (zone_id, hour), values in hourly.items()],
+            batch_size=500,
+        )
+        return len(ZoneDailyStats.objects.bulk_create(
+            [ZoneDailyStats(zone_id=zone_id, date=date, **dict(zip(COUNTERS, values)))
+             for (zone_id, date), values in daily.items()],
+            batch_size=500,
+        ))
+
+
+def _stored_from(model, start_date):
+    """start_date moved up to the local day of the model's oldest row, None
+    when the table is empty
+    """
+    oldest = model.objects.order_by('timestamp').values_list('timestamp', flat=True).first()
+    if oldest is None:
+        return None
+    return max(start_date or day_of(oldest), day_of(oldest))
+
+
+def _between(queryset, field, bounds):
+    start, end = bounds
+    if start is not None:
+        queryset = queryset.filter(**{f'{field}__gte': start})
+    if end is not None:
+        queryset = queryset.filter(**{f'{field}__lt': end})
+    return queryset
+
+
+def _occupied_intervals(bounds):
+    """(zone_id, start, end) of the closed occupied periods overlapping
+    bounds, clipped to them. Periods still open are left out, like in the
+    incremental path.
+    """
+    start, end = bounds
+    occupied = {}
+    if start is not None:
+        # devices already occupied when the range begins
+        last = ParkingLog.objects.filter(device=OuterRef('pk'), timestamp__lt=start).order_by('-timestamp')
+        occupied = {
+            device_id: (zone_id, start)
+            for device_id, zone_id in Device.objects.annotate(
+                last_occupied=Subquery(last.values('is_occupied')[:1])
+            ).filter(last_occupied=True).values_list('pk', 'zone_id')
+        }
+
+    logs = _between(ParkingLog.objects.all(), 'timestamp', bounds).order_by('device_id', 'timestamp')
+    for device_id, zone_id, is_occupied, timestamp in logs.values_list(
+        'device_id', 'device__zone', 'is_occupied', 'timestamp'
+    ).iterator(chunk_size=5000):
+        if is_occupied:
+            occupied.setdefault(device_id, (zone_id, timestamp))
+        elif device_id in occupied:
+            zone_id, since = occupied.pop(device_id)
+            yield zone_id, since, timestamp
+
+    if occupied and end is not None:
+        # periods closed after the range count up to its end
+        closed = ParkingLog.objects.filter(
+            device_id__in=occupied, is_occupied=False, timestamp__gte=end
+        ).order_by().values_list('device_id', flat=True).distinct()
+        for device_id in closed:
+            zone_id, since = occupied[device_id]
+            yield zone_id, since, end
+
+
+def _add_occupied(hourly, daily, zone_id, start, end, hour_range=(None, None), day_range=(None, None)):
+    """Spread the seconds of an occupied period over hourly and daily buckets"""
+    for buckets, bounds, step in ((hourly, hour_range, _next_hour), (daily, day_range, _next_day)):
+        lo = max(start, bounds[0]) if bounds[0] is not None else start
+        hi = min(end, bounds[1]) if bounds[1] is not None else end
+        while lo < hi:
+            bucket, bucket_end = step(lo)
+            buckets[zone_id, bucket][3] += (min(hi, bucket_end) - lo).total_seconds()
+            lo = bucket_end
+
+
+def _next_hour(timestamp):
+    hour = hour_of(timestamp)
+    return hour, hour + timedelta(hours=1)
+
+
+def _next_day(timestamp):
+    date = day_of(timestamp)
+    return date, day_bounds(date, date)[1]
+
+
+def _increment(model, bucket_field, counts, added=COUNTERS, maximum=()):
+    """Upsert {(zone_id, bucket): values} adding the `added` columns to the
+    stored ones and keeping the largest of the `maximum` ones (values hold
+    both, in that order). The ORM's upsert can only overwrite, so this is an
+    INSERT ... ON CONFLICT DO UPDATE, understood by SQLite and PostgreSQL.
+    """
+    if not counts:
+        return
+    qn = connection.ops.quote_name
+    field = model._meta.get_field(bucket_field)
+    table = qn(model._meta.db_table)
+    keys = [qn('zone_id'), qn(field.column)]
+    columns = keys + [qn(name) for name in (*added, *maximum)]
+    updates = ', '.join(
+        [f'{column} = {table}.{column} + excluded.{column}' for column in map(qn, added)]
+        + [
+            f'{column} = CASE WHEN excluded.{column} > {table}.{column} '
+            f'THEN excluded.{column} ELSE {table}.{column} END'
+            for column in map(qn, maximum)
+        ]
+    )
+
+    # SQLite allows 999 parameters per statement on older builds
+    rows = list(counts.items())
+    for offset in range(0, len(rows), 150):
+        chunk = rows[offset:offset + 150]
+        params = []
+        for (zone_id, bucket), values in chunk:
+            params += [zone_id, field.get_db_prep_value(bucket, connection), *values]
+        placeholders = ', '.join(['(%s)' % ', '.join(['%s'] * len(columns))] * len(chunk))
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f'INSERT INTO {table} ({", ".join(columns)}) VALUES {placeholders} '
+                f'ON CONFLICT ({", ".join(keys)}) DO UPDATE SET {updates}',
+                params,
+            )
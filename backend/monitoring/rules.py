@@ -0,0 +1,172 @@
+import threading
+import time
+import numpy as np
+from django.conf import settings
+from .models import Alert, AlertRule, MESSAGE_FORMAT_ERRORS
+from .versioning import SharedVersion
+
+METRICS = ['power', 'voltage', 'current', 'power_factor']
+
+
+class CompiledRules:
+    """AlertRule rows flattened into NumPy lookup tables.
+
+    Every rule gets an index into the per-rule arrays (threshold, metric,
+    operator, enabled). For each alert_type the default rule index is kept
+    plus sorted zone and device keys, so resolving the rule that applies to
+    each reading of a batch is a couple of searchsorted calls.
+    """
+
+    def __init__(self, rules):
+        self.rules = list(rules)
+        self.threshold = np.array([rule.threshold for rule in self.rules], dtype=np.float64)
+        self.metric = np.array([METRICS.index(rule.metric) for rule in self.rules], dtype=np.intp)
+        self.above = np.array([rule.operator == 'gt' for rule in self.rules], dtype=bool)
+        self.enabled = np.array([rule.is_enabled for rule in self.rules], dtype=bool)
+
+        self.checks = []
+        for alert_type in sorted({rule.alert_type for rule in self.rules}):
+            default = -1
+            zones, devices = {}, {}
+            for index, rule in enumerate(self.rules):
+                if rule.alert_type != alert_type:
+                    continue
+                if rule.device_id is not None:
+                    devices[rule.device_id] = index
+                elif rule.zone_id is not None:
+                    zones[rule.zone_id] = index
+                else:
+                    default = index
+            self.checks.append((alert_type, default, _lookup_table(zones), _lookup_table(devices)))
+
+    def evaluate(self, device_ids, zone_ids, values):
+        """Unsaved alerts for a batch, at most one per (device, alert_type).
+
+        `values` is a (len(METRICS), n) array of readings. When a device
+        breaks a rule several times in the batch the worst reading is kept.
+        """
+        alerts = []
+        for alert_type, rule, value, excess, broken in self._broken(device_ids, zone_ids, values):
+            # worst reading per device
+            order = broken[np.lexsort((-excess[broken], device_ids[broken]))]
+            _, first = np.unique(device_ids[order], return_index=True)
+            for position in order[first]:
+                matched = self.rules[rule[position]]
+                alerts.append(Alert(
+                    device_id=int(device_ids[position]),
+                    alert_type=alert_type,
+                    severity=matched.severity,
+                    message=_message(matched, float(value[position])),
+                ))
+        return alerts
+
+    def breaches(self, device_ids, zone_ids, values):
+        """Boolean mask of the readings that break at least one rule"""
+        mask = np.zeros(len(device_ids), dtype=bool)
+        for *_, broken in self._broken(device_ids, zone_ids, values):
+            mask[broken] = True
+        return mask
+
+    def _broken(self, device_ids, zone_ids, values):
+        """(alert_type, rule, value, excess, broken) per alert_type with
+        broken readings: the rule index and metric value of every reading,
+        how far past the threshold it is and the positions that break it
+        """
+        if not self.rules or not len(device_ids):
+            return
+
+        columns = np.arange(len(device_ids))
+        for alert_type, default, zones, devices in self.checks:
+            rule = np.full(len(device_ids), default, dtype=np.intp)
+            _override(rule, zone_ids, zones)
+            _override(rule, device_ids, devices)
+
+            active = rule >= 0
+            active[active] = self.enabled[rule[active]]
+            if not active.any():
+                continue
+
+            value = values[self.metric[rule], columns]
+            threshold = self.threshold[rule]
+            above = self.above[rule]
+            # distance past the threshold, positive when the rule is broken
+            excess = np.where(above, value - threshold, threshold - value)
+            broken = np.flatnonzero(active & (excess > 0))
+            if len(broken):
+                yield alert_type, rule, value, excess, broken
+
+
+def _message(rule, value):
+    try:
+        return rule.message.format(value=value, threshold=rule.threshold)
+    except MESSAGE_FORMAT_ERRORS:
+        # saved without validation (QuerySet.update(), a migration), a bad
+        # placeholder must not reject the reading
+        return rule.message
+
+
+def _lookup_table(mapping):
+    keys = np.array(sorted(mapping), dtype=np.int64)
+    return keys, np.array([mapping[key] for key in keys], dtype=np.intp)
+
+
+def _override(rule, ids, table):
+    keys, indexes = table
+    if not len(keys):
+        return
+    position = np.searchsorted(keys, ids).clip(max=len(keys) - 1)
+    hit = keys[position] == ids
+    rule[hit] = indexes[position[hit]]
+
+
+class RuleEngine:
+    """Process-wide holder of the compiled rules.
+
+    Rules are loaded on first use and reloaded after an AlertRule is saved or
+    deleted (signals.py, also seen by other processes through the shared
+    version counter) or when they are older than RULES_RELOAD_INTERVAL
+    seconds, which covers edits made with QuerySet.update().
+    """
+
+    def __init__(self, reload_interval=30.0):
+        self.reload_interval = reload_interval
+        self.shared_version = SharedVersion('monitoring:alert_rules:version')
+        self._compiled = None
+        self._loaded_at = 0.0
+        self._lock = threading.Lock()
+
+    @property
+    def compiled(self):
+        compiled = self._compiled
+        stale = (
+            compiled is None
+            or time.monotonic() - self._loaded_at > self.reload_interval
+            or self.shared_version.changed()
+        )
+        if stale:
+            with self._lock:
+                compiled = CompiledRules(AlertRule.objects.all())
+                self._compiled = compiled
+                self._loaded_at = time.monotonic()
+        return compiled
+
+    def invalidate(self):
+        self._compiled = None
+        self.shared_version.bump()
+
+    def evaluate(self, readings):
+        """Unsaved alerts for validated readings holding device_id and zone_id"""
+        if not readings:
+            return []
+
+        device_ids = np.fromiter((r['device_id'] for r in readings), dtype=np.int64, count=len(readings))
+        zone_ids = np.fromiter((r.get('zone_id') or -1 for r in readings), dtype=np.int64, count=len(readings))
+        voltage = np.fromiter((r['voltage'] for r in readings), dtype=np.float64, count=len(readings))
+        current = np.fromiter((r['current'] for r in readings), dtype=np.float64, count=len(readings))
+        power_factor = np.fromiter((r['power_factor'] for r in readings), dtype=np.float64, count=len(readings))
+        values = np.vstack([voltage * current * power_factor, voltage, current, power_factor])
+
+        return self.compiled.evaluate(device_ids, zone_ids, values)
+
+
+rule_engine = RuleEngine(reload_interval=getattr(settings, 'RULES_RELOAD_INTERVAL', 30.0))
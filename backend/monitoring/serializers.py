@@ -1,8 +1,29 @@
 from rest_framework import serializers
+from django.conf import settings
+from django.db import IntegrityError, transaction
 from django.utils import timezone
 from datetime import timedelta, datetime
-from .models import Device, TelemetryData, ParkingZone, ParkingLog, Alert
-from django.db.models import Count, Q
+from .models import Device, DeviceHealth, TelemetryData, ParkingZone, ParkingLog, Alert
+from .ingestion import ingest_telemetry, ingest_parking_logs, check_anomalies, update_telemetry_states, update_occupancy_states
+from .rollups import update_energy_rollups, update_parking_rollups
+from .analytics import occupancy_trend, zone_energy
+from .timeseries import telemetry_series
+from .registry import device_registry
+from .heartbeat import heartbeats
+from .spool import spool, encode
+from .writer import db_writer, writer_enabled
+from .summary_cache import summary_cache
+from django.db.models import Count, Q, Sum
+
+
+def device_codes(items):
+    """Device codes of raw bulk items for one registry lookup. Codes that
+    are not strings are left out, they fail validation as per-item errors.
+    """
+    return {
+        item.get('device_code') for item in items
+        if isinstance(item, dict) and isinstance(item.get('device_code'), str)
+    }
 
 # serializer for telemetry data sent by devices
 class TelemetrySerializer(serializers.Serializer):
@@ -13,13 +34,18 @@ class TelemetrySerializer(serializers.Serializer):
     timestamp = serializers.DateTimeField()
 
     def validate_device_code(self, value):
-        try:
-            device = Device.objects.get(device_code=value)
-            if not device.is_active:
-                raise serializers.ValidationError("Device is inactive.")
-            return value
-        except Device.DoesNotExist:
+        # bulk callers pass the entries they already resolved in the context
+        devices = self.context.get('devices')
+        if devices is not None:
+            device = devices.get(value)
+        else:
+            device = device_registry.get(value)
+
+        if device is None:
             raise serializers.ValidationError("Device does not exist.")
+        if not device.is_active:
+            raise serializers.ValidationError("Device is inactive.")
+        return value
         
     def validate_timestamp(self, value):
         now = timezone.now()
@@ -28,62 +54,138 @@ class TelemetrySerializer(serializers.Serializer):
         # reject data older than 24 hours
         if value < now - timedelta(hours=24):
             raise serializers.ValidationError("Timestamp is too old. (> 24 hours)")
-        return 
+        return value
     
     def create(self, validated_data):
-        device = Device.objects.get(device_code=validated_data['device_code'])
-        device.update_last_seen()
+        reading = self._reading(validated_data)
+        if writer_enabled():
+            return db_writer.run(self.write_many, reading)
+
+        with transaction.atomic():
+            return self.write(reading)
+
+    def submit(self):
+        """Queue the reading on the writer thread, returns a Future of the row"""
+        return db_writer.submit(self.write_many, self._reading(self.validated_data))
 
+    @staticmethod
+    def write_many(readings):
+        """Writer thread batch of write(): the readings of many requests go
+        through the bulk ingestion path, duplicates fail their own request
+        """
+        # heartbeats were recorded when the requests came in
+        created, duplicates = ingest_telemetry(readings, heartbeat=False)
+        duplicates = {id(reading) for reading in duplicates}
+        rows = iter(created)
+        return [
+            IntegrityError('Duplicate telemetry data') if id(reading) in duplicates else next(rows)
+            for reading in readings
+        ]
+
+    @staticmethod
+    def write(reading):
+        """Store a reading with its device state, energy and alerts, inside
+        the caller's transaction
+        """
         telemetry = TelemetryData.objects.create(
-            device=device,
-            voltage=validated_data['voltage'],
-            current=validated_data['current'],
-            power_factor=validated_data['power_factor'],
-            timestamp=validated_data['timestamp']
+            device_id=reading['device_id'],
+            voltage=reading['voltage'],
+            current=reading['current'],
+            power_factor=reading['power_factor'],
+            timestamp=reading['timestamp']
         )
+        previous = update_telemetry_states([reading])
+        update_energy_rollups([reading], previous)
 
-        # logic: check for abnormal power usage
-        self._check_power_anomaly(telemetry)
+        # logic: check the reading against the alert rules
+        check_anomalies([reading])
 
         return telemetry
-    
-    def _check_power_anomaly(self, telemetry):
-        """Alert if power consumption exceeds threshold"""
-        power = telemetry.power_consumption
-        POWER_THRESHOLD = 1500  # watts
-
-        if power > POWER_THRESHOLD:
-            Alert.create_if_not_exists(
-                device=telemetry.device,
-                alert_type='HIGH_POWER',
-                severity='WARNING',
-                message=f'Abnormal power usage: {power:.2f}W (threshold: {POWER_THRESHOLD}W)'
-            )
+
+    def _reading(self, validated_data):
+        device = self._device(validated_data['device_code'])
+        heartbeats.record([device.id])
+        return dict(validated_data, device_id=device.id, zone_id=device.zone_id, offline_timeout=device.offline_timeout)
+
+    def _device(self, device_code):
+        devices = self.context.get('devices')
+        if devices is not None:
+            return devices[device_code]
+        return device_registry.get(device_code)
+
+    def spool(self):
+        """Queue the reading for drain_spool instead of writing it now"""
+        device = device_registry.get(self.validated_data['device_code'])
+        heartbeats.record([device.id])
+        spool.append('telemetry', encode(self.validated_data))
 
 # serializer for bulk telemetry data upload
 class BulkTelemetrySerializer(serializers.Serializer):
-    data = TelemetrySerializer(many=True)
+    # items are validated one by one in validate_items() so a bad reading
+    # is reported back instead of rejecting the whole batch
+    data = serializers.ListField(child=serializers.DictField(), allow_empty=False)
 
     def create(self, validated_data):
-        results = []
+        readings, errors = self.validate_items(validated_data['data'])
+        return self.ingest(readings, errors)
+
+    def spool(self):
+        readings, errors = self.validate_items(self.validated_data['data'])
+        return self.spool_readings(readings, errors)
+
+    def ingest(self, readings, errors):
+        created, duplicates = ingest_telemetry(readings)
+        for reading in duplicates:
+            errors.append(
+                {
+                    'device_code': reading['device_code'],
+                    'error': 'Duplicate telemetry data'
+                }
+            )
+
+        return {
+            'created': len(created),
+            'errors': errors
+        }
+
+    def spool_readings(self, readings, errors):
+        """Queue the valid readings for drain_spool, duplicates are dropped there"""
+        heartbeats.record({reading['device_id'] for reading in readings})
+        spool.append_many('telemetry', [encode(reading) for reading in readings])
+
+        return {
+            'accepted': len(readings),
+            'errors': errors
+        }
+
+    def validate_items(self, items, devices=None):
+        """Split raw items into validated readings and per-item errors"""
+        readings = []
         errors = []
 
-        for item in validated_data['data']:
-            try:
-                serializers = TelemetrySerializer(data=item)
-                if serializers.is_valid(raise_exception=True):
-                    results.append(serializers.save())
-            except Exception as e:
+        # one lookup for every device in the payload
+        if devices is None:
+            devices = device_registry.get_many(device_codes(items))
+
+        for item in items:
+            serializer = TelemetrySerializer(data=item, context={'devices': devices})
+            if serializer.is_valid():
+                reading = dict(serializer.validated_data)
+                device = devices[reading['device_code']]
+                reading['device_id'] = device.id
+                reading['zone_id'] = device.zone_id
+                reading['offline_timeout'] = device.offline_timeout
+                readings.append(reading)
+            else:
+                # a string, as the per-reading save() used to report it
                 errors.append(
                     {
                         'device_code': item.get('device_code'),
-                        'error': str(e)
+                        'error': str(serializers.ValidationError(serializer.errors))
                     }
                 )
-        return {
-            'created': len(results),
-            'errors': errors
-        }
+
+        return readings, errors
     
 class DashboardSummarySerializer(serializers.Serializer):
     date = serializers.DateField(required=False)
@@ -95,89 +197,183 @@ class DashboardSummarySerializer(serializers.Serializer):
     
     def to_representation(self, instance):
         target_data = self.validated_data.get('date', timezone.now().date())
-        start_time = timezone.make_aware(datetime.combine(target_data, datetime.min.time()))
-        end_time = timezone.make_aware(datetime.combine(target_data, datetime.max.time()))
-
-        # total parking events in a day
-        total_events = ParkingLog.objects.filter(timestamp__range=(start_time, end_time)).count()
+        day = summary_cache.get(target_data, lambda: self.day_summary(target_data))
 
-        # current occupancy (latest status per device)
-        from django.db.models import OuterRef, Subquery
-        latest_logs = ParkingLog.objects.filter(
-            device=OuterRef('pk')
-        ).order_by('-timestamp')
-
-        devices_with_status = Device.objects.annotate(
-            latest_occupied=Subquery(
-                latest_logs.values('is_occupied')[:1]
-            )
+        # device counts: all, currently occupied (DeviceState) and
+        # active (received data in last 2 minutes, heartbeats still waiting
+        # in the write-behind buffer count as well), never cached
+        two_minutes_ago = timezone.now() - timedelta(minutes=2)
+        device_counts = Device.objects.aggregate(
+            total=Count('id'),
+            occupied=Count('id', filter=Q(state__is_occupied=True)),
+            active=Count('id', filter=(
+                Q(last_seen__gte=two_minutes_ago) |
+                Q(pk__in=list(heartbeats.pending(since=two_minutes_ago)))
+            ))
         )
 
-        current_occupancy = devices_with_status.filter(
-            latest_occupied=True
-        ).count()
+        return {
+            'date': target_data,
+            "summary": {
+                'total_events': day['total_events'],
+                'current_occupancy': device_counts['occupied'],
+                'active_devices': device_counts['active'],
+                'alerts_today': day['alerts'],
+                'critical_alerts': day['critical_alerts'],
+                'total_devices': device_counts['total']
+            },
+            'zones': day['zones'],
+            'timestamp': timezone.now()
+        }
 
-        # active devices (received data in last 2 minutes)
-        two_minutes_ago = timezone.now() - timedelta(minutes=2)
-        active_devices = Device.objects.filter(
-            last_seen__gte=two_minutes_ago
-        ).count()
+    def day_summary(self, target_data):
+        """Parts of the summary that depend on the date only, cached by summary_cache"""
+        start_time = timezone.make_aware(datetime.combine(target_data, datetime.min.time()))
+        end_time = timezone.make_aware(datetime.combine(target_data, datetime.max.time()))
 
-        # alerts triggered today
-        alerts_today = Alert.objects.filter(
-            created_at__range=(start_time, end_time)
-        ).count()
+        # parking events per zone from the daily rollup, zones without
+        # events included
+        zones = ParkingZone.objects.annotate(
+            events=Sum('daily_stats__events', filter=Q(daily_stats__date=target_data), default=0)
+        )
 
-        # Critical alerts count
-        critical_alerts = Alert.objects.filter(
-            created_at__range=(start_time, end_time),
-            severity='CRITICAL'
-        ).count()
+        # alerts triggered that day, total and critical
+        alert_counts = Alert.objects.filter(
+            created_at__range=(start_time, end_time)
+        ).aggregate(
+            total=Count('id'),
+            critical=Count('id', filter=Q(severity='CRITICAL'))
+        )
 
         # zone wise matrics
+        total_events = 0
         zones_data = []
-        for zone in ParkingZone.objects.all():
-            zone_events = ParkingLog.objects.filter(
-                device__zone=zone,
-                timestamp__range=(start_time, end_time)
-            ).count()
+        for zone in zones:
+            total_events += zone.events
 
             if zone.daily_target > 0:
-                efficiancy = (zone_events / zone.daily_target) * 100
+                efficiancy = (zone.events / zone.daily_target) * 100
             else:
                 efficiancy = 0
 
             zones_data.append({
                 'zone_name': zone.name,
                 'zone_code': zone.code,
-                'events': zone_events,
+                'events': zone.events,
                 'efficiency': round(efficiancy, 2),
                 'target': zone.daily_target,
                 'status': 'good' if efficiancy >= 80 else 'warning' if efficiancy >= 50 else 'critical'
             })
 
         return {
-            'date': target_data,
-            "summary": {
-                'total_events': total_events,
-                'current_occupancy': current_occupancy,
-                'active_devices': active_devices,
-                'alerts_today': alerts_today,
-                'critical_alerts': critical_alerts,
-                'total_devices': Device.objects.count()
-            },
+            'total_events': total_events,
+            'alerts': alert_counts['total'],
+            'critical_alerts': alert_counts['critical'],
             'zones': zones_data,
-            'timestamp': timezone.now()
         }
     
+class OccupancyTrendSerializer(serializers.Serializer):
+    """Query parameters of the occupancy trend, /api/analytics/occupancy/"""
+    start = serializers.DateField(required=False)
+    end = serializers.DateField(required=False)
+    bucket = serializers.ChoiceField(choices=['hour', 'day'], default='hour')
+    zone = serializers.CharField(required=False)
+
+    def validate(self, attrs):
+        attrs.setdefault('end', timezone.localdate())
+        attrs.setdefault('start', attrs['end'] - timedelta(days=6))
+        if attrs['start'] > attrs['end']:
+            raise serializers.ValidationError('start must not be after end.')
+        if 'zone' in attrs and not ParkingZone.objects.filter(code=attrs['zone']).exists():
+            raise serializers.ValidationError({'zone': 'Unknown zone code.'})
+        return attrs
+
+    def to_representation(self, instance):
+        return occupancy_trend(
+            self.validated_data['start'],
+            self.validated_data['end'],
+            bucket=self.validated_data['bucket'],
+            zone_code=self.validated_data.get('zone'),
+            max_points=settings.ANALYTICS_MAX_POINTS,
+        )
+
+
+class ZoneEnergySerializer(serializers.Serializer):
+    """Query parameters of the daily energy report, /api/analytics/energy/"""
+    start = serializers.DateField(required=False)
+    end = serializers.DateField(required=False)
+    zone = serializers.CharField(required=False)
+
+    def validate(self, attrs):
+        attrs.setdefault('end', timezone.localdate())
+        attrs.setdefault('start', attrs['end'] - timedelta(days=29))
+        if attrs['start'] > attrs['end']:
+            raise serializers.ValidationError('start must not be after end.')
+        if 'zone' in attrs and not ParkingZone.objects.filter(code=attrs['zone']).exists():
+            raise serializers.ValidationError({'zone': 'Unknown zone code.'})
+        return attrs
+
+    def to_representation(self, instance):
+        return zone_energy(
+            self.validated_data['start'],
+            self.validated_data['end'],
+            zone_code=self.validated_data.get('zone'),
+        )
+
+
+class TelemetrySeriesSerializer(serializers.Serializer):
+    """Query parameters of a device's telemetry chart, /api/devices/<code>/telemetry/"""
+    start = serializers.DateTimeField(required=False)
+    end = serializers.DateTimeField(required=False)
+    points = serializers.IntegerField(
+        min_value=2,
+        max_value=settings.TELEMETRY_SERIES_MAX_POINTS,
+        default=500
+    )
+
+    def validate(self, attrs):
+        attrs.setdefault('end', timezone.now())
+        attrs.setdefault('start', attrs['end'] - timedelta(days=1))
+        if attrs['start'] >= attrs['end']:
+            raise serializers.ValidationError('start must be before end.')
+        return attrs
+
+    def to_representation(self, instance):
+        device = self.context['device']
+        return {
+            'device_code': device.device_code,
+            'start': self.validated_data['start'],
+            'end': self.validated_data['end'],
+            **telemetry_series(
+                device.pk,
+                self.validated_data['start'],
+                self.validated_data['end'],
+                self.validated_data['points'],
+            ),
+        }
+
+
+class DeviceHealthSerializer(serializers.ModelSerializer):
+    device_code = serializers.CharField(source='device.device_code', read_only=True)
+    zone_code = serializers.CharField(source='device.zone.code', read_only=True)
+
+    class Meta:
+        model = DeviceHealth
+        fields = [
+            'device_code', 'zone_code', 'score', 'uptime_ratio', 'critical_alerts',
+            'warning_alerts', 'info_alerts', 'anomaly_rate', 'voltage_cv', 'readings',
+            'computed_at'
+        ]
+
+
 class AlertSerializer(serializers.ModelSerializer):
     device_code = serializers.CharField(source='device.device_code', read_only=True)
     zone_name = serializers.CharField(source='device.zone.name', read_only=True)
 
     class Meta:
         model = Alert
-        fields = ['id', 'device_code', 'zone_name', 'severity', 'alert_type', 'message', 'is_acknowledged', 'created_at', 'acknowledged_at']
-        read_only_fields = ['created_at', 'acknowledged_at']
+        fields = ['id', 'device_code', 'zone_name', 'severity', 'alert_type', 'message', 'is_acknowledged', 'created_at', 'acknowledged_at', 'resolved_at']
+        read_only_fields = ['created_at', 'acknowledged_at', 'resolved_at']
 
 class ParkingLogSerializer(serializers.Serializer):
     device_code = serializers.CharField(max_length=50)
@@ -185,11 +381,15 @@ class ParkingLogSerializer(serializers.Serializer):
     timestamp = serializers.DateTimeField()
 
     def validate_device_code(self, value):
-        try:
-            Device.objects.get(device_code=value)
-            return value
-        except Device.DoesNotExist:
+        devices = self.context.get('devices')
+        if devices is not None:
+            device = devices.get(value)
+        else:
+            device = device_registry.get(value)
+
+        if device is None:
             raise serializers.ValidationError("Device does not exist.")
+        return value
         
     def validate_timestamp(self, value):
         now = timezone.now()
@@ -198,12 +398,104 @@ class ParkingLogSerializer(serializers.Serializer):
         return value
     
     def create(self, validated_data):
-        device = Device.objects.get(device_code=validated_data['device_code'])
+        event = self._event(validated_data)
+        if writer_enabled():
+            return db_writer.run(self.write_many, event)
+
+        with transaction.atomic():
+            return self.write(event)
+
+    def submit(self):
+        """Queue the event on the writer thread, returns a Future of the row"""
+        return db_writer.submit(self.write_many, self._event(self.validated_data))
 
+    @classmethod
+    def write_many(cls, events):
+        """Writer thread batch of write(), every event is stored like a
+        single request stores it, unlike the bulk path that drops replays
+        """
+        return [cls.write(event) for event in events]
+
+    @staticmethod
+    def write(event):
+        """Store an event with its device state and rollups, inside the
+        caller's transaction
+        """
         parking_log = ParkingLog.objects.create(
-            device=device,
-            is_occupied=validated_data['is_occupied'],
-            timestamp=validated_data['timestamp']
+            device_id=event['device_id'],
+            is_occupied=event['is_occupied'],
+            timestamp=event['timestamp']
         )
+        intervals = update_occupancy_states([event])
+        update_parking_rollups([parking_log], intervals)
+
+        return parking_log
+
+    def _event(self, validated_data):
+        devices = self.context.get('devices')
+        if devices is not None:
+            device = devices[validated_data['device_code']]
+        else:
+            device = device_registry.get(validated_data['device_code'])
+        return dict(validated_data, device_id=device.id)
+
+    def spool(self):
+        """Queue the event for drain_spool instead of writing it now, it is
+        stored as write() stores it
+        """
+        spool.append('parking_log_event', encode(self.validated_data))
+
+# serializer for parking logs replayed by gateways after a network loss
+class BulkParkingLogSerializer(serializers.Serializer):
+    data = serializers.ListField(
+        child=serializers.DictField(),
+        allow_empty=False,
+        max_length=settings.PARKING_LOG_BULK_MAX_ITEMS
+    )
+
+    def create(self, validated_data):
+        events, errors = self.validate_items(validated_data['data'])
+        created, dropped = ingest_parking_logs(events)
+
+        return {
+            'accepted': len(created),
+            'rejected': len(errors) + sum(dropped.values()),
+            **dropped,
+            'errors': errors
+        }
+
+    def spool(self):
+        """Queue the valid events for drain_spool, deduplication happens there"""
+        events, errors = self.validate_items(self.validated_data['data'])
+
+        spool.append_many('parking_log', [encode(event) for event in events])
+
+        return {
+            'accepted': len(events),
+            'rejected': len(errors),
+            'errors': errors
+        }
+
+    def validate_items(self, items, devices=None):
+        """Split raw items into validated events and per-item errors"""
+        events = []
+        errors = []
+
+        if devices is None:
+            devices = device_registry.get_many(device_codes(items))
+
+        for item in items:
+            serializer = ParkingLogSerializer(data=item, context={'devices': devices})
+            if serializer.is_valid():
+                event = dict(serializer.validated_data)
+                event['device_id'] = devices[event['device_code']].id
+                events.append(event)
+            else:
+                errors.append(
+                    {
+                        'device_code': item.get('device_code'),
+                        'error': serializer.errors
+                    }
+                )
 
-        return parking_log
\ No newline at end of file
+        return events, errors
\ No newline at end of file
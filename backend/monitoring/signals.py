@@ -0,0 +1,47 @@
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+from django.utils import timezone
+from .alert_index import open_alerts
+from .detector import offline_detector
+from .etags import alert_version, catalog_version
+from .models import Device, ParkingZone, Alert, AlertRule
+from .registry import device_registry
+from .rules import rule_engine
+from .summary_cache import summary_cache
+
+
+@receiver([post_save, post_delete], sender=Device)
+def invalidate_device_entry(sender, instance, **kwargs):
+    device_registry.invalidate_device(instance.pk, instance.device_code)
+    offline_detector.invalidate()
+    catalog_version.bump()
+
+
+@receiver([post_save, post_delete], sender=ParkingZone)
+def invalidate_zone_entries(sender, instance, **kwargs):
+    device_registry.invalidate_zone(instance.pk)
+    offline_detector.invalidate()
+    catalog_version.bump()
+
+
+@receiver([post_save, post_delete], sender=AlertRule)
+def reload_alert_rules(sender, instance, **kwargs):
+    rule_engine.invalidate()
+
+
+@receiver(post_save, sender=Alert)
+def track_open_alert(sender, instance, created, **kwargs):
+    pair = (instance.device_id, instance.alert_type)
+    if not instance.is_open:
+        open_alerts.discard([pair])
+    else:
+        open_alerts.add([pair])
+    if created:
+        summary_cache.invalidate([timezone.localdate(instance.created_at)])
+
+
+@receiver(post_delete, sender=Alert)
+def forget_open_alert(sender, instance, **kwargs):
+    open_alerts.discard([(instance.device_id, instance.alert_type)])
+    summary_cache.invalidate([timezone.localdate(instance.created_at)])
+    alert_version.bump()
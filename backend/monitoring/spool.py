@@ -0,0 +1,169 @@
+import json
+import sqlite3
+import threading
+import time
+from datetime import datetime
+from decimal import Decimal
+from django.conf import settings
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS entries (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    kind TEXT NOT NULL,
+    payload TEXT NOT NULL,
+    enqueued_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS offsets (
+    consumer TEXT PRIMARY KEY,
+    position INTEGER NOT NULL,
+    updated_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS dead_letters (
+    id INTEGER PRIMARY KEY,
+    kind TEXT NOT NULL,
+    payload TEXT NOT NULL,
+    error TEXT NOT NULL,
+    failed_at REAL NOT NULL
+);
+"""
+
+
+class IngestSpool:
+    """Append-only ingestion queue in a separate SQLite file (WAL mode).
+
+    Views append validated readings and answer 202, the drain_spool command
+    reads them back in id order and writes them to the main database. The
+    consumer offset lives in the same file and is only advanced after the
+    main database commit, so a crash replays the last batch instead of
+    losing it (ingestion skips the duplicates). Entries that cannot be
+    written are moved to the dead_letters table by the same commit, so one
+    bad entry does not hold the queue back.
+    """
+
+    def __init__(self, path):
+        self.path = str(path)
+        self._local = threading.local()
+
+    @property
+    def connection(self):
+        conn = getattr(self._local, 'connection', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            # an accepted reading must survive a power loss
+            conn.execute('PRAGMA synchronous=FULL')
+            conn.executescript(SCHEMA)
+            self._local.connection = conn
+        return conn
+
+    def append(self, kind, payload):
+        return self.append_many(kind, [payload])
+
+    def append_many(self, kind, payloads):
+        now = time.time()
+        conn = self.connection
+        with conn:
+            conn.execute('BEGIN IMMEDIATE')
+            conn.executemany(
+                'INSERT INTO entries (kind, payload, enqueued_at) VALUES (?, ?, ?)',
+                [(kind, json.dumps(payload), now) for payload in payloads],
+            )
+        return len(payloads)
+
+    def read(self, after, limit):
+        rows = self.connection.execute(
+            'SELECT id, kind, payload FROM entries WHERE id > ? ORDER BY id LIMIT ?',
+            (after, limit),
+        )
+        return [(entry_id, kind, json.loads(payload)) for entry_id, kind, payload in rows]
+
+    def offset(self, consumer='default'):
+        row = self.connection.execute(
+            'SELECT position FROM offsets WHERE consumer = ?', (consumer,)
+        ).fetchone()
+        return row[0] if row else 0
+
+    def commit(self, position, dead_letters=(), consumer='default'):
+        """Advance the offset and drop the entries it covers, keeping the
+        (entry_id, kind, payload, error) dead letters
+        """
+        now = time.time()
+        conn = self.connection
+        with conn:
+            conn.execute('BEGIN IMMEDIATE')
+            conn.executemany(
+                'INSERT OR REPLACE INTO dead_letters (id, kind, payload, error, failed_at) VALUES (?, ?, ?, ?, ?)',
+                [
+                    (entry_id, kind, json.dumps(payload), error, now)
+                    for entry_id, kind, payload, error in dead_letters
+                ],
+            )
+            conn.execute(
+                'INSERT INTO offsets (consumer, position, updated_at) VALUES (?, ?, ?) '
+                'ON CONFLICT(consumer) DO UPDATE SET position = excluded.position, '
+                'updated_at = excluded.updated_at',
+                (consumer, position, now),
+            )
+            conn.execute('DELETE FROM entries WHERE id <= ?', (position,))
+
+    def dead_letters(self, limit=100):
+        rows = self.connection.execute(
+            'SELECT id, kind, payload, error FROM dead_letters ORDER BY id LIMIT ?', (limit,)
+        )
+        return [(entry_id, kind, json.loads(payload), error) for entry_id, kind, payload, error in rows]
+
+    def stats(self, consumer='default'):
+        offset = self.offset(consumer)
+        depth, oldest = self.connection.execute(
+            'SELECT COUNT(*), MIN(enqueued_at) FROM entries WHERE id > ?', (offset,)
+        ).fetchone()
+        dead_letters, = self.connection.execute('SELECT COUNT(*) FROM dead_letters').fetchone()
+        return {
+            'depth': depth,
+            'lag_seconds': round(time.time() - oldest, 3) if oldest else 0,
+            'offset': offset,
+            'dead_letters': dead_letters,
+        }
+
+
+def encode(validated_data):
+    """JSON-safe copy of serializer output.
+
+    Resolved ids are left out, the drain worker looks the device up again
+    in case it changed while the entry was queued.
+    """
+    payload = {}
+    for key, value in validated_data.items():
+        if key in ('device_id', 'zone_id'):
+            continue
+        if isinstance(value, Decimal):
+            value = str(value)
+        elif isinstance(value, datetime):
+            value = value.isoformat()
+        payload[key] = value
+    return payload
+
+
+def decode_telemetry(payload):
+    return {
+        'device_code': payload['device_code'],
+        'voltage': Decimal(payload['voltage']),
+        'current': Decimal(payload['current']),
+        'power_factor': Decimal(payload['power_factor']),
+        'timestamp': datetime.fromisoformat(payload['timestamp']),
+    }
+
+
+def decode_parking_log(payload):
+    return {
+        'device_code': payload['device_code'],
+        'is_occupied': payload['is_occupied'],
+        'timestamp': datetime.fromisoformat(payload['timestamp']),
+    }
+
+
+def spool_enabled():
+    return getattr(settings, 'INGEST_MODE', 'sync') == 'spool'
+
+
+spool = IngestSpool(getattr(settings, 'INGEST_SPOOL_PATH', settings.BASE_DIR / 'spool.sqlite3'))
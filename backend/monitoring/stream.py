@@ -0,0 +1,223 @@
+import asyncio
+import json
+import logging
+import weakref
+from collections import namedtuple
+from datetime import datetime, timedelta, timezone as dt_timezone
+from django.conf import settings
+from django.db.models import Max, Q
+from django.utils import timezone
+from .models import Alert
+from .serializers import AlertSerializer
+
+logger = logging.getLogger(__name__)
+
+EPOCH = datetime(1970, 1, 1, tzinfo=dt_timezone.utc)
+
+
+class StreamPosition(namedtuple('StreamPosition', ['created_id', 'acknowledged_at', 'acknowledged_id'])):
+    """Point in the alert change feed, sent to clients as the SSE event id.
+
+    Creations are ordered by alert id and acknowledgements by
+    (acknowledged_at, id). Neither is a commit order: a transaction can
+    commit an alert after a higher id, or an acknowledgement stamped before
+    one already sent. AlertBroadcaster rescans an overlap window behind the
+    positions for those, so a client that reconnects with Last-Event-ID
+    gets every event after its last one, and may get events of the last
+    `overlap` seconds again.
+    """
+
+    def encode(self):
+        micros = (self.acknowledged_at - EPOCH) // timedelta(microseconds=1)
+        return f'{self.created_id}-{micros}-{self.acknowledged_id}'
+
+    @classmethod
+    def decode(cls, value):
+        try:
+            created_id, micros, acknowledged_id = (int(part) for part in value.split('-'))
+            return cls(created_id, EPOCH + timedelta(microseconds=micros), acknowledged_id)
+        except (AttributeError, ValueError, OverflowError):
+            return None
+
+
+class Subscription:
+    def __init__(self, position, max_queued):
+        self.position = position
+        # None in the queue ends the stream, the client fell too far behind
+        # and resumes from its last event on reconnect
+        self.queue = asyncio.Queue(maxsize=max_queued)
+        # events of the overlap window already sent, by key
+        self.sent = {}
+
+
+class AlertBroadcaster:
+    """Fans alert changes out to every SSE client of one event loop.
+
+    While at least one client is connected a single task polls the database
+    every `interval` seconds: alerts with an id past the oldest client
+    position (created) and alerts acknowledged after it. Both are indexed
+    range scans that return nothing when the system is idle, and their cost
+    does not depend on the number of clients. Each client gets the events
+    after its own position, so a resumed client catches up on the next poll.
+    Alerts created or acknowledged in the last `overlap` seconds are read
+    again on every poll and sent to the clients that have not had them, so
+    an alert committed after a later one is still delivered.
+    A client resumes at most `max_resume` creations and acknowledgements
+    behind the head, an old Last-Event-ID would otherwise hold every poll
+    back to its position.
+    """
+
+    def __init__(self, interval=1.0, batch_size=500, max_queued=1000, max_resume=1000, overlap=10.0):
+        self.interval = interval
+        self.overlap = timedelta(seconds=overlap)
+        self.batch_size = batch_size
+        self.max_queued = max_queued
+        self.max_resume = max_resume
+        self.subscribers = set()
+        self.head = None
+        self._task = None
+
+    async def subscribe(self, position=None):
+        if self.head is None:
+            self.head = await self._current_head()
+        if position is not None:
+            position = await self._resume_from(position)
+        subscription = Subscription(position or self.head, self.max_queued)
+        self.subscribers.add(subscription)
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+        return subscription
+
+    def unsubscribe(self, subscription):
+        self.subscribers.discard(subscription)
+
+    async def poll(self):
+        created_from = min(s.position.created_id for s in self.subscribers)
+        acknowledged_from = min((s.position.acknowledged_at, s.position.acknowledged_id) for s in self.subscribers)
+        window = timezone.now() - self.overlap
+
+        alerts = Alert.objects.select_related('device', 'device__zone')
+        created = [
+            alert async for alert in
+            alerts.filter(pk__gt=created_from).order_by('pk')[:self.batch_size]
+        ]
+        acknowledged_at, acknowledged_id = acknowledged_from
+        acknowledged = [
+            alert async for alert in
+            alerts.filter(
+                Q(acknowledged_at__gt=acknowledged_at)
+                | Q(acknowledged_at=acknowledged_at, pk__gt=acknowledged_id)
+            ).order_by('acknowledged_at', 'pk')[:self.batch_size]
+        ]
+        # committed late, behind positions that already moved past them
+        late_created = [
+            alert async for alert in
+            alerts.filter(created_at__gte=window, pk__lte=created_from).order_by('pk')[:self.batch_size]
+        ]
+        late_acknowledged = [
+            alert async for alert in
+            alerts.filter(acknowledged_at__gte=window).filter(
+                Q(acknowledged_at__lt=acknowledged_at)
+                | Q(acknowledged_at=acknowledged_at, pk__lte=acknowledged_id)
+            ).order_by('acknowledged_at', 'pk')[:self.batch_size]
+        ]
+
+        events = (
+            [('created', alert) for alert in late_created + created]
+            + [('acknowledged', alert) for alert in late_acknowledged + acknowledged]
+        )
+        payloads = {}
+        for subscription in list(self.subscribers):
+            self._deliver(subscription, events, payloads, window)
+
+        head = self.head
+        if created:
+            head = head._replace(created_id=max(head.created_id, created[-1].pk))
+        if acknowledged:
+            last = acknowledged[-1]
+            if (last.acknowledged_at, last.pk) > (head.acknowledged_at, head.acknowledged_id):
+                head = head._replace(acknowledged_at=last.acknowledged_at, acknowledged_id=last.pk)
+        self.head = head
+
+    def _deliver(self, subscription, events, payloads, window):
+        position = subscription.position
+        sent = subscription.sent = {key: moment for key, moment in subscription.sent.items() if moment >= window}
+        for kind, alert in events:
+            if kind == 'created':
+                key, moment = (kind, alert.pk, None), alert.created_at
+                ahead = alert.pk > position.created_id
+                if ahead:
+                    position = position._replace(created_id=alert.pk)
+            else:
+                key, moment = (kind, alert.pk, alert.acknowledged_at), alert.acknowledged_at
+                ahead = (alert.acknowledged_at, alert.pk) > (position.acknowledged_at, position.acknowledged_id)
+                if ahead:
+                    position = position._replace(acknowledged_at=alert.acknowledged_at, acknowledged_id=alert.pk)
+            # behind the position only events of the window can be missing
+            if key in sent or not (ahead or moment >= window):
+                continue
+            if moment >= window:
+                sent[key] = moment
+
+            if key not in payloads:
+                payloads[key] = json.dumps(AlertSerializer(alert).data)
+            try:
+                subscription.queue.put_nowait((kind, payloads[key], position))
+            except asyncio.QueueFull:
+                # end the stream now, the client resumes from its last event
+                self.unsubscribe(subscription)
+                while not subscription.queue.empty():
+                    subscription.queue.get_nowait()
+                subscription.queue.put_nowait(None)
+                return
+        subscription.position = position
+
+    async def _resume_from(self, position):
+        """position clamped to the head and to max_resume events behind it"""
+        head = self.head
+        created_id = min(max(position.created_id, head.created_id - self.max_resume), head.created_id)
+        acknowledged = min((position.acknowledged_at, position.acknowledged_id), (head.acknowledged_at, head.acknowledged_id))
+        oldest = await (
+            Alert.objects.filter(acknowledged_at__isnull=False)
+            .order_by('-acknowledged_at', '-pk')
+            .values_list('acknowledged_at', 'pk')[self.max_resume:self.max_resume + 1]
+            .afirst()
+        )
+        if oldest is not None:
+            acknowledged = max(acknowledged, oldest)
+        return StreamPosition(created_id, *acknowledged)
+
+    async def _current_head(self):
+        created_id = (await Alert.objects.aaggregate(last=Max('pk')))['last'] or 0
+        last = await (
+            Alert.objects.filter(acknowledged_at__isnull=False)
+            .order_by('-acknowledged_at', '-pk')
+            .values_list('acknowledged_at', 'pk')
+            .afirst()
+        )
+        return StreamPosition(created_id, *(last or (EPOCH, 0)))
+
+    async def _run(self):
+        while self.subscribers:
+            try:
+                await self.poll()
+            except Exception:
+                logger.exception('Alert stream poll failed')
+            await asyncio.sleep(self.interval)
+        # nobody listening, recompute the head for the next client
+        self.head = None
+
+
+# one broadcaster per event loop, its queues and task belong to that loop
+_broadcasters = weakref.WeakKeyDictionary()
+
+
+def alert_broadcaster():
+    loop = asyncio.get_running_loop()
+    if loop not in _broadcasters:
+        _broadcasters[loop] = AlertBroadcaster(
+            interval=getattr(settings, 'ALERT_STREAM_POLL_INTERVAL', 1.0),
+            max_resume=getattr(settings, 'ALERT_STREAM_MAX_RESUME', 1000),
+            overlap=getattr(settings, 'ALERT_STREAM_OVERLAP', 10.0),
+        )
+    return _broadcasters[loop]
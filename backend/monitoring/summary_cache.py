@@ -0,0 +1,123 @@
+import threading
+import time
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.utils import timezone
+from .etags import catalog_version
+from .versioning import cache_is_shared
+
+
+class SummaryCache:
+    """Per-date dashboard summary parts kept in the Django cache.
+
+    Past days are cached until a write touches them, today and later days
+    expire after `today_ttl` seconds as well. With a per-process cache
+    (LocMemCache) a write only invalidates its own worker's copy, so past
+    days then expire after `past_ttl` seconds too. Writers call invalidate() with
+    the days they changed, which bumps a per-day version counter so that an
+    entry being computed meanwhile is stored under a key nobody reads.
+    Zone renames and targets are covered by catalog_version.
+
+    A miss is computed once: threads of a process wait on a lock per key,
+    other processes on a lock entry in the cache (when it is shared), and
+    read the result when it lands.
+    """
+
+    def __init__(self, prefix='monitoring:summary', today_ttl=10, past_ttl=300, lock_timeout=10.0, poll=0.05):
+        self.prefix = prefix
+        self.today_ttl = today_ttl
+        self.past_ttl = past_ttl
+        self.lock_timeout = lock_timeout
+        self.poll = poll
+        self._locks = {}
+        self._guard = threading.Lock()
+
+    def get(self, date, compute):
+        key = self._key(date)
+        value = cache.get(key)
+        if value is not None:
+            return value
+
+        with self._lock(key):
+            value = cache.get(key)
+            if value is not None:
+                return value
+            lock_key = f'{key}:lock'
+            acquired = cache.add(lock_key, 1, timeout=self.lock_timeout)
+            if not acquired:
+                value = self._wait(key)
+                if value is not None:
+                    return value
+            try:
+                value = compute()
+                cache.set(key, value, timeout=self._timeout(date))
+            finally:
+                # a lock that timed out on us belongs to its owner
+                if acquired:
+                    cache.delete(lock_key)
+            return value
+
+    def invalidate(self, dates):
+        """Drop the entries of the given days once the surrounding
+        transaction commits
+        """
+        dates = set(dates)
+        if dates:
+            transaction.on_commit(lambda: self._bump(f'{self.prefix}:version:{date}' for date in dates))
+
+    def clear(self):
+        """Drop every entry, for bulk rewrites of history"""
+        transaction.on_commit(lambda: self._bump([f'{self.prefix}:version']))
+
+    def _timeout(self, date):
+        if date >= timezone.localdate():
+            return self.today_ttl
+        return None if cache_is_shared() else self.past_ttl
+
+    def _key(self, date):
+        versions = cache.get_many([f'{self.prefix}:version', f'{self.prefix}:version:{date}'])
+        return ':'.join(str(part) for part in (
+            self.prefix,
+            versions.get(f'{self.prefix}:version'),
+            catalog_version.current(),
+            date,
+            versions.get(f'{self.prefix}:version:{date}'),
+        ))
+
+    def _bump(self, keys):
+        for key in keys:
+            try:
+                cache.incr(key)
+            except ValueError:
+                # key missing or evicted, a fresh counter still changes the key
+                cache.add(key, int(time.time() * 1000), timeout=None)
+
+    def _lock(self, key):
+        with self._guard:
+            lock = self._locks.get(key)
+            if lock is None:
+                # drop locks of keys nobody waits on anymore
+                self._locks = {k: v for k, v in self._locks.items() if v.locked()}
+                lock = self._locks[key] = threading.Lock()
+            return lock
+
+    def _wait(self, key):
+        """Value computed by another process, None when its lock went away
+        or timed out without one
+        """
+        deadline = time.monotonic() + self.lock_timeout
+        while time.monotonic() < deadline:
+            time.sleep(self.poll)
+            value = cache.get(key)
+            if value is not None:
+                return value
+            if cache.get(f'{key}:lock') is None:
+                return cache.get(key)
+        return None
+
+
+summary_cache = SummaryCache(
+    today_ttl=getattr(settings, 'DASHBOARD_CACHE_TTL', 10),
+    past_ttl=getattr(settings, 'DASHBOARD_PAST_CACHE_TTL', 300),
+)
@@ -1,20 +1,121 @@
+import logging
+import time
+from django.db import transaction
+from django.db.models import Exists, OuterRef, Q
 from django.utils import timezone
 from datetime import timedelta
-from .models import Alert, Device
+from .alert_index import open_alerts
+from .models import Alert, Device, ParkingZone
+from .heartbeat import heartbeats
+from .summary_cache import summary_cache
+
+logger = logging.getLogger(__name__)
+
 
 def check_offline_devices():
-    """Background task to check for offline devices"""
-    threshold = timezone.now() - timedelta(minutes=2)
+    """Background task to check for offline devices.
+
+    Raises DEVICE_OFFLINE alerts for devices silent for longer than their
+    zone's offline_timeout and CONNECTION_RESTORED alerts for devices seen
+    again since, each with a single query to find the devices and one bulk
+    write, whatever the number of devices. The in-process OfflineDetector
+    (detector.py) does the same from heartbeats; this scan is the fallback
+    for deployments that run it from a scheduler.
+
+    It reads the stored last_seen only. The heartbeats of the web workers
+    wait in their own buffers (heartbeat.py) for up to
+    HEARTBEAT_FLUSH_INTERVAL seconds, so a device only counts as offline
+    once that delay has passed as well.
+    """
+    started = time.monotonic()
+    heartbeats.flush()
+    now = timezone.now()
+    timeouts = set(ParkingZone.objects.values_list('offline_timeout', flat=True))
+    if not timeouts:
+        return {'offline': 0, 'restored': 0, 'duration': 0}
+
+    flush_delay = timedelta(seconds=max(heartbeats.flush_interval, 0))
+    stale, alive = Q(), Q()
+    for timeout in timeouts:
+        threshold = now - timedelta(seconds=timeout)
+        stale |= Q(zone__offline_timeout=timeout, last_seen__lt=threshold - flush_delay)
+        alive |= Q(device__zone__offline_timeout=timeout, device__last_seen__gte=threshold)
+
+    open_offline = Alert.objects.filter(alert_type='DEVICE_OFFLINE', is_acknowledged=False, resolved_at__isnull=True)
 
     offline_devices = Device.objects.filter(
-        is_active=True,
-        last_seen__lt=threshold
+        stale,
+        is_active=True
+    ).exclude(
+        Exists(open_offline.filter(device=OuterRef('pk')))
+    ).order_by().values_list('pk', 'device_code', 'last_seen', 'zone__offline_timeout')
+
+    offline = raise_offline_alerts(offline_devices)
+
+    # open offline alerts of devices that reported again
+    restored_ids = open_offline.filter(alive).order_by().values_list('device_id', flat=True)
+    restored = restore_devices(list(restored_ids), now)
+
+    duration = time.monotonic() - started
+    logger.info(
+        'Offline check: %d offline, %d restored in %.3fs',
+        len(offline), len(restored), duration
     )
+    return {
+        'offline': len(offline),
+        'restored': len(restored),
+        'duration': round(duration, 3),
+    }
+
+
+def raise_offline_alerts(devices):
+    """DEVICE_OFFLINE alerts for (device_id, device_code, last_seen, timeout) rows"""
+    return Alert.bulk_create_if_not_exists([
+        Alert(
+            device_id=pk,
+            alert_type='DEVICE_OFFLINE',
+            severity='CRITICAL',
+            message=f"Device {device_code} has been offline for more than {timeout} seconds. Last seen: {last_seen}"
+        )
+        for pk, device_code, last_seen, timeout in devices
+    ])
+
+
+def restore_devices(device_ids, now=None):
+    """Resolve the open DEVICE_OFFLINE alerts of the devices and raise one
+    CONNECTION_RESTORED per reconnect.
+
+    Both stay unacknowledged for operators. The resolved offline alert no
+    longer blocks the next outage's alert, and the restored alert is
+    stored resolved, it records an event that is already over, so a device
+    that flaps gets one per reconnect.
+    """
+    if not device_ids:
+        return []
+
+    now = now or timezone.now()
+    with transaction.atomic():
+        resolved = Alert.objects.filter(
+            device_id__in=device_ids,
+            alert_type='DEVICE_OFFLINE',
+            is_acknowledged=False,
+            resolved_at__isnull=True,
+        ).order_by()
+        restored_ids = list(resolved.select_for_update().values_list('device_id', flat=True))
+        if not restored_ids:
+            return []
+        resolved.filter(device_id__in=restored_ids).update(resolved_at=now)
+        open_alerts.discard((device_id, 'DEVICE_OFFLINE') for device_id in restored_ids)
 
-    for device in offline_devices:
-        Alert.create_if_not_exists(
-            device=device,
-            alert_type="DEVICE_OFFLINE",
-            severity="CRITICAL",
-            message=f"Device {device.device_code} has been offline for more than 2 minutes. Last seen: {device.last_seen}"
-        )
\ No newline at end of file
+        restored = Alert.objects.bulk_create([
+            Alert(
+                device_id=device_id,
+                alert_type='CONNECTION_RESTORED',
+                severity='INFO',
+                message='Device reconnected successfully',
+                resolved_at=now,
+            )
+            for device_id in restored_ids
+        ])
+        summary_cache.invalidate([timezone.localdate(now)])
+        return restored
@@ -1,3 +1,1366 @@
-from django.test import TestCase
+import asyncio
+import gzip
+import json
+import random
+import tempfile
+import threading
+import time
+from datetime import datetime, timedelta
+from decimal import Decimal
+from io import StringIO
+from unittest import skipUnless
+from unittest.mock import patch
+import numpy as np
+from asgiref.sync import sync_to_async
+from django.core.cache import cache
+from django.core.management import CommandError, call_command
+from django.db import DataError, IntegrityError, transaction
+from django.core.exceptions import ValidationError
+from django.db.models import Q, Sum
+from django.test import AsyncClient, TestCase, TransactionTestCase, override_settings
+from django.utils import timezone
+from django.test.utils import CaptureQueriesContext
+from django.db import connection
+from rest_framework.test import APIClient
+from .alert_index import OpenAlertIndex, open_alerts
+from .detector import OfflineDetector, offline_detector
+from .heartbeat import HeartbeatBuffer, heartbeats
+from .registry import DeviceRegistry, device_registry
+from .rules import rule_engine
+from .ingestion import ingest_parking_logs, ingest_telemetry, rebuild_device_states
+from .health import devices_to_score, score_devices
+from . import retention
+from .compaction import compact_telemetry, decode_chunk, encode_chunk
+from .models import DEFAULT_OFFLINE_TIMEOUT, AlertRule, ParkingZone, Device, DeviceHealth, DeviceState, ParkingLog, TelemetryData, Alert, TelemetryChunk, ZoneDailyStats, ZoneEnergyDaily, ZoneHourlyStats
+from .rollups import hour_of, rebuild_energy_rollups, rebuild_rollups
+from .summary_cache import SummaryCache
+from .tasks import check_offline_devices
+from .timeseries import load_telemetry
+from .serializers import ParkingLogSerializer, TelemetrySerializer
+from .spool import IngestSpool
+from .stream import EPOCH, AlertBroadcaster, StreamPosition, Subscription
+from .async_views import _alert_events
+from .writer import WriteQueue, WriterTimeout
 
-# Create your tests here.
+
+class IngestionTestCase(TestCase):
+    """Zone A with devices A-0, A-1 and A-2. Heartbeats are written at once
+    and the offline detector thread stays off, process-wide caches start
+    empty.
+    """
+
+    def setUp(self):
+        for target, name, value in ((heartbeats, 'flush_interval', 0), (offline_detector, 'enabled', False)):
+            self.addCleanup(setattr, target, name, getattr(target, name))
+            setattr(target, name, value)
+        cache.clear()
+        device_registry.clear()
+        open_alerts.reload()
+        rule_engine.invalidate()
+        self.zone = ParkingZone.objects.create(name='Zone A', code='A', total_slots=10, daily_target=4)
+        self.devices = [
+            Device.objects.create(device_code=f'A-{i}', zone=self.zone, slot_number=str(i)) for i in range(3)
+        ]
+        self.client = APIClient()
+        self.now = timezone.now().replace(microsecond=0)
+
+    def reading(self, device_code='A-0', seconds_ago=10, **fields):
+        return {
+            'device_code': device_code,
+            'voltage': '220.00',
+            'current': '5.00',
+            'power_factor': '0.90',
+            'timestamp': (self.now - timedelta(seconds=seconds_ago)).isoformat(),
+            **fields,
+        }
+
+
+class BulkTelemetryTests(IngestionTestCase):
+    def test_valid_readings_stored_and_bad_ones_reported(self):
+        items = [self.reading(f'A-{i % 3}', seconds_ago=10 + i) for i in range(6)]
+        items += [
+            items[0],
+            self.reading('nope'),
+            self.reading(['A-0']),
+            self.reading({'code': 'A-0'}),
+            self.reading('A-1', voltage='-1'),
+        ]
+        response = self.client.post('/api/telemetry/bulk/', {'data': items}, format='json')
+
+        self.assertEqual(response.status_code, 201)
+        data = response.json()
+        self.assertEqual(data['created'], 6)
+        self.assertEqual(len(data['errors']), 5)
+        self.assertEqual(data['errors'][0]['device_code'], 'nope')
+        self.assertIn('device_code', data['errors'][1]['error'])
+        self.assertIsInstance(data['errors'][1]['error'], str)
+        self.assertIn('voltage', data['errors'][3]['error'])
+        self.assertEqual(data['errors'][-1]['error'], 'Duplicate telemetry data')
+        self.assertEqual(TelemetryData.objects.count(), 6)
+
+        # a replayed batch only reports duplicates
+        data = self.client.post('/api/telemetry/bulk/', {'data': items[:6]}, format='json').json()
+        self.assertEqual((data['created'], len(data['errors'])), (0, 6))
+
+    def test_queries_do_not_grow_with_the_batch(self):
+        def queries(items):
+            with CaptureQueriesContext(connection) as context:
+                self.client.post('/api/telemetry/bulk/', {'data': items}, format='json')
+            return len(context)
+
+        # the first batch also loads the devices and the alert rules
+        queries([self.reading(f'A-{i % 3}', seconds_ago=300 + i) for i in range(3)])
+        small = queries([self.reading(f'A-{i % 3}', seconds_ago=200 + i) for i in range(3)])
+        large = queries([self.reading(f'A-{i % 3}', seconds_ago=100 + i) for i in range(60)])
+        self.assertEqual(small, large)
+
+    def test_high_power_alert_once_per_device(self):
+        items = [self.reading('A-0', seconds_ago=10 + i, current='20.00') for i in range(3)]
+        self.client.post('/api/telemetry/bulk/', {'data': items}, format='json')
+        self.client.post('/api/telemetry/bulk/', {'data': [self.reading('A-0', current='20.00')]}, format='json')
+
+        alert = Alert.objects.get()
+        self.assertEqual((alert.device, alert.alert_type), (self.devices[0], 'HIGH_POWER'))
+
+
+class DeviceRegistryTests(IngestionTestCase):
+    def test_warm_reading_costs_no_device_lookup(self):
+        self.assertEqual(self.client.post('/api/telemetry/', self.reading(seconds_ago=20), format='json').status_code, 201)
+        with CaptureQueriesContext(connection) as context:
+            self.client.post('/api/telemetry/', self.reading(seconds_ago=10), format='json')
+        self.assertFalse([query for query in context if 'FROM "monitoring_device"' in query['sql']])
+        # the zone's offline_timeout for the energy rollup comes with the entry
+        self.assertFalse([query for query in context if 'FROM "monitoring_parkingzone"' in query['sql']])
+
+        # saving a device drops its entry
+        self.devices[0].is_active = False
+        self.devices[0].save()
+        response = self.client.post('/api/telemetry/', self.reading(seconds_ago=5), format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('inactive', str(response.json()))
+
+    def test_zone_timeout_change_reaches_energy(self):
+        self.client.post('/api/telemetry/', self.reading(seconds_ago=100, current='1.00'), format='json')
+        self.zone.offline_timeout = 30
+        self.zone.save()
+        self.client.post('/api/telemetry/', self.reading(seconds_ago=10, current='1.00'), format='json')
+        # 90 seconds since the previous reading, capped at the new 30
+        energy = ZoneEnergyDaily.objects.get(zone=self.zone, date=timezone.localdate(self.now - timedelta(seconds=10)))
+        self.assertAlmostEqual(energy.energy_wh, 220 * 0.9 * 30 / 3600)
+
+    def test_unknown_codes_expire(self):
+        registry = DeviceRegistry(missing_ttl=60)
+        self.assertIsNone(registry.get('B-1'))
+        # created without signals, as another worker process would
+        Device.objects.bulk_create([Device(device_code='B-1', zone=self.zone, slot_number='11')])
+        with self.assertNumQueries(0):
+            self.assertIsNone(registry.get('B-1'))
+
+        registry.missing_ttl = 0
+        registry.get('B-2')
+        Device.objects.bulk_create([Device(device_code='B-2', zone=self.zone, slot_number='12')])
+        self.assertIsNotNone(registry.get('B-2'))
+
+    def test_lru_eviction(self):
+        registry = DeviceRegistry(max_size=2)
+        registry.get_many(['A-0', 'A-1', 'A-2'])
+        self.assertEqual(registry.stats()['size'], 2)
+        self.assertEqual(registry.stats()['evictions'], 1)
+
+
+class HeartbeatBufferTests(IngestionTestCase):
+    def test_newest_heartbeat_flushed_in_one_update(self):
+        buffer = HeartbeatBuffer(flush_interval=1000)
+        self.addCleanup(buffer.stop)
+        a, b, _ = self.devices
+        with self.assertNumQueries(0):
+            buffer.record([a.id, b.id], seen_at=self.now - timedelta(seconds=30))
+            buffer.record([a.id], seen_at=self.now)
+            # an older heartbeat does not roll the newest back
+            buffer.record([a.id], seen_at=self.now - timedelta(seconds=60))
+        self.assertEqual(buffer.last_seen(a.id), self.now)
+        self.assertEqual(set(buffer.pending(since=self.now)), {a.id})
+
+        with self.assertNumQueries(1):
+            self.assertEqual(buffer.flush(), 2)
+        self.assertEqual(buffer.pending(), {})
+        self.assertEqual(
+            dict(Device.objects.filter(last_seen__isnull=False).values_list('pk', 'last_seen')),
+            {a.id: self.now, b.id: self.now - timedelta(seconds=30)},
+        )
+
+    def test_dashboard_counts_pending_heartbeats(self):
+        buffer = HeartbeatBuffer(flush_interval=1000)
+        self.addCleanup(buffer.stop)
+        buffer.record([self.devices[0].id])
+        with patch('monitoring.serializers.heartbeats', buffer), patch('monitoring.etags.heartbeats', buffer):
+            data = self.client.get('/api/dashboard/summary/').json()
+        self.assertEqual(data['summary']['active_devices'], 1)
+
+
+@override_settings(INGEST_MODE='spool')
+class SpoolTests(IngestionTestCase):
+    def setUp(self):
+        super().setUp()
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.spool = IngestSpool(f'{directory.name}/spool.sqlite3')
+        for target in ('serializers', 'views', 'management.commands.drain_spool'):
+            patcher = patch(f'monitoring.{target}.spool', self.spool)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def drain(self):
+        call_command('drain_spool', '--once', stdout=StringIO())
+
+    def test_accepted_then_drained(self):
+        response = self.client.post('/api/telemetry/', self.reading(), format='json')
+        self.assertEqual(response.status_code, 202)
+        response = self.client.post('/api/telemetry/bulk/', {'data': [
+            self.reading('A-1'), self.reading('A-2'), self.reading('nope'),
+        ]}, format='json')
+        self.assertEqual(response.status_code, 202)
+        self.assertEqual((response.json()['accepted'], len(response.json()['errors'])), (2, 1))
+        self.assertFalse(TelemetryData.objects.exists())
+        self.assertEqual(self.spool.stats()['depth'], 3)
+
+        self.drain()
+        self.assertEqual(TelemetryData.objects.count(), 3)
+        self.assertEqual(self.spool.stats()['depth'], 0)
+
+        # entries replayed after a crash before the offset moved
+        self.client.post('/api/telemetry/', self.reading(), format='json')
+        self.drain()
+        self.assertEqual(TelemetryData.objects.count(), 3)
+
+    def test_single_parking_logs_stored_like_sync_mode(self):
+        # a repeated state is stored by /api/parking-log/, dropped by the bulk endpoint
+        events = [
+            {'device_code': 'A-0', 'is_occupied': True, 'timestamp': (self.now - timedelta(seconds=seconds_ago)).isoformat()}
+            for seconds_ago in (30, 20)
+        ]
+        for event in events:
+            self.assertEqual(self.client.post('/api/parking-log/', event, format='json').status_code, 202)
+        self.client.post('/api/parking-log/bulk/', {'data': [
+            {'device_code': 'A-1', 'is_occupied': True, 'timestamp': (self.now - timedelta(seconds=30)).isoformat()},
+            {'device_code': 'A-1', 'is_occupied': True, 'timestamp': (self.now - timedelta(seconds=20)).isoformat()},
+        ]}, format='json')
+
+        self.drain()
+        self.assertEqual(ParkingLog.objects.filter(device=self.devices[0]).count(), 2)
+        self.assertEqual(ParkingLog.objects.filter(device=self.devices[1]).count(), 1)
+
+        # replayed after a crash before the offset moved
+        self.spool.append('parking_log_event', events[0])
+        self.drain()
+        self.assertEqual(ParkingLog.objects.count(), 3)
+
+    def test_bad_entries_moved_to_dead_letters(self):
+        self.client.post('/api/telemetry/', self.reading(), format='json')
+        self.spool.append('telemetry', self.reading('A-1', voltage='not a number'))
+        self.client.post('/api/parking-log/bulk/', {'data': [
+            {'device_code': 'A-1', 'is_occupied': True, 'timestamp': self.now.isoformat()},
+        ]}, format='json')
+
+        def ingest_parking_logs(items):
+            if items:
+                raise DataError('value too long')
+            return [], {}
+
+        with patch('monitoring.management.commands.drain_spool.ingest_parking_logs', ingest_parking_logs):
+            self.drain()
+        self.assertEqual(TelemetryData.objects.count(), 1)
+        self.assertFalse(ParkingLog.objects.exists())
+        self.assertEqual(self.spool.stats()['depth'], 0)
+        self.assertEqual(
+            [(kind, error.split(':')[0]) for _, kind, _, error in self.spool.dead_letters()],
+            [('telemetry', 'InvalidOperation'), ('parking_log', 'DataError')],
+        )
+
+
+class BulkParkingLogTests(IngestionTestCase):
+    def event(self, device_code, is_occupied, seconds_ago):
+        return {
+            'device_code': device_code,
+            'is_occupied': is_occupied,
+            'timestamp': (self.now - timedelta(seconds=seconds_ago)).isoformat(),
+        }
+
+    def test_replay_ordered_and_deduplicated(self):
+        items = [
+            # out of order, replayed by the gateway
+            self.event('A-0', False, 10),
+            self.event('A-0', True, 30),
+            self.event('A-0', True, 20),
+            self.event('A-0', True, 30),
+            self.event('A-1', True, 30),
+            self.event('nope', True, 30),
+            self.event(['A-0'], True, 30),
+        ]
+        response = self.client.post('/api/parking-log/bulk/', {'data': items}, format='json')
+
+        self.assertEqual(response.status_code, 201)
+        data = response.json()
+        self.assertEqual(
+            (data['accepted'], data['rejected'], data['duplicates'], data['unchanged'], len(data['errors'])),
+            (3, 4, 1, 1, 2),
+        )
+        self.assertEqual(
+            list(ParkingLog.objects.filter(device=self.devices[0]).order_by('timestamp').values_list('is_occupied', flat=True)),
+            [True, False],
+        )
+        self.assertFalse(DeviceState.objects.get(device=self.devices[0]).is_occupied)
+
+        # events older than the stored state are stale
+        data = self.client.post('/api/parking-log/bulk/', {'data': items[:2]}, format='json').json()
+        self.assertEqual((data['accepted'], data['stale'], data['duplicates']), (0, 1, 1))
+
+    def test_flip_at_the_same_time_is_kept(self):
+        items = [self.event('A-0', True, 30), self.event('A-0', False, 30)]
+        data = self.client.post('/api/parking-log/bulk/', {'data': items[:1]}, format='json').json()
+        self.assertEqual(data['accepted'], 1)
+        data = self.client.post('/api/parking-log/bulk/', {'data': items[1:]}, format='json').json()
+        self.assertEqual((data['accepted'], data['duplicates']), (1, 0))
+        self.assertFalse(DeviceState.objects.get(device=self.devices[0]).is_occupied)
+
+        # replaying both only finds duplicates
+        data = self.client.post('/api/parking-log/bulk/', {'data': items}, format='json').json()
+        self.assertEqual((data['accepted'], data['duplicates']), (0, 2))
+        self.assertEqual(ParkingLog.objects.count(), 2)
+
+
+class TelemetryStreamTests(IngestionTestCase):
+    def post(self, lines, **extra):
+        body = '\n'.join(lines).encode()
+        if extra.get('HTTP_CONTENT_ENCODING') == 'gzip':
+            body = gzip.compress(body)
+        return self.client.generic('POST', '/api/telemetry/stream/', body, content_type='application/x-ndjson', **extra)
+
+    @override_settings(TELEMETRY_STREAM_CHUNK_SIZE=4)
+    def test_gzip_stream_in_chunks(self):
+        lines = [json.dumps(self.reading(f'A-{i % 3}', seconds_ago=10 + i)) for i in range(10)]
+        lines[3] = '{broken'
+        lines[5] = json.dumps(self.reading(['A-0']))
+        lines.append(lines[0])
+        response = self.post(lines, HTTP_CONTENT_ENCODING='gzip')
+
+        self.assertEqual(response.status_code, 201)
+        data = response.json()
+        self.assertEqual(
+            {key: data[key] for key in ('received', 'created', 'duplicates', 'invalid', 'chunks')},
+            {'received': 11, 'created': 8, 'duplicates': 1, 'invalid': 2, 'chunks': 3},
+        )
+        self.assertEqual([error['line'] for error in data['errors']], [4, 6])
+        self.assertEqual(TelemetryData.objects.count(), 8)
+
+    def test_truncated_gzip_rejected(self):
+        body = gzip.compress(json.dumps(self.reading()).encode() + b'\n')[:-8]
+        response = self.client.generic(
+            'POST', '/api/telemetry/stream/', body,
+            content_type='application/x-ndjson', HTTP_CONTENT_ENCODING='gzip',
+        )
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('decompress', response.json()['error'])
+
+
+class AsyncIngestionTests(IngestionTestCase):
+    async def test_async_views(self):
+        client = AsyncClient()
+        response = await client.post('/api/telemetry/async/', self.reading(), content_type='application/json')
+        self.assertEqual(response.status_code, 201)
+        response = await client.post('/api/telemetry/async/', self.reading(), content_type='application/json')
+        self.assertEqual(response.json(), {'error': 'Duplicate telemetry data'})
+
+        response = await client.post('/api/telemetry/bulk/async/', {'data': [
+            self.reading('A-1'), self.reading(['A-1']), self.reading('nope'),
+        ]}, content_type='application/json')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual((response.json()['created'], len(response.json()['errors'])), (1, 2))
+
+        response = await client.post('/api/parking-log/async/', {
+            'device_code': 'A-2', 'is_occupied': True, 'timestamp': self.now.isoformat(),
+        }, content_type='application/json')
+        self.assertEqual(response.status_code, 201)
+
+        response = await client.post('/api/telemetry/async/', '[1]', content_type='application/json')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(await TelemetryData.objects.acount(), 2)
+        self.assertEqual(await ParkingLog.objects.acount(), 1)
+
+    async def test_write_errors_answer_400_like_the_sync_views(self):
+        client = AsyncClient()
+        for path, serializer in (('/api/telemetry/async/', TelemetrySerializer), ('/api/parking-log/async/', ParkingLogSerializer)):
+            with patch.object(serializer, 'save', side_effect=DataError('value out of range')):
+                response = await client.post(path, self.reading(is_occupied=True), content_type='application/json')
+            self.assertEqual((response.status_code, response.json()), (400, {'error': 'value out of range'}))
+
+
+class AlertRuleTests(IngestionTestCase):
+    def ingest(self, device, **fields):
+        reading = {
+            'device_id': device.id,
+            'zone_id': device.zone_id,
+            'voltage': Decimal('220.00'),
+            'current': Decimal('5.00'),
+            'power_factor': Decimal('0.90'),
+            'timestamp': self.now,
+            **fields,
+        }
+        ingest_telemetry([reading], heartbeat=False)
+
+    def test_zone_and_device_overrides(self):
+        a, b, c = self.devices
+        AlertRule.objects.create(
+            alert_type='LOW_VOLTAGE', metric='voltage', operator='lt', threshold=215,
+            message='{value:.1f} < {threshold:g}', zone=self.zone,
+        )
+        AlertRule.objects.create(
+            alert_type='LOW_VOLTAGE', metric='voltage', operator='lt', threshold=215,
+            message='', device=c, is_enabled=False,
+        )
+        for device in self.devices:
+            self.ingest(device, voltage=Decimal('212.00'))
+
+        self.assertEqual(
+            list(Alert.objects.order_by('device_id').values_list('device_id', 'alert_type', 'message')),
+            [(a.id, 'LOW_VOLTAGE', '212.0 < 215'), (b.id, 'LOW_VOLTAGE', '212.0 < 215')],
+        )
+
+        # other zones keep the default rule
+        zone = ParkingZone.objects.create(name='Zone B', code='B', total_slots=10, daily_target=4)
+        other = Device.objects.create(device_code='B-0', zone=zone, slot_number='0')
+        self.ingest(other, voltage=Decimal('212.00'))
+        self.ingest(other, voltage=Decimal('209.00'), timestamp=self.now - timedelta(seconds=1))
+        self.assertEqual(Alert.objects.get(device=other).message, 'Voltage below normal: 209.00V (threshold: 210V)')
+
+    def test_bad_message_rejected_and_never_breaks_ingestion(self):
+        rule = AlertRule(alert_type='TEST', metric='voltage', operator='gt', threshold=200, message='v={foo}')
+        with self.assertRaises(ValidationError):
+            rule.full_clean()
+        rule.message = '{value:.2f} {threshold}'
+        rule.full_clean()
+
+        # saved without validation
+        AlertRule.objects.create(alert_type='TEST', metric='voltage', operator='gt', threshold=200, message='v={foo} {0}')
+        response = self.client.post('/api/telemetry/', self.reading(), format='json')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(Alert.objects.get(alert_type='TEST').message, 'v={foo} {0}')
+
+    def test_seeded_anomalies_raise_rule_alerts(self):
+        random.seed(8)
+        call_command('seed_data', stdout=StringIO())
+        self.assertTrue(Alert.objects.filter(alert_type='LOW_VOLTAGE').exists())
+        self.assertTrue(Alert.objects.filter(alert_type='HIGH_POWER').exists())
+        self.assertFalse(Alert.objects.filter(message__contains='expected').exists())
+        self.assertEqual(
+            set(Alert.objects.values_list('device_id', flat=True)),
+            set(TelemetryData.objects.filter(Q(voltage__lt=210) | Q(power__gt=1500)).values_list('device_id', flat=True)),
+        )
+
+
+class OpenAlertIndexTests(IngestionTestCase):
+    def alert(self, device, alert_type='HIGH_POWER'):
+        return Alert(device=device, alert_type=alert_type, severity='WARNING', message='')
+
+    def test_one_open_alert_per_device_and_type(self):
+        a, b, _ = self.devices
+        for enabled in (True, False):
+            index = OpenAlertIndex(enabled=enabled)
+            with patch('monitoring.alert_index.open_alerts', index):
+                Alert.bulk_create_if_not_exists([self.alert(a), self.alert(a), self.alert(b)])
+                Alert.bulk_create_if_not_exists([self.alert(a), self.alert(a, 'LOW_VOLTAGE')])
+            self.assertEqual(Alert.objects.filter(is_acknowledged=False).count(), 3)
+            Alert.objects.update(is_acknowledged=True)
+
+        # the constraint still holds when the index misses a pair
+        Alert.objects.create(device=a, alert_type='HIGH_POWER', severity='WARNING', message='')
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            Alert.objects.create(device=a, alert_type='HIGH_POWER', severity='WARNING', message='')
+
+    def test_acknowledged_pairs_alert_again(self):
+        device = self.devices[0]
+        index = OpenAlertIndex(enabled=False)
+        with patch('monitoring.alert_index.open_alerts', index):
+            Alert.bulk_create_if_not_exists([self.alert(device)])
+            # acknowledged by another worker, nothing tells this one
+            Alert.objects.update(is_acknowledged=True)
+            self.assertEqual(len(Alert.bulk_create_if_not_exists([self.alert(device)])), 1)
+
+    def test_lost_race_is_not_reported_as_created(self):
+        a, b, _ = self.devices
+        index = OpenAlertIndex(enabled=True)
+        index.reload()
+        with patch('monitoring.alert_index.open_alerts', index), self.captureOnCommitCallbacks(execute=True):
+            # stored by another worker, this index has not heard of it
+            Alert.objects.bulk_create([self.alert(a)])
+            created = Alert.bulk_create_if_not_exists([self.alert(a), self.alert(b)])
+            self.assertEqual([(alert.device_id, alert.pk is not None) for alert in created], [(b.id, True)])
+            self.assertEqual(created[0], Alert.objects.get(device=b))
+        # both pairs are known open now
+        self.assertEqual(index.filter_new([self.alert(a), self.alert(b)]), [])
+
+        index._pairs = set()
+        with patch('monitoring.alert_index.open_alerts', index):
+            self.assertIsNone(Alert.create_if_not_exists(a, 'HIGH_POWER', 'WARNING', ''))
+
+    @override_settings(OPEN_ALERT_INDEX=True)
+    def test_index_needs_a_shared_cache(self):
+        from .alert_index import _index_enabled
+        with self.assertLogs('monitoring.alert_index', 'WARNING'):
+            self.assertFalse(_index_enabled())
+        with override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache', 'LOCATION': tempfile.gettempdir()}}):
+            self.assertTrue(_index_enabled())
+
+
+class OfflineCheckTests(IngestionTestCase):
+    def setUp(self):
+        super().setUp()
+        self.device = self.devices[0]
+        Device.objects.update(last_seen=self.now)
+
+    def go_offline(self):
+        Device.objects.filter(pk=self.device.pk).update(last_seen=timezone.now() - timedelta(minutes=10))
+
+    def test_flapping_device(self):
+        self.go_offline()
+        self.assertEqual(check_offline_devices()['offline'], 1)
+        self.assertEqual(check_offline_devices()['offline'], 0)
+
+        heartbeats.record([self.device.id])
+        self.assertEqual(check_offline_devices()['restored'], 1)
+        offline = Alert.objects.get(alert_type='DEVICE_OFFLINE')
+        # resolved, still waiting for an operator
+        self.assertFalse(offline.is_acknowledged)
+        self.assertIsNotNone(offline.resolved_at)
+        result = check_offline_devices()
+        self.assertEqual((result['offline'], result['restored']), (0, 0))
+
+        # a second outage and reconnect get alerts of their own
+        self.go_offline()
+        self.assertEqual(check_offline_devices()['offline'], 1)
+        heartbeats.record([self.device.id])
+        self.assertEqual(check_offline_devices()['restored'], 1)
+        self.assertEqual(
+            sorted(Alert.objects.values_list('alert_type', 'is_acknowledged')),
+            [('CONNECTION_RESTORED', False)] * 2 + [('DEVICE_OFFLINE', False)] * 2,
+        )
+
+    def test_waits_for_heartbeats_buffered_elsewhere(self):
+        # a worker may hold the device's heartbeat for one flush interval
+        Device.objects.filter(pk=self.device.pk).update(
+            last_seen=timezone.now() - timedelta(seconds=DEFAULT_OFFLINE_TIMEOUT + 2)
+        )
+        with patch.object(heartbeats, 'flush_interval', 5):
+            self.assertEqual(check_offline_devices()['offline'], 0)
+            self.go_offline()
+            self.assertEqual(check_offline_devices()['offline'], 1)
+
+    def test_queries_do_not_grow_with_devices(self):
+        def queries():
+            with CaptureQueriesContext(connection) as context:
+                check_offline_devices()
+            return len(context)
+
+        Device.objects.update(last_seen=timezone.now() - timedelta(minutes=10))
+        few = queries()
+        Device.objects.bulk_create([
+            Device(device_code=f'B-{i}', zone=self.zone, slot_number=f'B{i}', last_seen=timezone.now() - timedelta(minutes=10))
+            for i in range(30)
+        ])
+        Alert.objects.update(is_acknowledged=True)
+        self.assertEqual(queries(), few)
+
+
+class OfflineDetectorTests(TransactionTestCase):
+    def setUp(self):
+        zone = ParkingZone.objects.create(name='Zone A', code='A', total_slots=2, daily_target=4, offline_timeout=1)
+        self.device = Device.objects.create(device_code='A-1', zone=zone, slot_number='1')
+        self.detector = OfflineDetector(tick=0.05)
+        self.addCleanup(self.detector.stop)
+
+    def wait_for(self, alert_type):
+        deadline = time.monotonic() + 5
+        while time.monotonic() < deadline:
+            if Alert.objects.filter(alert_type=alert_type).exists():
+                return True
+            time.sleep(0.05)
+        return False
+
+    def test_alerts_from_heartbeat_deadlines(self):
+        started = time.monotonic()
+        self.detector.touch([self.device.id], timezone.now())
+        self.assertTrue(self.wait_for('DEVICE_OFFLINE'))
+        # fired from the deadline, not from a polling interval
+        self.assertLess(time.monotonic() - started, 3)
+
+        self.detector.touch([self.device.id], timezone.now())
+        self.assertTrue(self.wait_for('CONNECTION_RESTORED'))
+        self.assertIsNotNone(Alert.objects.get(alert_type='DEVICE_OFFLINE').resolved_at)
+
+
+class AlertPaginationTests(TestCase):
+    def setUp(self):
+        zone = ParkingZone.objects.create(name='Zone A', code='A', total_slots=10, daily_target=4)
+        self.devices = [
+            Device.objects.create(device_code=f'A-{i}', zone=zone, slot_number=str(i))
+            for i in range(3)
+        ]
+        self.client = APIClient()
+        self.now = timezone.now()
+        # five alerts share each instant, id breaks the ties
+        Alert.objects.bulk_create([
+            Alert(device=self.devices[i % 3], alert_type='HIGH_POWER', severity='WARNING', message=str(i), is_acknowledged=True)
+            for i in range(25)
+        ])
+        for i, pk in enumerate(Alert.objects.order_by('pk').values_list('pk', flat=True)):
+            Alert.objects.filter(pk=pk).update(created_at=self.now - timedelta(minutes=i // 5))
+
+    def pages(self, url):
+        ids = []
+        while url:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            ids.append([alert['id'] for alert in response.data['results']])
+            url = response.data['next']
+        return ids
+
+    def test_pages_follow_created_at_then_id(self):
+        pages = self.pages('/api/alerts/?page_size=7')
+        self.assertEqual([len(page) for page in pages], [7, 7, 7, 4])
+        expected = list(Alert.objects.order_by('-created_at', '-id').values_list('id', flat=True))
+        self.assertEqual(sum(pages, []), expected)
+
+    def test_new_alerts_do_not_shift_later_pages(self):
+        response = self.client.get('/api/alerts/?page_size=10')
+        first = [alert['id'] for alert in response.data['results']]
+        Alert.objects.create(device=self.devices[0], alert_type='LOW_VOLTAGE', severity='WARNING', message='new')
+        rest = sum(self.pages(response.data['next']), [])
+        self.assertEqual(len(first + rest), 25)
+        self.assertFalse(set(first) & set(rest))
+
+    def test_page_size_is_capped(self):
+        with patch('monitoring.views.AlertCursorPagination.max_page_size', 4):
+            response = self.client.get('/api/alerts/?page_size=100')
+        self.assertEqual(len(response.data['results']), 4)
+
+    def test_filters_apply_to_every_page(self):
+        Alert.objects.filter(pk__in=Alert.objects.order_by('pk').values('pk')[:6]).update(severity='CRITICAL')
+        pages = self.pages('/api/alerts/?severity=critical&page_size=4')
+        self.assertEqual([len(page) for page in pages], [4, 2])
+
+
+class AlertStreamTests(IngestionTestCase):
+    def test_refused_under_wsgi(self):
+        response = self.client.get('/api/alerts/stream/')
+        self.assertEqual(response.status_code, 501)
+
+    def test_decode_rejects_bad_ids(self):
+        position = StreamPosition(3, EPOCH + timedelta(seconds=1), 2)
+        self.assertEqual(StreamPosition.decode(position.encode()), position)
+        for value in (None, '', '1-2', 'a-b-c', f'1-{10 ** 30}-1'):
+            self.assertIsNone(StreamPosition.decode(value))
+
+    async def test_resume_is_limited(self):
+        alerts = await sync_to_async(self.create_alerts)(5)
+        broadcaster = AlertBroadcaster(max_resume=2)
+        subscription = await broadcaster.subscribe(StreamPosition(0, EPOCH, 0))
+        broadcaster.unsubscribe(subscription)
+        broadcaster._task.cancel()
+
+        head = broadcaster.head
+        self.assertEqual(head.created_id, alerts[-1].pk)
+        self.assertEqual(subscription.position.created_id, alerts[-1].pk - 2)
+        # the third newest acknowledgement, the last two are replayed
+        self.assertEqual(subscription.position.acknowledged_id, alerts[2].pk)
+
+        # a position past the head starts at the head
+        subscription = await broadcaster.subscribe(StreamPosition(10 ** 6, head.acknowledged_at + timedelta(days=1), 0))
+        broadcaster.unsubscribe(subscription)
+        broadcaster._task.cancel()
+        self.assertEqual(subscription.position, head)
+
+    async def test_late_commits_are_delivered_once(self):
+        alerts = await sync_to_async(self.create_alerts)(3)
+        broadcaster = AlertBroadcaster()
+        broadcaster.head = await broadcaster._current_head()
+        # the client got the newest creation and acknowledgement, the
+        # others committed after them
+        newest = alerts[-1]
+        subscription = Subscription(broadcaster.head, 10)
+        subscription.sent = {
+            ('created', newest.pk, None): newest.created_at,
+            ('acknowledged', newest.pk, newest.acknowledged_at): newest.acknowledged_at,
+        }
+        broadcaster.subscribers.add(subscription)
+
+        await broadcaster.poll()
+        events = [subscription.queue.get_nowait() for _ in range(subscription.queue.qsize())]
+        self.assertEqual(
+            sorted((kind, json.loads(data)['id']) for kind, data, _ in events),
+            sorted([('created', alert.pk) for alert in alerts[:2]] + [('acknowledged', alert.pk) for alert in alerts[:2]]),
+        )
+        # the position does not go back
+        self.assertTrue(all(position == broadcaster.head for _, _, position in events))
+        await broadcaster.poll()
+        self.assertTrue(subscription.queue.empty())
+
+    async def test_lagging_client_stream_ends(self):
+        await sync_to_async(self.create_alerts)(1)
+        broadcaster = AlertBroadcaster(max_queued=1, overlap=0)
+        broadcaster.head = StreamPosition(0, EPOCH, 0)
+        subscription = Subscription(broadcaster.head, 1)
+        broadcaster.subscribers.add(subscription)
+
+        await broadcaster.poll()
+        self.assertFalse(broadcaster.subscribers)
+        stream = _alert_events(broadcaster, subscription, subscription.position)
+        self.assertTrue((await anext(stream)).startswith('retry:'))
+        with self.assertRaises(StopAsyncIteration):
+            await asyncio.wait_for(anext(stream), 1)
+
+    def create_alerts(self, count):
+        Alert.objects.bulk_create([
+            Alert(device=self.devices[0], alert_type=f'TEST_{i}', severity='INFO', message='',
+                  is_acknowledged=True, acknowledged_at=self.now + timedelta(seconds=i))
+            for i in range(count)
+        ])
+        return list(Alert.objects.order_by('pk'))
+
+
+class AlertsETagTests(IngestionTestCase):
+    def setUp(self):
+        super().setUp()
+        shared = patch('monitoring.etags.cache_is_shared', return_value=True)
+        shared.start()
+        self.addCleanup(shared.stop)
+        for device in self.devices:
+            Alert.objects.create(device=device, alert_type='DEVICE_OFFLINE', severity='CRITICAL', message='')
+
+    def assertChanged(self, change):
+        etag = self.client.get('/api/alerts/')['ETag']
+        self.assertEqual(self.client.get('/api/alerts/', HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        change()
+        response = self.client.get('/api/alerts/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+
+    def test_deleting_an_older_alert_changes_the_etag(self):
+        self.assertChanged(lambda: Alert.objects.order_by('pk').first().delete())
+        # without counting the alerts
+        with CaptureQueriesContext(connection) as context:
+            self.client.get('/api/alerts/', HTTP_IF_NONE_MATCH='"x"')
+        self.assertFalse([query for query in context if 'COUNT(' in query['sql']])
+
+    def test_bulk_resolution_changes_the_etag(self):
+        self.assertChanged(lambda: Alert.objects.filter(device=self.devices[0]).update(resolved_at=timezone.now()))
+
+    def test_no_etag_without_a_shared_cache(self):
+        with patch('monitoring.etags.cache_is_shared', return_value=False):
+            self.assertFalse(self.client.get('/api/alerts/').has_header('ETag'))
+            self.assertFalse(self.client.get('/api/dashboard/summary/').has_header('ETag'))
+
+    def test_acknowledging_changes_the_etag(self):
+        self.assertChanged(lambda: self.client.patch(f'/api/alerts/{Alert.objects.first().pk}/acknowledge/'))
+
+
+class DashboardSummaryTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        # one process, its local cache is all there is to share
+        shared = patch('monitoring.etags.cache_is_shared', return_value=True)
+        shared.start()
+        self.addCleanup(shared.stop)
+        self.client = APIClient()
+        now = timezone.now()
+
+        zone_a = ParkingZone.objects.create(name='Zone A', code='A', total_slots=10, daily_target=4)
+        zone_b = ParkingZone.objects.create(name='Zone B', code='B', total_slots=10, daily_target=10)
+        ParkingZone.objects.create(name='Zone C', code='C', total_slots=10, daily_target=0)
+
+        a1 = Device.objects.create(device_code='A-1', zone=zone_a, slot_number='1', last_seen=now)
+        a2 = Device.objects.create(device_code='A-2', zone=zone_a, slot_number='2')
+        b1 = Device.objects.create(device_code='B-1', zone=zone_b, slot_number='1', last_seen=now - timedelta(minutes=10))
+
+        ParkingLog.objects.create(device=a1, is_occupied=False, timestamp=now - timedelta(days=1))
+        ParkingLog.objects.create(device=a1, is_occupied=True, timestamp=now - timedelta(seconds=30))
+        ParkingLog.objects.create(device=a2, is_occupied=True, timestamp=now - timedelta(seconds=20))
+        ParkingLog.objects.create(device=a2, is_occupied=False, timestamp=now - timedelta(seconds=10))
+        ParkingLog.objects.create(device=b1, is_occupied=True, timestamp=now - timedelta(seconds=5))
+        rebuild_device_states()
+        rebuild_rollups()
+
+        Alert.objects.create(device=a1, alert_type='HIGH_POWER', severity='WARNING', message='')
+        Alert.objects.create(device=b1, alert_type='DEVICE_OFFLINE', severity='CRITICAL', message='')
+        old = Alert.objects.create(device=a2, alert_type='DEVICE_OFFLINE', severity='CRITICAL', message='')
+        Alert.objects.filter(pk=old.pk).update(created_at=now - timedelta(days=1))
+
+    def test_summary(self):
+        data = self.client.get('/api/dashboard/summary/').json()
+
+        self.assertEqual(data['summary'], {
+            'total_events': 4,
+            'current_occupancy': 2,
+            'active_devices': 1,
+            'alerts_today': 2,
+            'critical_alerts': 1,
+            'total_devices': 3,
+        })
+        zones = {zone['zone_code']: zone for zone in data['zones']}
+        self.assertEqual(zones['A']['events'], 3)
+        self.assertEqual(zones['A']['efficiency'], 75.0)
+        self.assertEqual(zones['B']['events'], 1)
+        self.assertEqual(zones['C']['events'], 0)
+        self.assertEqual(zones['C']['status'], 'critical')
+
+    def test_query_budget_does_not_grow_with_zones(self):
+        # 4 for the ETag, then zone events, alert counts and device counts
+        with self.assertNumQueries(7):
+            self.client.get('/api/dashboard/summary/')
+
+        for i in range(20):
+            zone = ParkingZone.objects.create(name=f'Extra {i}', code=f'X{i}', total_slots=5, daily_target=5)
+            device = Device.objects.create(device_code=f'X-{i}', zone=zone, slot_number='1')
+            ParkingLog.objects.create(device=device, is_occupied=True, timestamp=timezone.now())
+
+        with self.assertNumQueries(7):
+            response = self.client.get('/api/dashboard/summary/')
+        self.assertEqual(len(response.json()['zones']), 23)
+
+    def test_cached_until_a_write_touches_the_day(self):
+        self.client.get('/api/dashboard/summary/')
+        # 4 for the ETag and the live device counts
+        with self.assertNumQueries(5):
+            self.client.get('/api/dashboard/summary/')
+
+        with self.captureOnCommitCallbacks(execute=True):
+            ingest_parking_logs([{
+                'device_id': Device.objects.get(device_code='A-2').id,
+                'is_occupied': True,
+                'timestamp': timezone.now(),
+            }])
+        data = self.client.get('/api/dashboard/summary/').json()
+        self.assertEqual(data['summary']['total_events'], 5)
+
+    def test_concurrent_misses_compute_once(self):
+        summary_cache = SummaryCache(prefix='test:summary')
+        calls = []
+
+        def compute():
+            calls.append(1)
+            time.sleep(0.1)
+            return {'events': 1}
+
+        threads = [
+            threading.Thread(target=summary_cache.get, args=(timezone.localdate(), compute))
+            for _ in range(5)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(len(calls), 1)
+
+    def test_waiter_leaves_the_owners_lock(self):
+        summary_cache = SummaryCache(prefix='test:summary', lock_timeout=0.1, poll=0.02)
+        date = timezone.localdate()
+        # another process is computing and holds the lock
+        lock_key = f'{summary_cache._key(date)}:lock'
+        cache.add(lock_key, 1, timeout=60)
+        self.assertEqual(summary_cache.get(date, lambda: {'events': 1}), {'events': 1})
+        self.assertIsNotNone(cache.get(lock_key))
+
+    def test_past_days_expire_unless_the_cache_is_shared(self):
+        summary_cache = SummaryCache(prefix='test:summary', today_ttl=10, past_ttl=300)
+        yesterday = timezone.localdate() - timedelta(days=1)
+        with patch('monitoring.summary_cache.cache') as mock_cache:
+            mock_cache.get.return_value = None
+            mock_cache.get_many.return_value = {}
+            summary_cache.get(yesterday, lambda: {'events': 1})
+            summary_cache.get(timezone.localdate(), lambda: {'events': 1})
+            with patch('monitoring.summary_cache.cache_is_shared', return_value=True):
+                summary_cache.get(yesterday, lambda: {'events': 1})
+        self.assertEqual([c.kwargs['timeout'] for c in mock_cache.set.call_args_list], [300, 10, None])
+
+
+class DeviceStateTests(TestCase):
+    def setUp(self):
+        zone = ParkingZone.objects.create(name='Zone A', code='A', total_slots=10, daily_target=4)
+        self.device = Device.objects.create(device_code='A-1', zone=zone, slot_number='1')
+        self.now = timezone.now()
+
+    def test_parking_logs_update_state(self):
+        events = [
+            {'device_id': self.device.id, 'is_occupied': True, 'timestamp': self.now - timedelta(minutes=5)},
+            {'device_id': self.device.id, 'is_occupied': False, 'timestamp': self.now - timedelta(minutes=1)},
+        ]
+        ingest_parking_logs(events)
+        # a late event must not roll the state back
+        ingest_parking_logs([
+            {'device_id': self.device.id, 'is_occupied': True, 'timestamp': self.now - timedelta(minutes=3)},
+        ])
+
+        state = DeviceState.objects.get(device=self.device)
+        self.assertFalse(state.is_occupied)
+        self.assertEqual(state.occupancy_changed_at, self.now - timedelta(minutes=1))
+
+        rebuild_device_states()
+        self.assertEqual(DeviceState.objects.get(device=self.device).occupancy_changed_at, state.occupancy_changed_at)
+
+    def test_telemetry_updates_state(self):
+        readings = [
+            {
+                'device_id': self.device.id,
+                'zone_id': self.device.zone_id,
+                'voltage': Decimal(voltage),
+                'current': Decimal('2.00'),
+                'power_factor': Decimal('0.95'),
+                'timestamp': self.now - timedelta(minutes=minutes),
+            }
+            for minutes, voltage in ((1, '231.00'), (2, '219.00'))
+        ]
+        ingest_telemetry(readings[:1], heartbeat=False)
+        ingest_telemetry(readings[1:], heartbeat=False)
+
+        state = DeviceState.objects.get(device=self.device)
+        self.assertEqual(state.voltage, Decimal('231.00'))
+        self.assertEqual(state.telemetry_at, readings[0]['timestamp'])
+        self.assertIsNone(state.is_occupied)
+
+
+class RollupTests(TestCase):
+    def setUp(self):
+        zone = ParkingZone.objects.create(name='Zone A', code='A', total_slots=10, daily_target=4)
+        self.devices = [
+            Device.objects.create(device_code=f'A-{i}', zone=zone, slot_number=str(i)) for i in range(2)
+        ]
+        self.hour = hour_of(timezone.now()) - timedelta(hours=3)
+
+    def stats(self):
+        return (
+            list(ZoneHourlyStats.objects.order_by('hour').values_list('hour', 'events', 'occupied_events', 'devices', 'occupied_seconds')),
+            list(ZoneDailyStats.objects.order_by('date').values_list('date', 'events', 'occupied_events', 'devices', 'occupied_seconds')),
+        )
+
+    def test_incremental_rollups_match_rebuild(self):
+        a, b = self.devices
+        ingest_parking_logs([
+            {'device_id': a.id, 'is_occupied': True, 'timestamp': self.hour + timedelta(minutes=5)},
+            {'device_id': a.id, 'is_occupied': False, 'timestamp': self.hour + timedelta(minutes=20)},
+        ])
+        ingest_parking_logs([
+            {'device_id': a.id, 'is_occupied': True, 'timestamp': self.hour + timedelta(minutes=40)},
+            {'device_id': b.id, 'is_occupied': True, 'timestamp': self.hour + timedelta(minutes=50)},
+            {'device_id': b.id, 'is_occupied': False, 'timestamp': self.hour + timedelta(minutes=70)},
+        ])
+
+        hourly, daily = self.stats()
+        self.assertEqual(hourly, [(self.hour, 4, 3, 2, 1500.0), (self.hour + timedelta(hours=1), 1, 0, 1, 600.0)])
+        self.assertEqual(sum(row[1] for row in daily), 5)
+
+        rebuild_rollups(timezone.localdate(self.hour), timezone.localdate(self.hour + timedelta(hours=2)))
+        self.assertEqual(self.stats(), (hourly, daily))
+        rebuild_rollups()
+        self.assertEqual(self.stats(), (hourly, daily))
+
+
+class ZoneEnergyTests(TestCase):
+    def setUp(self):
+        zone = ParkingZone.objects.create(name='Zone A', code='A', total_slots=2, daily_target=4, offline_timeout=300)
+        self.device = Device.objects.create(device_code='A-1', zone=zone, slot_number='1')
+        self.start = timezone.now().replace(microsecond=0) - timedelta(hours=1)
+
+    def reading(self, seconds):
+        return {
+            'device_id': self.device.id,
+            'zone_id': self.device.zone_id,
+            'voltage': Decimal('230.00'),
+            'current': Decimal('2.00'),
+            'power_factor': Decimal('0.50'),
+            'timestamp': self.start + timedelta(seconds=seconds),
+        }
+
+    def energy(self):
+        return list(ZoneEnergyDaily.objects.order_by('date').values_list(
+            'date', 'energy_wh', 'power_sum', 'readings', 'peak_w'
+        ))
+
+    def test_incremental_energy_matches_rebuild(self):
+        ingest_telemetry([self.reading(60 * i) for i in range(3)], heartbeat=False)
+        # the 30 minute gap only counts up to the zone's offline timeout
+        ingest_telemetry([self.reading(120 + 60), self.reading(1980)], heartbeat=False)
+
+        self.assertEqual(TelemetryData.objects.first().power, 230.0)
+        rows = self.energy()
+        self.assertAlmostEqual(sum(row[1] for row in rows), 230 * (180 + 300) / 3600)
+        self.assertEqual(sum(row[3] for row in rows), 5)
+
+        rebuild_energy_rollups()
+        for rebuilt, incremental in zip(self.energy(), rows):
+            self.assertEqual(rebuilt[0], incremental[0])
+            self.assertAlmostEqual(rebuilt[1], incremental[1])
+            self.assertEqual(rebuilt[3:], incremental[3:])
+
+        response = APIClient().get('/api/analytics/energy/', {'zone': 'A'})
+        data = response.json()['zones'][0]
+        self.assertAlmostEqual(data['energy_kwh'], 0.031, places=3)
+        self.assertEqual(data['days'][-1]['peak_w'], 230.0)
+        self.assertEqual(data['days'][-1]['mean_w'], 230.0)
+
+
+class OccupancyTrendTests(TestCase):
+    def setUp(self):
+        zone = ParkingZone.objects.create(name='Zone A', code='A', total_slots=2, daily_target=4)
+        self.device = Device.objects.create(device_code='A-1', zone=zone, slot_number='1')
+        self.client = APIClient()
+
+    def test_hourly_occupancy(self):
+        today = timezone.localdate()
+        day_start = timezone.make_aware(datetime.combine(today - timedelta(days=1), datetime.min.time()))
+        # occupied 30 minutes in hour 1 and the whole of hour 2
+        ingest_parking_logs([
+            {'device_id': self.device.id, 'is_occupied': True, 'timestamp': day_start + timedelta(minutes=90)},
+            {'device_id': self.device.id, 'is_occupied': False, 'timestamp': day_start + timedelta(minutes=180)},
+        ])
+
+        response = self.client.get('/api/analytics/occupancy/', {
+            'start': (today - timedelta(days=1)).isoformat(),
+            'end': today.isoformat(),
+            'zone': 'A',
+        })
+        data = response.json()
+        self.assertEqual((data['bucket'], data['bucket_size']), ('hour', 1))
+        series = data['zones'][0]['series']
+        self.assertEqual(len(series), 48)
+        self.assertEqual([point['events'] for point in series[:3]], [0, 1, 0])
+        self.assertEqual([point['occupancy'] for point in series[:4]], [0, 25.0, 50.0, 0])
+
+    def test_long_ranges_get_wider_buckets(self):
+        response = self.client.get('/api/analytics/occupancy/', {
+            'start': '2026-01-01', 'end': '2026-03-31', 'bucket': 'hour',
+        })
+        data = response.json()
+        self.assertEqual((data['bucket'], data['bucket_size']), ('hour', 6))
+        self.assertLessEqual(len(data['zones'][0]['series']), 500)
+
+
+class TelemetrySeriesTests(TestCase):
+    def setUp(self):
+        zone = ParkingZone.objects.create(name='Zone A', code='A', total_slots=2, daily_target=4)
+        self.device = Device.objects.create(device_code='A-1', zone=zone, slot_number='1')
+        self.start = timezone.now().replace(microsecond=0) - timedelta(hours=1)
+        TelemetryData.objects.bulk_create([
+            TelemetryData(
+                device=self.device,
+                voltage=Decimal('300.00') if i == 7 else Decimal('220.00'),
+                current=Decimal('5.00'),
+                power_factor=Decimal('0.90'),
+                timestamp=self.start + timedelta(seconds=10 * i),
+            )
+            for i in range(360)
+        ])
+        self.client = APIClient()
+
+    def test_downsampled_to_points(self):
+        response = self.client.get('/api/devices/A-1/telemetry/', {
+            'start': self.start.isoformat(),
+            'end': (self.start + timedelta(hours=1)).isoformat(),
+            'points': 10,
+        })
+        data = response.json()
+        self.assertEqual(data['raw_count'], 360)
+        self.assertEqual(len(data['timestamps']), 10)
+        # the spike survives as the max of its bucket
+        self.assertEqual(data['voltage']['max'][0], 300.0)
+        self.assertEqual(data['voltage']['min'][0], 220.0)
+        self.assertAlmostEqual(data['power']['mean'][1], 990.0)
+
+    def test_unknown_device(self):
+        self.assertEqual(self.client.get('/api/devices/nope/telemetry/').status_code, 404)
+
+
+class TelemetryCompactionTests(TestCase):
+    def setUp(self):
+        zone = ParkingZone.objects.create(name='Zone A', code='A', total_slots=2, daily_target=4)
+        self.device = Device.objects.create(device_code='A-1', zone=zone, slot_number='1')
+        self.start = timezone.now().replace(microsecond=0) - timedelta(days=10)
+        TelemetryData.objects.bulk_create([
+            TelemetryData(
+                device=self.device,
+                voltage=Decimal('220.00') + i % 7,
+                current=Decimal('5.25'),
+                power_factor=Decimal('0.91'),
+                # one reading off the 10 second grid
+                timestamp=self.start + timedelta(seconds=10 * i + (3 if i == 50 else 0)),
+            )
+            for i in range(500)
+        ] + [
+            TelemetryData(
+                device=self.device, voltage=Decimal('230.00'), current=Decimal('1.00'),
+                power_factor=Decimal('0.99'), timestamp=timezone.now() - timedelta(hours=1),
+            )
+        ])
+
+    def test_encoding_round_trip(self):
+        timestamps = np.array([0, 10_000_000, 20_000_000, 30_000_123, 40_000_000], dtype=np.int64)
+        values = np.array([[22000, 525, 91], [22010, 525, 91], [21990, 530, 90], [60000, 0, 100], [0, 525, 91]])
+        decoded_timestamps, decoded_values = decode_chunk(encode_chunk(timestamps, values))
+        np.testing.assert_array_equal(decoded_timestamps, timestamps)
+        np.testing.assert_array_equal(decoded_values, values)
+
+    def test_compacted_days_read_back(self):
+        end = timezone.now()
+        before = load_telemetry(self.device.id, self.start, end)
+
+        chunks, readings = compact_telemetry(timezone.localdate() - timedelta(days=7))
+        self.assertEqual(readings, 500)
+        self.assertEqual(TelemetryData.objects.count(), 1)
+        self.assertEqual(TelemetryChunk.objects.aggregate(total=Sum('readings'))['total'], 500)
+        self.assertEqual(chunks, TelemetryChunk.objects.count())
+
+        after = load_telemetry(self.device.id, self.start, end)
+        np.testing.assert_array_equal(after[0], before[0])
+        np.testing.assert_allclose(after[1], before[1])
+        # ranges starting inside a chunk
+        middle = self.start + timedelta(seconds=995)
+        self.assertEqual(len(load_telemetry(self.device.id, middle, end)[0]), 401)
+
+        # readings restored into a compacted day are merged into its chunk
+        TelemetryData.objects.create(
+            device=self.device, voltage=Decimal('225.00'), current=Decimal('5.25'),
+            power_factor=Decimal('0.91'), timestamp=self.start + timedelta(seconds=5),
+        )
+        compact_telemetry(timezone.localdate() - timedelta(days=7))
+        self.assertEqual(len(load_telemetry(self.device.id, self.start, end)[0]), 502)
+
+
+class DeviceHealthTests(TestCase):
+    def setUp(self):
+        zone = ParkingZone.objects.create(name='Zone A', code='A', total_slots=2, daily_target=4)
+        self.device = Device.objects.create(device_code='A-1', zone=zone, slot_number='1')
+        self.idle = Device.objects.create(device_code='A-2', zone=zone, slot_number='2')
+        self.now = timezone.now()
+
+    def reading(self, seconds_ago, voltage='220.00'):
+        return {
+            'device_id': self.device.id,
+            'zone_id': self.device.zone_id,
+            'voltage': Decimal(voltage),
+            'current': Decimal('5.00'),
+            'power_factor': Decimal('0.95'),
+            'timestamp': self.now - timedelta(seconds=seconds_ago),
+        }
+
+    def test_scores_and_rescoring_only_changed_devices(self):
+        # the last hour of a two hour window, one reading over the voltage rule
+        ingest_telemetry(
+            [self.reading(10 * i, '250.00' if i == 5 else '220.00') for i in range(1, 361)],
+            heartbeat=False,
+        )
+        self.assertEqual(score_devices(window=timedelta(hours=2)), 2)
+
+        health = DeviceHealth.objects.get(device=self.device)
+        self.assertAlmostEqual(health.uptime_ratio, 0.5, places=2)
+        self.assertEqual(health.readings, 360)
+        self.assertEqual(health.warning_alerts, 1)
+        self.assertAlmostEqual(health.anomaly_rate, 1 / 360, places=4)
+        self.assertEqual(DeviceHealth.objects.get(device=self.idle).score, 25)
+
+        self.assertEqual(list(devices_to_score()), [])
+        # new readings wait for the hourly refresh, a new alert does not
+        ingest_telemetry([self.reading(-5)], heartbeat=False)
+        self.assertEqual(list(devices_to_score()), [])
+        self.assertCountEqual(devices_to_score(self.now + timedelta(hours=2)), [self.device.id, self.idle.id])
+        Alert.objects.create(
+            device=self.idle, alert_type='DEVICE_OFFLINE', severity='WARNING',
+            message='Device A-2 is offline',
+        )
+        self.assertEqual(list(devices_to_score()), [self.idle.id])
+
+        response = APIClient().get('/api/devices/health/')
+        self.assertEqual([row['device_code'] for row in response.json()], ['A-2', 'A-1'])
+
+
+@skipUnless(retention.pa, 'archiving needs pyarrow')
+@override_settings(ARCHIVE_DELETE_PAUSE=0)
+class RetentionTests(TestCase):
+    def setUp(self):
+        zone = ParkingZone.objects.create(name='Zone A', code='A', total_slots=2, daily_target=4)
+        self.device = Device.objects.create(device_code='A-1', zone=zone, slot_number='1')
+        self.old = timezone.now() - timedelta(days=40)
+        self.root = tempfile.TemporaryDirectory()
+        self.addCleanup(self.root.cleanup)
+
+        ingest_telemetry([
+            {
+                'device_id': self.device.id,
+                'zone_id': zone.id,
+                'voltage': Decimal('229.99'),
+                'current': Decimal('1.10'),
+                'power_factor': Decimal('0.93'),
+                'timestamp': moment,
+            }
+            for moment in (self.old, self.old + timedelta(minutes=1), timezone.now() - timedelta(hours=1))
+        ], heartbeat=False)
+        ingest_parking_logs([
+            {'device_id': self.device.id, 'is_occupied': True, 'timestamp': self.old},
+            {'device_id': self.device.id, 'is_occupied': False, 'timestamp': self.old + timedelta(minutes=30)},
+        ])
+        for acknowledged in (True, False):
+            alert = Alert.objects.create(
+                device=self.device, severity='INFO', alert_type=f'TEST_{acknowledged}',
+                message='test', is_acknowledged=acknowledged,
+            )
+            Alert.objects.filter(pk=alert.pk).update(created_at=self.old)
+        # resolved but never acknowledged
+        alert = Alert.objects.create(
+            device=self.device, severity='INFO', alert_type='CONNECTION_RESTORED',
+            message='test', resolved_at=self.old,
+        )
+        Alert.objects.filter(pk=alert.pk).update(created_at=self.old)
+
+    def test_archive_purge_and_restore(self):
+        result = retention.archive(
+            retention={'telemetry': 30, 'parking_logs': 30, 'alerts': 30}, root=self.root.name
+        )
+        self.assertEqual(result, {'telemetry': (1, 2), 'telemetry_chunks': (0, 0), 'parking_logs': (1, 2), 'alerts': (1, 2)})
+        self.assertEqual(TelemetryData.objects.count(), 1)
+        self.assertFalse(ParkingLog.objects.exists())
+        # open alerts stay, they drive deduplication
+        self.assertEqual(list(Alert.objects.values_list('is_acknowledged', flat=True)), [False])
+
+        manifest = retention.load_manifest(self.root.name)
+        self.assertEqual(
+            sorted((entry['table'], entry['rows']) for entry in manifest['files']),
+            [('alerts', 2), ('parking_logs', 2), ('telemetry', 2)],
+        )
+        archived = retention.read_archive('telemetry', root=self.root.name)
+        self.assertEqual(archived.column('voltage').to_pylist(), [229.99, 229.99])
+
+        # the rollups of archived days survive a rebuild
+        rebuild_rollups()
+        rebuild_energy_rollups()
+        self.assertEqual(ZoneDailyStats.objects.get().events, 2)
+        self.assertEqual(ZoneEnergyDaily.objects.filter(date=timezone.localdate(self.old)).count(), 1)
+
+        self.assertEqual(retention.restore_archive('telemetry', root=self.root.name), 2)
+        restored = TelemetryData.objects.order_by('timestamp').first()
+        self.assertEqual(restored.timestamp, self.old)
+        self.assertEqual((restored.voltage, restored.current, restored.power_factor), (Decimal('229.99'), Decimal('1.10'), Decimal('0.93')))
+        self.assertEqual(retention.restore_archive('alerts', root=self.root.name), 2)
+        self.assertEqual(Alert.objects.count(), 3)
+
+    def test_restore_skips_readings_sent_again(self):
+        retention.archive(retention={'telemetry': 30}, root=self.root.name)
+        # the device resends an archived reading, it gets a new id
+        ingest_telemetry([{
+            'device_id': self.device.id,
+            'zone_id': self.device.zone_id,
+            'voltage': Decimal('231.00'),
+            'current': Decimal('1.10'),
+            'power_factor': Decimal('0.93'),
+            'timestamp': self.old,
+        }], heartbeat=False)
+
+        # read and inserted a batch at a time
+        with patch.object(retention, 'ROW_GROUP_SIZE', 1), patch.object(retention, '_insert', wraps=retention._insert) as insert:
+            self.assertEqual(retention.restore_archive('telemetry', root=self.root.name), 2)
+        self.assertEqual(insert.call_count, 2)
+        self.assertEqual(TelemetryData.objects.count(), 3)
+        self.assertEqual(TelemetryData.objects.get(timestamp=self.old).voltage, Decimal('231.00'))
+
+
+class WriteQueueTests(TransactionTestCase):
+    def setUp(self):
+        zone = ParkingZone.objects.create(name='Zone A', code='A', total_slots=2, daily_target=4)
+        self.device = Device.objects.create(device_code='A-1', zone=zone, slot_number='1')
+        self.writer = WriteQueue(max_batch=50)
+        self.addCleanup(self.writer.stop)
+
+    def test_batched_writes_fail_alone(self):
+        now = timezone.now().replace(microsecond=0)
+        readings = [
+            {
+                'device_code': 'A-1',
+                'device_id': self.device.id,
+                'zone_id': self.device.zone_id,
+                'voltage': Decimal('220.00'),
+                'current': Decimal('5.00'),
+                'power_factor': Decimal('0.95'),
+                'timestamp': now - timedelta(seconds=i),
+            }
+            # the last one repeats the first
+            for i in list(range(20)) + [0]
+        ]
+        futures = [self.writer.submit(TelemetrySerializer.write_many, reading) for reading in readings]
+        futures.append(self.writer.submit(ParkingLogSerializer.write_many, {
+            'device_id': self.device.id, 'is_occupied': True, 'timestamp': now,
+        }))
+
+        for future in futures[:20]:
+            self.assertIsInstance(future.result(timeout=10), TelemetryData)
+        with self.assertRaises(IntegrityError):
+            futures[20].result(timeout=10)
+        self.assertIsInstance(futures[21].result(timeout=10), ParkingLog)
+
+        self.assertEqual(TelemetryData.objects.count(), 20)
+        self.assertEqual(DeviceState.objects.get().telemetry_at, now)
+        self.assertTrue(DeviceState.objects.get().is_occupied)
+        stats = self.writer.stats()
+        self.assertEqual((stats['writes'], stats['failed']), (22, 1))
+
+    def test_stalled_writer_times_out(self):
+        release = threading.Event()
+        self.addCleanup(release.set)
+
+        def stall(items):
+            release.wait(10)
+            return items
+
+        self.writer.timeout = 0.1
+        stalled = self.writer.submit(stall, 1)
+        # queued behind the stalled write, dropped when it times out
+        with self.assertRaises(WriterTimeout):
+            self.writer.run(stall, 2)
+
+        release.set()
+        # the writer's transaction ends before the request reads the database
+        self.assertEqual(stalled.result(10), 1)
+
+        with override_settings(INGEST_MODE='writer'), patch.object(heartbeats, 'flush_interval', 0), \
+                patch.object(offline_detector, 'enabled', False), \
+                patch('monitoring.serializers.db_writer.run', side_effect=WriterTimeout('late')):
+            response = APIClient().post('/api/telemetry/', {
+                'device_code': 'A-1', 'voltage': '220.00', 'current': '5.00', 'power_factor': '0.95',
+                'timestamp': timezone.now().isoformat(),
+            }, format='json')
+        self.assertEqual(response.status_code, 503)
+
+
+class BenchmarkIngestTests(TransactionTestCase):
+    def test_leaves_real_data_alone(self):
+        zone = ParkingZone.objects.create(name='Zone A', code='A', total_slots=2, daily_target=4)
+        device = Device.objects.create(device_code='A-1', zone=zone, slot_number='1')
+        ingest_telemetry([{
+            'device_id': device.id,
+            'zone_id': zone.id,
+            'voltage': Decimal('220.00'),
+            'current': Decimal('5.00'),
+            'power_factor': Decimal('0.90'),
+            'timestamp': timezone.now() - timedelta(seconds=5),
+        }], heartbeat=False)
+        before = (TelemetryData.objects.count(), DeviceState.objects.count(), ZoneEnergyDaily.objects.count())
+
+        with patch.object(heartbeats, 'flush_interval', 0), patch.object(offline_detector, 'enabled', False):
+            out = StringIO()
+            call_command('benchmark_ingest', requests=20, concurrency=2, mode='asgi', devices=3, stdout=out)
+        self.assertIn('20 ok', out.getvalue())
+
+        self.assertEqual((TelemetryData.objects.count(), DeviceState.objects.count(), ZoneEnergyDaily.objects.count()), before)
+        self.assertEqual(list(Device.objects.values_list('device_code', flat=True)), ['A-1'])
+        self.assertFalse(ParkingZone.objects.filter(code='BENCH').exists())
+
+    def test_refuses_a_real_bench_zone(self):
+        zone = ParkingZone.objects.create(name='Bench row', code='BENCH', total_slots=2, daily_target=4)
+        Device.objects.create(device_code='BENCH-0', zone=zone, slot_number='0')
+        with self.assertRaises(CommandError):
+            call_command('benchmark_ingest', requests=1, mode='asgi', devices=1, stdout=StringIO())
+        self.assertTrue(Device.objects.filter(device_code='BENCH-0').exists())
@@ -0,0 +1,96 @@
+from datetime import datetime, timezone as dt_timezone
+import numpy as np
+from django.db.models import FloatField
+from django.db.models.functions import Cast
+from .compaction import load_cold
+from .models import TelemetryData
+
+SERIES = ['voltage', 'current', 'power_factor', 'power']
+
+
+def load_telemetry(device_id, start, end, chunk_size=10000):
+    """Readings of a device in [start, end), oldest first, as an array of
+    epoch seconds and a (n, len(SERIES)) array of values.
+
+    Rows are streamed through the (device, -timestamp) index and cast to
+    float by the database, so no model instance or Decimal is built; power
+    is the stored generated column. Days compacted into TelemetryChunk are
+    decoded and merged in.
+    """
+    rows = TelemetryData.objects.filter(
+        device_id=device_id,
+        timestamp__gte=start,
+        timestamp__lt=end,
+    ).order_by('timestamp').values_list(
+        'timestamp',
+        Cast('voltage', FloatField()),
+        Cast('current', FloatField()),
+        Cast('power_factor', FloatField()),
+        'power',
+    ).iterator(chunk_size=chunk_size)
+
+    flat = np.fromiter(
+        (value for row in rows for value in (row[0].timestamp(), row[1], row[2], row[3], row[4])),
+        dtype=np.float64,
+    ).reshape(-1, 5)
+    timestamps, values = flat[:, 0], flat[:, 1:]
+
+    cold_timestamps, cold_values = load_cold(device_id, start, end)
+    if len(cold_timestamps):
+        cold_values = np.column_stack([cold_values, np.prod(cold_values, axis=1)])
+        timestamps = np.r_[cold_timestamps, timestamps]
+        values = np.r_[cold_values, values]
+        order = np.argsort(timestamps, kind='stable')
+        timestamps, values = timestamps[order], values[order]
+    return timestamps, values
+
+
+def downsample(timestamps, values, start, end, points):
+    """Min, max and mean of each column over `points` equal time buckets
+    between start and end (epoch seconds), empty buckets left out.
+
+    Returns the bucket start times and three (buckets, columns) arrays.
+    Spikes survive as the min and max of their bucket, which averaging or
+    picking every nth reading would hide.
+    """
+    width = (end - start) / points
+    bucket = np.minimum(((timestamps - start) // width).astype(np.int64), points - 1)
+    # readings are sorted, so each bucket is a contiguous run
+    first = np.flatnonzero(np.r_[True, bucket[1:] != bucket[:-1]])
+    counts = np.diff(np.r_[first, len(bucket)])[:, None]
+
+    return (
+        start + bucket[first] * width,
+        np.minimum.reduceat(values, first, axis=0),
+        np.maximum.reduceat(values, first, axis=0),
+        np.add.reduceat(values, first, axis=0) / counts,
+    )
+
+
+def telemetry_series(device_id, start, end, points):
+    """Chart data for a device: every reading when there are at most
+    `points`, otherwise min/max/mean per bucket. The Python work depends on
+    `points`, the rows are only touched by NumPy.
+    """
+    timestamps, values = load_telemetry(device_id, start, end)
+    raw_count = len(timestamps)
+    if raw_count > points:
+        bucket_seconds = (end - start).total_seconds() / points
+        timestamps, low, high, mean = downsample(timestamps, values, start.timestamp(), end.timestamp(), points)
+    else:
+        bucket_seconds = None
+        low = high = mean = values
+
+    series = {}
+    for column, name in enumerate(SERIES):
+        series[name] = {
+            'min': np.round(low[:, column], 3).tolist(),
+            'max': np.round(high[:, column], 3).tolist(),
+            'mean': np.round(mean[:, column], 3).tolist(),
+        }
+    return {
+        'raw_count': raw_count,
+        'bucket_seconds': bucket_seconds,
+        'timestamps': [datetime.fromtimestamp(moment, dt_timezone.utc) for moment in timestamps.tolist()],
+        **series,
+    }
@@ -1,11 +1,22 @@
 from django.urls import path
-from . import views
+from . import views, async_views
 
 urlpatterns = [
     path('telemetry/', views.telemetry_submit, name='telemetry-submit'),
     path('telemetry/bulk/', views.telemetry_bulk_submit, name='telemetry-bulk'),
+    path('telemetry/stream/', views.telemetry_stream_submit, name='telemetry-stream'),
+    path('telemetry/async/', async_views.telemetry_submit, name='telemetry-submit-async'),
+    path('telemetry/bulk/async/', async_views.telemetry_bulk_submit, name='telemetry-bulk-async'),
     path('dashboard/summary/', views.dashboard_summary, name='dashboard-summary'),
+    path('analytics/occupancy/', views.occupancy_trend, name='analytics-occupancy'),
+    path('analytics/energy/', views.zone_energy, name='analytics-energy'),
+    path('devices/health/', views.devices_health, name='devices-health'),
+    path('devices/<str:device_code>/telemetry/', views.device_telemetry, name='device-telemetry'),
     path('parking-log/', views.parking_log_submit, name='parking-log-submit'),
+    path('parking-log/bulk/', views.parking_log_bulk_submit, name='parking-log-bulk'),
+    path('parking-log/async/', async_views.parking_log_submit, name='parking-log-submit-async'),
     path('alerts/', views.alerts_list, name='alerts-list'),
+    path('alerts/stream/', async_views.alerts_stream, name='alerts-stream'),
     path('alerts/<int:pk>/acknowledge/', views.alert_acknowledge, name='alert-acknowledge'),
+    path('metrics/', views.metrics, name='metrics'),
 ]
@@ -0,0 +1,57 @@
+import time
+from django.conf import settings
+from django.core.cache import cache
+
+# backends whose entries never leave the process
+LOCAL_CACHES = {
+    'django.core.cache.backends.locmem.LocMemCache',
+    'django.core.cache.backends.dummy.DummyCache',
+}
+
+
+def cache_is_shared():
+    """True when the default cache reaches every worker process, which
+    SharedVersion needs to tell them anything
+    """
+    return settings.CACHES['default']['BACKEND'] not in LOCAL_CACHES
+
+
+class SharedVersion:
+    """Version counter kept in the Django cache.
+
+    In-process caches bump it when they invalidate so that other worker
+    processes sharing the same cache backend notice and drop their copies.
+    Reads are throttled to one cache round trip per `check_interval`.
+    """
+
+    def __init__(self, key, check_interval=1.0):
+        self.key = key
+        self.check_interval = check_interval
+        self._seen = None
+        self._checked_at = 0.0
+
+    def bump(self):
+        try:
+            version = cache.incr(self.key)
+        except ValueError:
+            # key missing or evicted
+            cache.add(self.key, 1, timeout=None)
+            version = cache.get(self.key)
+        self._seen = version
+        self._checked_at = time.monotonic()
+
+    def current(self):
+        return cache.get(self.key)
+
+    def changed(self):
+        """True when another process bumped the counter since the last check"""
+        now = time.monotonic()
+        if now - self._checked_at < self.check_interval:
+            return False
+        self._checked_at = now
+
+        version = cache.get(self.key)
+        if version == self._seen:
+            return False
+        self._seen = version
+        return True
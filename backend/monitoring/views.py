@@ -1,9 +1,20 @@
 from rest_framework import status
-from rest_framework.decorators import api_view
+from rest_framework.decorators import api_view, parser_classes
+from rest_framework.exceptions import ParseError
 from rest_framework.response import Response
+from django.conf import settings
 from django.db import IntegrityError
-from .serializers import TelemetrySerializer, BulkTelemetrySerializer, DashboardSummarySerializer, AlertSerializer, ParkingLogSerializer
-from .models import Alert
+from django.views.decorators.http import condition
+from .serializers import TelemetrySerializer, BulkTelemetrySerializer, DashboardSummarySerializer, AlertSerializer, ParkingLogSerializer, BulkParkingLogSerializer, OccupancyTrendSerializer, ZoneEnergySerializer, TelemetrySeriesSerializer, DeviceHealthSerializer, device_codes
+from .models import Alert, Device, DeviceHealth
+from .ingestion import ingest_telemetry
+from .pagination import AlertCursorPagination
+from .etags import dashboard_summary_etag, alerts_list_etag
+from .parsers import NDJSONParser
+from .registry import device_registry
+from .heartbeat import heartbeats
+from .spool import spool, spool_enabled, encode
+from .writer import WriterTimeout, db_writer, writer_enabled
 from django.utils import timezone
 
 # view for telemetry data submit
@@ -13,6 +24,12 @@ def telemetry_submit(request):
 
     try:
         if serializer.is_valid(raise_exception=True):
+            if spool_enabled():
+                serializer.spool()
+                return Response(
+                    {'message': 'Telemetry data accepted'},
+                    status=status.HTTP_202_ACCEPTED
+                )
             serializer.save()
             return Response(
                 {'message': 'Telemetry data received'},
@@ -25,6 +42,13 @@ def telemetry_submit(request):
             },
             status=status.HTTP_400_BAD_REQUEST
         )
+    except WriterTimeout as e:
+        return Response(
+            {
+                'error': str(e)
+            },
+            status=status.HTTP_503_SERVICE_UNAVAILABLE
+        )
     except Exception as e:
         return Response(
             {
@@ -39,13 +63,91 @@ def telemetry_bulk_submit(request):
     serializer = BulkTelemetrySerializer(data=request.data)
 
     if serializer.is_valid(raise_exception=True):
+        if spool_enabled():
+            return Response(
+                serializer.spool(),
+                status=status.HTTP_202_ACCEPTED
+            )
         result = serializer.save()
         return Response(
             result,
             status=status.HTTP_201_CREATED
         )
+
+# view for streamed telemetry: one reading per line (NDJSON), optionally
+# gzip or zstd compressed, validated and written in fixed-size chunks
+@api_view(['POST'])
+@parser_classes([NDJSONParser])
+def telemetry_stream_submit(request):
+    summary = {
+        'received': 0,
+        'created': 0,
+        'duplicates': 0,
+        'invalid': 0,
+        'chunks': 0,
+        'errors': [],
+    }
+    chunk = []
+
+    try:
+        for line_number, item in request.data:
+            summary['received'] += 1
+            chunk.append((line_number, item))
+            if len(chunk) >= settings.TELEMETRY_STREAM_CHUNK_SIZE:
+                _ingest_telemetry_chunk(chunk, summary)
+                chunk = []
+        _ingest_telemetry_chunk(chunk, summary)
+    except ParseError as e:
+        # chunks before the broken line are already stored
+        summary['error'] = str(e.detail)
+        return Response(summary, status=status.HTTP_400_BAD_REQUEST)
+
+    return Response(
+        summary,
+        status=status.HTTP_202_ACCEPTED if spool_enabled() else status.HTTP_201_CREATED
+    )
+
+def _ingest_telemetry_chunk(chunk, summary):
+    if not chunk:
+        return
+
+    devices = device_registry.get_many(device_codes(item for _, item in chunk))
+
+    readings = []
+    for line_number, item in chunk:
+        if isinstance(item, ParseError):
+            error = str(item.detail)
+        elif not isinstance(item, dict):
+            error = 'Expected a JSON object.'
+        else:
+            serializer = TelemetrySerializer(data=item, context={'devices': devices})
+            if serializer.is_valid():
+                reading = dict(serializer.validated_data)
+                device = devices[reading['device_code']]
+                reading['device_id'] = device.id
+                reading['zone_id'] = device.zone_id
+                reading['offline_timeout'] = device.offline_timeout
+                readings.append(reading)
+                continue
+            error = serializer.errors
+
+        summary['invalid'] += 1
+        # keep the response small whatever the size of the stream
+        if len(summary['errors']) < settings.TELEMETRY_STREAM_MAX_ERRORS:
+            summary['errors'].append({'line': line_number, 'error': error})
+
+    if spool_enabled():
+        heartbeats.record({reading['device_id'] for reading in readings})
+        spool.append_many('telemetry', [encode(reading) for reading in readings])
+        summary['created'] += len(readings)
+    else:
+        created, duplicates = ingest_telemetry(readings)
+        summary['created'] += len(created)
+        summary['duplicates'] += len(duplicates)
+    summary['chunks'] += 1
     
 @api_view(['GET'])
+@condition(etag_func=dashboard_summary_etag)
 def dashboard_summary(request):
     date_str = request.query_params.get('date')
 
@@ -66,7 +168,53 @@ def dashboard_summary(request):
 
     return Response(serializer.data)
 
+# bucketed parking events and occupancy per zone for a date range
+@api_view(['GET'])
+def occupancy_trend(request):
+    serializer = OccupancyTrendSerializer(data=request.query_params)
+    serializer.is_valid(raise_exception=True)
+
+    return Response(serializer.data)
+
+# energy, peak and mean power per zone and day
+@api_view(['GET'])
+def zone_energy(request):
+    serializer = ZoneEnergySerializer(data=request.query_params)
+    serializer.is_valid(raise_exception=True)
+
+    return Response(serializer.data)
+
+# stored health scores, worst first, computed by `manage.py score_devices`
+@api_view(['GET'])
+def devices_health(request):
+    queryset = DeviceHealth.objects.select_related('device', 'device__zone').order_by('score', 'device_id')
+
+    zone = request.query_params.get('zone')
+    if zone:
+        queryset = queryset.filter(device__zone__code=zone)
+
+    serializer = DeviceHealthSerializer(queryset, many=True)
+    return Response(serializer.data)
+
+# downsampled voltage, current, power factor and power of one device
 @api_view(['GET'])
+def device_telemetry(request, device_code):
+    try:
+        device = Device.objects.get(device_code=device_code)
+    except Device.DoesNotExist:
+        return Response(
+            {
+                'error': 'Device not found'
+            },
+            status=status.HTTP_404_NOT_FOUND
+        )
+    serializer = TelemetrySeriesSerializer(data=request.query_params, context={'device': device})
+    serializer.is_valid(raise_exception=True)
+
+    return Response(serializer.data)
+
+@api_view(['GET'])
+@condition(etag_func=alerts_list_etag)
 def alerts_list(request):
     queryset = Alert.objects.select_related('device', 'device__zone')
 
@@ -80,8 +228,10 @@ def alerts_list(request):
     if is_acknowledged is not None:
         queryset = queryset.filter(is_acknowledged=is_acknowledged.lower() == 'true')
 
-    serializer = AlertSerializer(queryset, many=True)
-    return Response(serializer.data)
+    paginator = AlertCursorPagination()
+    page = paginator.paginate_queryset(queryset, request)
+    serializer = AlertSerializer(page, many=True)
+    return paginator.get_paginated_response(serializer.data)
 
 @api_view(['PATCH'])
 def alert_acknowledge(request, pk):
@@ -107,6 +257,14 @@ def parking_log_submit(request):
 
     try:
         if serializer.is_valid(raise_exception=True):
+            if spool_enabled():
+                serializer.spool()
+                return Response(
+                    {
+                        'message': 'Parking log accepted'
+                    },
+                    status=status.HTTP_202_ACCEPTED
+                )
             serializer.save()
             return Response(
                 {
@@ -114,10 +272,46 @@ def parking_log_submit(request):
                 },
                 status=status.HTTP_201_CREATED
             )
+    except WriterTimeout as e:
+        return Response(
+            {
+                'error': str(e)
+            },
+            status=status.HTTP_503_SERVICE_UNAVAILABLE
+        )
     except Exception as e:
         return Response(
             {
                 'error': str(e)
             },
             status=status.HTTP_400_BAD_REQUEST
-        )
\ No newline at end of file
+        )
+
+# view for bulk parking log submit, used by gateways replaying buffered events
+@api_view(['POST'])
+def parking_log_bulk_submit(request):
+    serializer = BulkParkingLogSerializer(data=request.data)
+
+    if serializer.is_valid(raise_exception=True):
+        if spool_enabled():
+            return Response(
+                serializer.spool(),
+                status=status.HTTP_202_ACCEPTED
+            )
+        result = serializer.save()
+        return Response(
+            result,
+            status=status.HTTP_201_CREATED
+        )
+
+# in-process cache and queue statistics, used to size them
+@api_view(['GET'])
+def metrics(request):
+    data = {
+        'device_registry': device_registry.stats(),
+    }
+    if spool_enabled():
+        data['spool'] = spool.stats()
+    if writer_enabled():
+        data['writer'] = db_writer.stats()
+    return Response(data)
\ No newline at end of file
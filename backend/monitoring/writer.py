@@ -0,0 +1,173 @@
+import atexit
+import logging
+import queue
+import threading
+import time
+from collections import defaultdict
+from concurrent.futures import Future, TimeoutError as FutureTimeout
+from django.conf import settings
+from django.db import connection, transaction
+
+logger = logging.getLogger(__name__)
+
+
+class WriterTimeout(Exception):
+    """The writer thread did not commit an item in time, the views answer
+    503. The item is dropped if still queued, a write already running may
+    still commit.
+    """
+
+
+class WriteQueue:
+    """Single writer thread for the single-item ingestion views.
+
+    SQLite lets one connection write at a time, so with a transaction per
+    request concurrent requests queue on the database lock, retry, and each
+    pays for its own commit. With INGEST_MODE = "writer" the views hand
+    their item to this thread instead and wait on a Future. The thread
+    takes everything queued meanwhile, up to `max_batch` items, passes the
+    items of each write function to it as one list and commits them all in
+    one transaction. The futures resolve once that commit is done, so a
+    201 still means the data is stored. A request waits at most `timeout`
+    seconds, a dead or stalled writer fails requests instead of hanging
+    them.
+
+    A write function takes a list of items and returns one result per
+    item; an exception instance in the list fails that item's request. If
+    the function raises, its items are retried one by one in savepoints so
+    one bad item only fails itself.
+    """
+
+    def __init__(self, max_batch=200, timeout=30.0):
+        self.max_batch = max_batch
+        self.timeout = timeout
+        self._queue = queue.SimpleQueue()
+        self._lock = threading.Lock()
+        self._thread = None
+        self._exit_hook = False
+        self._batches = 0
+        self._writes = 0
+        self._failed = 0
+        self._busy = 0.0
+
+    def submit(self, function, item):
+        """Queue item for function, returns a Future of its result"""
+        future = Future()
+        with self._lock:
+            if self._thread is None:
+                self._start()
+        self._queue.put((future, function, item))
+        return future
+
+    def run(self, function, item, timeout=None):
+        """submit() and wait for the result, raising what the write raised,
+        or WriterTimeout after `timeout` seconds (self.timeout by default)
+        """
+        future = self.submit(function, item)
+        try:
+            return future.result(self.timeout if timeout is None else timeout)
+        except FutureTimeout:
+            future.cancel()
+            raise WriterTimeout('The database writer did not answer in time.') from None
+
+    def stats(self):
+        with self._lock:
+            return {
+                'queued': self._queue.qsize(),
+                'batches': self._batches,
+                'writes': self._writes,
+                'failed': self._failed,
+                'average_batch': round(self._writes / self._batches, 1) if self._batches else 0,
+                'busy_seconds': round(self._busy, 3),
+            }
+
+    def stop(self):
+        with self._lock:
+            thread, self._thread = self._thread, None
+        if thread is not None:
+            self._queue.put(None)
+            thread.join(timeout=30)
+
+    def _start(self):
+        self._thread = threading.Thread(target=self._run, name='ingest-writer', daemon=True)
+        self._thread.start()
+        if not self._exit_hook:
+            # queued writes are committed when the worker shuts down
+            atexit.register(self.stop)
+            self._exit_hook = True
+
+    def _run(self):
+        stopping = False
+        while not stopping:
+            batch = [self._queue.get()]
+            # everything that queued up during the previous commit
+            while len(batch) < self.max_batch:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            if None in batch:
+                stopping = True
+                batch = [entry for entry in batch if entry is not None]
+            batch = [entry for entry in batch if entry[0].set_running_or_notify_cancel()]
+            if batch:
+                self._write(batch)
+        connection.close()
+
+    def _write(self, batch):
+        started = time.monotonic()
+        groups = defaultdict(list)
+        for entry in batch:
+            groups[entry[1]].append(entry)
+
+        outcomes = []
+        try:
+            with transaction.atomic():
+                for function, entries in groups.items():
+                    futures = [future for future, _, _ in entries]
+                    outcomes += zip(futures, self._call(function, [item for _, _, item in entries]))
+        except Exception as e:
+            # the commit itself failed, nothing in the batch is stored
+            logger.exception('Writer batch of %d failed', len(batch))
+            connection.close_if_unusable_or_obsolete()
+            outcomes = [(future, e) for future, _, _ in batch]
+
+        failed = 0
+        for future, outcome in outcomes:
+            if isinstance(outcome, Exception):
+                failed += 1
+                future.set_exception(outcome)
+            else:
+                future.set_result(outcome)
+        with self._lock:
+            self._batches += 1
+            self._writes += len(batch)
+            self._failed += failed
+            self._busy += time.monotonic() - started
+
+    def _call(self, function, items):
+        try:
+            with transaction.atomic():
+                return function(items)
+        except Exception as e:
+            if len(items) == 1:
+                return [e]
+        # one bad item fails the whole call, find it
+        results = []
+        for item in items:
+            try:
+                with transaction.atomic():
+                    results += function([item])
+            except Exception as e:
+                results.append(e)
+        return results
+
+
+def writer_enabled():
+    return getattr(settings, 'INGEST_MODE', 'sync') == 'writer'
+
+
+db_writer = WriteQueue(
+    max_batch=getattr(settings, 'INGEST_WRITER_MAX_BATCH', 200),
+    timeout=getattr(settings, 'INGEST_WRITER_TIMEOUT', 30.0),
+)
@@ -1,19 +1,24 @@
 import React, { useState, useEffect } from 'react';
-import { alertAPI } from '../services/api';
+import { alertAPI, openAlertStream } from '../services/api';
 import { format } from 'date-fns';
 import { SEVERITY_COLORS, POLLING_INTERVAL } from '../config';
 import './AlertPanel.css';
 
 function AlertPanel() {
   const [alerts, setAlerts] = useState([]);
+  const [olderAlerts, setOlderAlerts] = useState([]);
+  const [nextPage, setNextPage] = useState(undefined);
   const [filter, setFilter] = useState('all');
   const [loading, setLoading] = useState(true);
 
+  // polling refreshes the first page only, older pages stay as loaded
   const fetchAlerts = async () => {
     try {
       const params = filter !== 'all' ? { severity: filter } : {};
       const response = await alertAPI.getAlerts(params);
-      setAlerts(response.data);
+      setAlerts(response.data.results);
+      // undefined until the first page arrives, null once every page is loaded
+      setNextPage(next => next === undefined ? response.data.next : next);
     } catch (error) {
       console.error('Failed to fetch alerts:', error);
     } finally {
@@ -21,10 +26,55 @@ function AlertPanel() {
     }
   };
 
+  const loadMore = async () => {
+    try {
+      const response = await alertAPI.getPage(nextPage);
+      setOlderAlerts(older => [...older, ...response.data.results]);
+      setNextPage(response.data.next);
+    } catch (error) {
+      console.error('Failed to fetch alerts:', error);
+    }
+  };
+
   useEffect(() => {
+    setOlderAlerts([]);
+    setNextPage(undefined);
     fetchAlerts();
-    const interval = setInterval(fetchAlerts, POLLING_INTERVAL);
-    return () => clearInterval(interval);
+
+    // refetch when the server pushes a change, poll while the stream is
+    // down and for good once it is refused (501 when the API runs under WSGI)
+    let interval = setInterval(fetchAlerts, POLLING_INTERVAL);
+    let refresh = null;
+    const stream = openAlertStream();
+    if (stream) {
+      stream.onopen = () => {
+        clearInterval(interval);
+        interval = null;
+        fetchAlerts();
+      };
+      stream.onerror = () => {
+        // CLOSED: the server answered with an error, EventSource gives up
+        if (stream.readyState === EventSource.CLOSED) stream.close();
+        if (!interval) interval = setInterval(fetchAlerts, POLLING_INTERVAL);
+      };
+      // one refetch for a burst of events
+      const scheduleRefresh = () => {
+        if (!refresh) {
+          refresh = setTimeout(() => {
+            refresh = null;
+            fetchAlerts();
+          }, 500);
+        }
+      };
+      stream.addEventListener('created', scheduleRefresh);
+      stream.addEventListener('acknowledged', scheduleRefresh);
+    }
+
+    return () => {
+      if (stream) stream.close();
+      clearInterval(interval);
+      clearTimeout(refresh);
+    };
   }, [filter]);
 
   const handleAcknowledge = async (alertId) => {
@@ -36,7 +86,9 @@ function AlertPanel() {
     }
   };
 
-  const unacknowledgedAlerts = alerts.filter(a => !a.is_acknowledged);
+  const firstPageIds = new Set(alerts.map(a => a.id));
+  const shownAlerts = [...alerts, ...olderAlerts.filter(a => !firstPageIds.has(a.id))];
+  const unacknowledgedAlerts = shownAlerts.filter(a => !a.is_acknowledged);
 
   return (
     <div className="alert-panel">
@@ -59,10 +111,10 @@ function AlertPanel() {
         <div className="loading">Loading alerts...</div>
       ) : (
         <div className="alert-list">
-          {alerts.length === 0 ? (
+          {shownAlerts.length === 0 ? (
             <div className="no-alerts">No alerts found</div>
           ) : (
-            alerts.map(alert => (
+            shownAlerts.map(alert => (
               <div
                 key={alert.id}
                 className={`alert-item ${alert.severity.toLowerCase()} ${
@@ -95,6 +147,11 @@ function AlertPanel() {
               </div>
             ))
           )}
+          {nextPage && (
+            <button className="filter-btn" onClick={loadMore}>
+              Load older alerts
+            </button>
+          )}
         </div>
       )}
     </div>
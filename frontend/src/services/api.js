@@ -6,6 +6,36 @@ const api = axios.create({
   headers: {
     'Content-Type': 'application/json',
   },
+  validateStatus: (status) => (status >= 200 && status < 300) || status === 304,
+});
+
+// Conditional GETs: the last ETag and body per URL are kept, the server
+// answers 304 with an empty body when nothing changed and the cached body
+// is handed back instead.
+const etagCache = new Map();
+
+const cacheKey = (config) => api.getUri(config);
+
+api.interceptors.request.use((config) => {
+  if (config.method === 'get') {
+    const cached = etagCache.get(cacheKey(config));
+    if (cached) config.headers['If-None-Match'] = cached.etag;
+  }
+  return config;
+});
+
+api.interceptors.response.use((response) => {
+  const { config } = response;
+  if (config.method !== 'get') return response;
+
+  const key = cacheKey(config);
+  if (response.status === 304 && etagCache.has(key)) {
+    return { ...response, status: 200, data: etagCache.get(key).data };
+  }
+  if (response.headers.etag) {
+    etagCache.set(key, { etag: response.headers.etag, data: response.data });
+  }
+  return response;
 });
 
 export const telemetryAPI = {
@@ -15,15 +45,32 @@ export const telemetryAPI = {
 
 export const parkingAPI = {
   submitLog: (data) => api.post('/parking-log/', data),
+  bulkSubmitLogs: (data) => api.post('/parking-log/bulk/', data),
 };
 
 export const dashboardAPI = {
   getSummary: (date) => api.get('/dashboard/summary/', { params: { date } }),
 };
 
+export const analyticsAPI = {
+  // params: start, end (YYYY-MM-DD), bucket ('hour' | 'day'), zone
+  getOccupancy: (params) => api.get('/analytics/occupancy/', { params }),
+  // params: start, end (YYYY-MM-DD), zone
+  getEnergy: (params) => api.get('/analytics/energy/', { params }),
+  // params: start, end (ISO datetimes), points
+  getDeviceTelemetry: (deviceCode, params) =>
+    api.get(`/devices/${encodeURIComponent(deviceCode)}/telemetry/`, { params }),
+};
+
 export const alertAPI = {
   getAlerts: (params) => api.get('/alerts/', { params }),
+  getPage: (url) => api.get(url),
   acknowledge: (id) => api.patch(`/alerts/${id}/acknowledge/`),
 };
 
+// Server-Sent Events feed of alert changes, served by the ASGI app (501
+// under WSGI). null when the browser has no EventSource.
+export const openAlertStream = () =>
+  typeof EventSource === 'undefined' ? null : new EventSource(`${API_BASE_URL}/alerts/stream/`);
+
 export default api;
\ No newline at end of file